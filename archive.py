@@ -0,0 +1,322 @@
+import asyncio
+import concurrent.futures
+import gzip
+import json
+import logging
+import os
+import queue
+import threading
+import time
+
+import discord
+
+try:
+    import zstandard
+except ImportError:  # Optional; segments are gzip compressed without it.
+    zstandard = None
+
+log = logging.getLogger("autodelete.archive")
+
+EXTENSIONS = {"gzip": ".jsonl.gz", "zstd": ".jsonl.zst"}
+PART_SUFFIX = ".part"
+# Records kept per channel beyond its task's limit, for the messages that
+# push it over before the trim runs.
+RECORD_MARGIN = 100
+
+
+def message_record(message):
+    """What the archive keeps of a message until it is deleted."""
+    return {
+        "id": message.id,
+        "author_id": message.author.id,
+        "author": str(message.author),
+        "created_at": message.created_at.isoformat(),
+        "content": message.content,
+        "attachments": [attachment.url for attachment in message.attachments],
+    }
+
+
+def segment_range(name):
+    """The (first, last) message ids in a segment's file name, or None."""
+    stem = name.split(".", 1)[0]
+    first, _, last = stem.partition("-")
+    if not first.isdigit() or not last.isdigit():
+        return None
+    return int(first), int(last)
+
+
+class _Segment:
+    def __init__(self, directory, compression):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.compression = compression
+        self.path = os.path.join(directory, f"{time.time_ns()}{PART_SUFFIX}")
+        raw = open(self.path, "wb")
+        if compression == "zstd":
+            self.file = zstandard.ZstdCompressor().stream_writer(raw)
+        else:
+            self.file = gzip.GzipFile(fileobj=raw, mode="wb")
+        self.raw = raw
+        self.opened = time.monotonic()
+        self.size = 0
+        self.first = None
+        self.last = None
+
+    def write(self, record):
+        line = json.dumps(record, ensure_ascii=False).encode() + b"\n"
+        self.file.write(line)
+        self.size += len(line)
+        message_id = record["id"]
+        self.first = message_id if self.first is None else min(self.first, message_id)
+        self.last = message_id if self.last is None else max(self.last, message_id)
+
+    def close(self):
+        """Finish the file and give it its final name; returns that path."""
+        self.file.close()
+        if not self.raw.closed:
+            self.raw.close()
+        if self.first is None:
+            os.remove(self.path)
+            return None
+        path = os.path.join(
+            self.directory, f"{self.first}-{self.last}{EXTENSIONS[self.compression]}"
+        )
+        os.replace(self.path, path)
+        return path
+
+
+class SegmentWriter:
+    """Writes archive records to rotating compressed JSONL segments on a
+    background thread.
+
+    Every channel has its own directory and at most one open segment. A
+    segment is closed once ``segment_bytes`` of JSON went into it or it has
+    been open for ``segment_seconds``; closed segments are named after the
+    first and last message id they hold. Records are handed over through a
+    queue of at most ``queue_size`` entries, so a slow disk can't make the
+    bot buffer without bound: :meth:`submit` refuses records when it is
+    full.
+    """
+
+    def __init__(self, directory, compression, segment_bytes, segment_seconds, queue_size):
+        self.directory = directory
+        self.compression = compression
+        self.segment_bytes = segment_bytes
+        self.segment_seconds = segment_seconds
+        self.queue = queue.Queue(queue_size)
+        self.segments = {}
+        self.thread = None
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(
+                target=self._run, name="autodelete-archive", daemon=True
+            )
+            self.thread.start()
+
+    def channel_directory(self, guild_id, channel_id):
+        return os.path.join(self.directory, str(guild_id), str(channel_id))
+
+    def submit(self, guild_id, channel_id, record):
+        try:
+            self.queue.put_nowait(("write", (guild_id, channel_id), record))
+        except queue.Full:
+            return False
+        return True
+
+    def rotate(self, guild_id, channel_id):
+        """Close the channel's open segment; the returned future resolves
+        once everything submitted before is on disk."""
+        future = concurrent.futures.Future()
+        if self.thread is None:
+            future.set_result(None)
+            return future
+        try:
+            self.queue.put_nowait(("rotate", (guild_id, channel_id), future))
+        except queue.Full:
+            future.set_exception(RuntimeError("The archive queue is full."))
+        return future
+
+    def close(self):
+        """Write what is queued, close all segments and stop the thread."""
+        if self.thread is None:
+            return
+        self.queue.put(None)
+        self.thread.join()
+        self.thread = None
+
+    def _run(self):
+        while True:
+            try:
+                item = self.queue.get(timeout=min(self.segment_seconds, 60.0))
+            except queue.Empty:
+                self._close_stale()
+                continue
+            if item is None:
+                break
+            kind, key, value = item
+            try:
+                if kind == "write":
+                    self._write(key, value)
+                else:
+                    self._close(key)
+                    value.set_result(None)
+            except Exception as e:
+                log.exception("Archive write failed", extra={"channel_id": key[1]})
+                if kind == "rotate":
+                    value.set_exception(e)
+            self._close_stale()
+        for key in list(self.segments):
+            self._close(key)
+
+    def _write(self, key, record):
+        segment = self.segments.get(key)
+        if segment is None:
+            segment = self.segments[key] = _Segment(
+                self.channel_directory(*key), self.compression
+            )
+        segment.write(record)
+        if segment.size >= self.segment_bytes:
+            self._close(key)
+
+    def _close(self, key):
+        segment = self.segments.pop(key, None)
+        if segment is not None:
+            path = segment.close()
+            if path is not None:
+                log.debug("Closed archive segment", extra={"channel_id": key[1], "path": path})
+
+    def _close_stale(self):
+        now = time.monotonic()
+        for key, segment in list(self.segments.items()):
+            if now - segment.opened >= self.segment_seconds:
+                self._close(key)
+
+
+class Archive:
+    """Records deleted messages of channels whose task has ``archive`` set.
+
+    The content of those channels' messages is kept in memory from the
+    time the bot sees them until they are deleted or leave the channel.
+    Each channel keeps at most its task's limit plus ``RECORD_MARGIN``
+    records, and never more than ``max_records``; the oldest are evicted
+    and read again from the channel before they are deleted (see
+    :meth:`missing`). Messages the bot deletes are then handed to a
+    :class:`SegmentWriter`; if its queue is full they are counted in
+    ``dropped`` instead, so archiving never holds up a trim.
+    """
+
+    def __init__(
+        self, directory, compression, segment_bytes, segment_seconds, queue_size, max_records
+    ):
+        if compression not in EXTENSIONS:
+            raise ValueError(f"Unknown archive compression: {compression}")
+        if compression == "zstd" and zstandard is None:
+            log.warning("zstandard is not installed; archiving with gzip instead.")
+            compression = "gzip"
+        self.records = {}
+        self.max_records = max_records
+        self.writer = SegmentWriter(
+            directory, compression, segment_bytes, segment_seconds, queue_size
+        )
+        self.archived = 0
+        self.dropped = 0
+
+    def start(self):
+        self.writer.start()
+
+    def remember(self, message, limit):
+        """Keep ``message``'s record, evicting the channel's oldest beyond
+        what its task's ``limit`` needs."""
+        records = self.records.setdefault(message.channel.id, {})
+        records[message.id] = message_record(message)
+        if len(records) > min(limit + RECORD_MARGIN, self.max_records):
+            del records[next(iter(records))]
+
+    def missing(self, channel_id, message_ids):
+        """The ids among ``message_ids`` without a record."""
+        records = self.records.get(channel_id, {})
+        return [message_id for message_id in message_ids if message_id not in records]
+
+    def update(self, channel_id, message_id, data):
+        """Apply an edit's new content and attachments to a kept record."""
+        record = self.records.get(channel_id, {}).get(message_id)
+        if record is None:
+            return
+        if "content" in data:
+            record["content"] = data["content"]
+        if "attachments" in data:
+            record["attachments"] = [attachment["url"] for attachment in data["attachments"]]
+
+    def discard(self, channel_id, message_ids):
+        records = self.records.get(channel_id)
+        if records:
+            for message_id in message_ids:
+                records.pop(message_id, None)
+
+    def forget_channel(self, channel_id):
+        self.records.pop(channel_id, None)
+
+    def take(self, channel_id, message_ids):
+        """Remove and return the records of messages about to be deleted.
+
+        They are taken before the delete call, so the gateway's delete
+        event can't discard them first. Pass them to :meth:`write` once the
+        messages are gone, or back to :meth:`restore` if the call failed.
+        """
+        records = self.records.get(channel_id)
+        if not records:
+            return []
+        return [
+            record
+            for record in (records.pop(message_id, None) for message_id in message_ids)
+            if record is not None
+        ]
+
+    def restore(self, channel_id, records):
+        if records:
+            kept = self.records.setdefault(channel_id, {})
+            for record in records:
+                kept[record["id"]] = record
+
+    def write(self, guild_id, channel_id, records):
+        """Queue the records of deleted messages; returns how many were queued."""
+        if not records:
+            return 0
+        deleted_at = discord.utils.utcnow().isoformat()
+        queued = 0
+        for record in records:
+            record["deleted_at"] = deleted_at
+            if self.writer.submit(guild_id, channel_id, record):
+                queued += 1
+            else:
+                self.dropped += 1
+                if self.dropped % 1000 == 1:
+                    log.warning(
+                        "Archive queue full, dropping records",
+                        extra={"channel_id": channel_id, "dropped": self.dropped},
+                    )
+        self.archived += queued
+        return queued
+
+    async def segments(self, guild_id, channel_id, since_id=0):
+        """Paths of the channel's segments with messages from ``since_id``
+        on, oldest first. The open segment is closed first so it is
+        included."""
+        await asyncio.wrap_future(self.writer.rotate(guild_id, channel_id))
+        directory = self.writer.channel_directory(guild_id, channel_id)
+        try:
+            names = os.listdir(directory)
+        except FileNotFoundError:
+            return []
+        found = []
+        for name in names:
+            if name.endswith(PART_SUFFIX):
+                continue
+            ids = segment_range(name)
+            if ids is not None and ids[1] >= since_id:
+                found.append((ids, os.path.join(directory, name)))
+        return [path for _, path in sorted(found)]
+
+    async def close(self):
+        await asyncio.get_running_loop().run_in_executor(None, self.writer.close)
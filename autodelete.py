@@ -1,729 +1,2692 @@
-import discord
-from discord import app_commands
-from discord.ext import commands
-import json
-import asyncio
-import subprocess
-import sys
-from dotenv import load_dotenv
-import os
-
-load_dotenv()
-
-DISCORD_TOKEN = os.getenv("DISCORD_TOKEN")
-STATUS_TEXT = os.getenv("BOT_STATUS", "AutoDeleteBot")
-CONFIG_FILE = "autodelete_config.json"
-
-intents = discord.Intents.default()
-intents.message_content = True
-intents.messages = True
-intents.members = True
-intents.reactions = True
-activity = discord.CustomActivity(name=STATUS_TEXT)
-
-
-class AutoDeleteBot(commands.Bot):
-    def __init__(self):
-        super().__init__(command_prefix="/", intents=intents, activity=activity)
-        self.data_file = CONFIG_FILE
-        self.config = self.load_config()
-
-    def load_config(self):
-        try:
-            with open(self.data_file, "r") as f:
-                config = json.load(f)
-                self.deleted_message_count = config.get("deleted_message_count", {})
-                return config
-        except (FileNotFoundError, json.JSONDecodeError):
-            self.deleted_message_count = {}
-            return {"management_roles": {}}
-
-    def get_management_roles(self, guild_id):
-        return self.config.get("management_roles", {}).get(str(guild_id), [])
-
-    def set_management_roles(self, guild_id, role_ids):
-        if "management_roles" not in self.config:
-            self.config["management_roles"] = {}
-        self.config["management_roles"][str(guild_id)] = role_ids
-        self.save_config()
-        print(json.dumps(self.config, indent=4))
-
-    def save_config(self):
-        self.config["deleted_message_count"] = self.deleted_message_count
-        with open(self.data_file, "w") as f:
-            json.dump(self.config, f, indent=4)
-
-    def get_channel_config(self, channel_id):
-        return self.config.get(
-            str(channel_id),
-            {"limit": None, "pins": False, "embeds": False, "enabled": True},
-        )
-
-    def increment_deleted_messages(self, channel_id, count):
-        if channel_id not in self.deleted_message_count:
-            self.deleted_message_count[channel_id] = 0
-        self.deleted_message_count[channel_id] += count
-        self.save_config()
-
-
-bot = AutoDeleteBot()
-semaphore = asyncio.Semaphore(1)
-autodelete_group = app_commands.Group(name="autodelete", description="Required prefix.")
-
-
-@bot.event
-async def on_member_update(before, after):
-    target_role_name = "LOCK"
-    added_roles = [role for role in after.roles if role not in before.roles]
-
-    for role in added_roles:
-        print(f"Added role: {role.name}")
-        if role.name == target_role_name:
-            # Send a message in a specific channel
-            channel_id = 1146950830461816832  # Replace with your channel ID
-            channel = after.guild.get_channel(channel_id)
-            if channel:
-                await channel.send(
-                    f"Why don't you have a seat right over here {after.mention}  "
-                )
-
-
-@bot.event
-async def on_ready():
-    print(f"Logged in as {bot.user}")
-
-    if "--restarted" in sys.argv:
-        channel_id_arg = next(
-            (arg for arg in sys.argv if arg.startswith("--channel=")), None
-        )
-        message_id_arg = next(
-            (arg for arg in sys.argv if arg.startswith("--message=")), None
-        )
-
-        if channel_id_arg and message_id_arg:
-            channel_id = int(channel_id_arg.split("=")[1])
-            message_id = int(message_id_arg.split("=")[1])
-
-            channel = bot.get_channel(channel_id)
-            if channel:
-                try:
-                    message = await channel.fetch_message(message_id)
-                    embed = discord.Embed(
-                        title="Restart Successful",
-                        description="The bot has restarted and is now online.",
-                        color=discord.Color.green(),
-                    )
-                    await message.edit(embed=embed)
-
-                except Exception as e:
-                    print(f"Failed to edit the restart message: {e}")
-
-        sys.argv.remove("--restarted")
-        if channel_id_arg:
-            sys.argv.remove(channel_id_arg)
-        if message_id_arg:
-            sys.argv.remove(message_id_arg)
-    await bot.tree.sync(guild=None)
-    print("Ready")
-
-
-@bot.event
-async def on_raw_reaction_add(payload):
-    if payload.member.id == bot.user.id:
-        return
-    if payload.message_author_id != bot.user.id:
-        return
-    if str(payload.emoji) == "❌":
-        channel = bot.get_channel(payload.channel_id)
-        message = await channel.fetch_message(payload.message_id)
-        await message.delete()
-    if str(payload.emoji) == "🔄":
-        embed = generate_stats_embed(payload.guild_id, bot)
-        channel = bot.get_channel(payload.channel_id)
-        message = await channel.fetch_message(payload.message_id)
-        await message.remove_reaction(payload.emoji, payload.member)
-        await message.edit(embed=embed)
-        await message.add_reaction("🔄")
-
-
-@bot.event
-async def on_message(message):
-    if not message.guild:
-        return
-    if message.author.bot:
-        return
-
-    async with semaphore:
-        channel_id = str(message.channel.id)
-        if channel_id in bot.config:
-            channel_config = bot.get_channel_config(channel_id)
-            if not channel_config.get("enabled", True):
-                return
-
-            limit = channel_config["limit"]
-            pins = channel_config["pins"]
-            embeds = channel_config["embeds"]
-
-            try:
-                messages = []
-                async for msg in message.channel.history(limit=None):
-                    if not pins and msg.pinned:
-                        continue
-                    if not embeds and (msg.author.bot and msg.embeds):
-                        continue
-                    messages.append(msg)
-
-                current_message_count = len(messages)
-                discrepancy = current_message_count - limit
-
-                print(
-                    f"[DEBUG] Channel: {message.channel.name} (ID: {channel_id}) | "
-                    f"Messages Found: {current_message_count} | Limit: {limit} | "
-                    f"Discrepancy: {discrepancy if discrepancy > 0 else 0}"
-                )
-                if discrepancy > 0:
-                    to_delete = messages[limit:]
-                    for msg in to_delete:
-                        print(
-                            f"[ACTION] Deleting message from '{msg.author}': {msg.content} "
-                            f"(Message ID: {msg.id})"
-                        )
-                        await msg.delete()
-                        await asyncio.sleep(0.5)
-                    print(
-                        f"[INFO] Deleted {len(to_delete)} messages in channel '{message.channel.name}'."
-                    )
-                    print()
-                    bot.increment_deleted_messages(channel_id, len(to_delete))
-
-            except discord.Forbidden:
-                print(
-                    f"[ERROR] Missing permissions to manage messages in channel '{message.channel.name}' (ID: {channel_id})."
-                )
-            except discord.HTTPException as e:
-                print(f"[ERROR] HTTP exception: {e}")
-
-
-
-async def check_role(interaction: discord.Interaction):
-    guild = interaction.guild
-    if not guild:
-        embed = discord.Embed(
-            title="Invalid",
-            description="This command cannot be used here.",
-            color=discord.Color.red(),
-        )
-        await interaction.response.send_message(embed=embed)
-        message = await interaction.original_response()
-        await message.add_reaction("❌")
-        return False
-
-    required_roles = bot.get_management_roles(guild.id)
-    if not required_roles:
-        embed = discord.Embed(
-            title="Setup",
-            description=(
-                "No management roles have been set for this server.\n"
-                "Use `/autodelete setup` to set roles required to use the bot."
-            ),
-            color=discord.Color.orange(),
-        )
-        await interaction.response.send_message(embed=embed)
-        message = await interaction.original_response()
-        await message.add_reaction("❌")
-        return False
-
-    if not any(
-        discord.utils.get(guild.roles, id=int(role_id)) in interaction.user.roles
-        for role_id in required_roles
-    ):
-        embed = discord.Embed(
-            title="Setup",
-            description="You don't have any of the required management roles to use this command.",
-            color=discord.Color.red(),
-        )
-        await interaction.response.send_message(embed=embed)
-        message = await interaction.original_response()
-        await message.add_reaction("❌")
-        return False
-
-    return True
-
-
-@autodelete_group.command(name="restart", description="Restarts the bot.")
-async def restart(interaction: discord.Interaction):
-    """Restarts the bot."""
-    if not await check_role(interaction):
-        return
-
-    embed = discord.Embed(
-        title="Restarting",
-        description="The bot is restarting... Please wait a moment.",
-        color=discord.Color.orange(),
-    )
-    await interaction.response.defer()
-    await interaction.followup.send(embed=embed)
-    message = await interaction.original_response()
-    await message.add_reaction("❌")
-
-    channel_id = interaction.channel.id
-    message_id = message.id
-
-    new_argv = (
-        [sys.executable]
-        + sys.argv
-        + ["--restarted", f"--channel={channel_id}", f"--message={message_id}"]
-    )
-
-    subprocess.Popen(new_argv, shell=True)
-
-    await bot.close()
-
-
-@autodelete_group.command(
-    name="setup", description="Set the management roles required to use the bot."
-)
-@app_commands.describe(
-    roles="Mention all roles required to manage the bot, separated by spaces."
-)
-async def setup(interaction: discord.Interaction, roles: str):
-    guild = interaction.guild
-    if not guild:
-        embed = discord.Embed(
-            title="Error",
-            description="This command must be used in a server.",
-            color=discord.Color.red(),
-        )
-        await interaction.response.send_message(embed=embed)
-        message = await interaction.original_response()
-        await message.add_reaction("❌")
-        return
-
-    role_ids = []
-    for role_str in roles.split():
-        if role_str.startswith("<@&") and role_str.endswith(">"):
-            try:
-                role_id = int(role_str[3:-1])
-                role = guild.get_role(role_id)
-                if role:
-                    role_ids.append(role_id)
-            except ValueError:
-                pass
-
-    if not role_ids:
-        embed = discord.Embed(
-            title="Error",
-            description="No valid roles were provided.",
-            color=discord.Color.red(),
-        )
-        await interaction.response.send_message(embed=embed)
-        message = await interaction.original_response()
-        await message.add_reaction("❌")
-        return
-
-    bot.set_management_roles(interaction.guild_id, role_ids)
-    embed = discord.Embed(
-        title="Roles Set",
-        description=f"The following roles have been set: {', '.join([f'<@&{role_id}>' for role_id in role_ids])}",
-        color=discord.Color.green(),
-    )
-    await interaction.response.send_message(embed=embed)
-    message = await interaction.original_response()
-    await message.add_reaction("❌")
-
-@autodelete_group.command(name="add", description="Add a new task.")
-@app_commands.describe(
-    channel="The channel to configure.",
-    limit="Maximum number of messages allowed.",
-    pins="Delete pinned messages.",
-    embeds="Delete bot embeds.",
-    enabled="Enable or disable the task.",
-)
-async def add(
-    interaction: discord.Interaction,
-    channel: discord.TextChannel,
-    limit: int,
-    pins: bool = False,
-    embeds: bool = False,
-    enabled: bool = True,
-):
-    if not await check_role(interaction):
-        return
-    guild = interaction.guild
-    bot.config[str(channel.id)] = {
-        "limit": limit,
-        "pins": pins,
-        "embeds": embeds,
-        "enabled": enabled,
-        "guild": guild.id,
-    }
-    bot.save_config()
-    embed = discord.Embed(
-        title="Task added",
-        description=(
-            f"A task has been added for {channel.mention}.\n\n"
-            f"Enabled: `{'Yes' if enabled else 'No'}`\n"
-            f"Message Limit: `{limit}`\n"
-            f"Delete Pins: `{'Yes' if pins else 'No'}`\n"
-            f"Delete Embeds: `{'Yes' if embeds else 'No'}`"
-        ),
-        color=discord.Color.green(),
-    )
-    await interaction.response.send_message(embed=embed)
-    message = await interaction.original_response()
-    await message.add_reaction("❌")
-
-@autodelete_group.command(name="remove", description="Remove a task.")
-@app_commands.describe(channel="The channel name the task should be removed from.")
-async def remove(interaction: discord.Interaction, channel: discord.TextChannel):
-    if not await check_role(interaction):
-        return
-    if str(channel.id) in bot.config:
-        del bot.config[str(channel.id)]
-        bot.save_config()
-        embed = discord.Embed(
-            title="Task removed",
-            description=f"A task has been removed for {channel.mention}.",
-            color=discord.Color.red(),
-        )
-        await interaction.response.send_message(embed=embed)
-    else:
-        embed = discord.Embed(
-            title="No task",
-            description=f"No task was found for {channel.mention}.",
-            color=discord.Color.orange(),
-        )
-        await interaction.response.send_message(embed=embed)
-    message = await interaction.original_response()
-    await message.add_reaction("❌")
-
-@autodelete_group.command(name="list", description="View all existing tasks.")
-async def list(interaction: discord.Interaction):
-    if not await check_role(interaction):
-        return
-
-    tasks = [
-        (channel_id, config)
-        for channel_id, config in bot.config.items()
-        if channel_id != "management_roles"
-        and config.get("guild") == interaction.guild_id
-    ]
-
-    if not tasks:
-        embed = discord.Embed(
-            title="No tasks",
-            description="There are no available tasks.\nUse `/autodelete` to `add`, `remove`, or `edit` a task.\nUse `/autodelete help` for a list of commands.",
-            color=discord.Color.orange(),
-        )
-        await interaction.response.send_message(embed=embed)
-        message = await interaction.original_response()
-        await message.add_reaction("❌")
-        return
-
-    entries_per_page = 5
-    total_pages = (len(tasks) + entries_per_page - 1) // entries_per_page
-    current_page = 0
-
-    def create_embed(page):
-        start_idx = page * entries_per_page
-        end_idx = start_idx + entries_per_page
-        page_tasks = tasks[start_idx:end_idx]
-
-        embed = discord.Embed(
-            title=f"Tasks (Page {page + 1}/{total_pages})",
-            description="Use  `/autodelete` to `add`, `remove`, or `edit` a task.\n\n",
-            color=discord.Color.green(),
-        )
-
-        for channel_id, config in page_tasks:
-            channel = bot.get_channel(int(channel_id))
-            if channel:
-                task_info = (
-                    f"Enabled: `{'Yes' if config.get('enabled', True) else 'No'}`\n"
-                    f"Message Limit: `{config.get('limit', 'Not Set')}`\n"
-                    f"Delete Pins: `{'Yes' if config.get('pins', False) else 'No'}`\n"
-                    f"Delete Embeds: `{'Yes' if config.get('embeds', False) else 'No'}`"
-                )
-                embed.add_field(
-                    name=f"{start_idx + page_tasks.index((channel_id, config)) + 1} - {channel.mention}",
-                    value=task_info,
-                    inline=False,
-                )
-
-        return embed
-
-    embed = create_embed(current_page)
-    await interaction.response.send_message(embed=embed)
-    message = await interaction.original_response()
-
-    if total_pages > 1:
-        await message.add_reaction("◀️")
-        await message.add_reaction("▶️")
-        await message.add_reaction("❌")
-
-        def check(reaction, user):
-            return (
-                str(reaction.emoji) in ["◀️", "▶️", "❌"]
-                and reaction.message.id == message.id
-            )
-
-    while True:
-        try:
-            reaction, user = await bot.wait_for("reaction_add", check=check)
-            if str(reaction.emoji) == "❌":
-                await message.delete()
-                break
-            if str(reaction.emoji) == "◀️" and current_page > 0:
-                current_page -= 1
-            elif str(reaction.emoji) == "▶️" and current_page < total_pages - 1:
-                current_page += 1
-            embed = create_embed(current_page)
-            await message.edit(embed=embed)
-            await message.remove_reaction(reaction.emoji, user)
-        except asyncio.TimeoutError:
-            await message.clear_reactions()
-            break
-
-
-def generate_stats_embed(guild_id: int, bot: AutoDeleteBot) -> discord.Embed:
-    server_tasks = [
-        config
-        for channel_id, config in bot.config.items()
-        if channel_id != "management_roles" and config.get("guild") == guild_id
-    ]
-
-    total_tasks = len(server_tasks)
-    active_tasks = sum(1 for task in server_tasks if task.get("enabled", True))
-    inactive_tasks = total_tasks - active_tasks
-    management_roles = bot.get_management_roles(guild_id)
-
-    if management_roles:
-        roles_mentions = ", ".join(f"<@&{role_id}>" for role_id in management_roles)
-    else:
-        roles_mentions = "None"
-
-    deleted_counts = []
-    combined_total = 0
-    for channel_id, count in bot.deleted_message_count.items():
-        channel = bot.get_channel(int(channel_id))
-        if channel and channel.guild.id == guild_id:
-            deleted_counts.append(f"{channel.mention}: `{count}`")
-            combined_total += count
-
-    description = (
-        f"Total tasks: `{total_tasks}`\n"
-        f"Active tasks: `{active_tasks}`\n"
-        f"Inactive tasks: `{inactive_tasks}`\n"
-        f"Management roles: {roles_mentions}\n\n"
-        f"Deleted messages per channel:\n\n" + "\n".join(deleted_counts) + "\n\n"
-        f"Total deleted messages: `{combined_total}`"
-    )
-
-    return discord.Embed(
-        title="Statistics", description=description, color=discord.Color.brand_green()
-    )
-
-
-@autodelete_group.command(name="edit", description="Edit an existing task.")
-@app_commands.describe(
-    channel="The channel whose task you want to edit.",
-    limit="The new limit for ",
-    pins="Toggle deleting pinned messages.",
-    embeds="Toggle deleting bot embeds.",
-    enabled="Enable or disable the task.",
-)
-async def edit(
-    interaction: discord.Interaction,
-    channel: discord.TextChannel,
-    limit: int = None,
-    pins: bool = None,
-    embeds: bool = None,
-    enabled: bool = None,
-):
-    if not await check_role(interaction):
-        return
-
-    if str(channel.id) not in bot.config:
-        embed = discord.Embed(
-            title="Task not found",
-            description=f"Coudn't find a task for {channel.mention}.",
-            color=discord.Color.orange(),
-        )
-        await interaction.response.send_message(embed=embed)
-        message = await interaction.original_response()
-        await message.add_reaction("❌")
-        return
-
-    if limit is not None:
-        bot.config[str(channel.id)]["limit"] = limit
-    if pins is not None:
-        bot.config[str(channel.id)]["pins"] = pins
-    if embeds is not None:
-        bot.config[str(channel.id)]["embeds"] = embeds
-    if enabled is not None:
-        bot.config[str(channel.id)]["enabled"] = enabled
-
-    bot.save_config()
-    embed = discord.Embed(
-        title="Task updated",
-        description=f"The task for {channel.mention} has been updated.\n\n"
-        f"Enabled: `{'Yes' if bot.config[str(channel.id)].get('enabled') else 'No'}`\n"
-        f"Message Limit: `{bot.config[str(channel.id)].get('limit', 'Unchanged')}`\n"
-        f"Delete Pins: `{'Yes' if bot.config[str(channel.id)].get('pins') else 'No'}`\n"
-        f"Delete Embeds: `{'Yes' if bot.config[str(channel.id)].get('embeds') else 'No'}`",
-        color=discord.Color.green(),
-    )
-    await interaction.response.send_message(embed=embed)
-    message = await interaction.original_response()
-    await message.add_reaction("❌")
-
-@autodelete_group.command(
-    name="stats", description="View this server's bot statistics."
-)
-async def stats(interaction: discord.Interaction):
-    if not await check_role(interaction):
-        return
-
-    embed = generate_stats_embed(interaction.guild.id, bot)
-    await interaction.response.send_message(embed=embed)
-    message = await interaction.original_response()
-    await message.add_reaction("❌")
-    await message.add_reaction("🔄")
-
-
-@autodelete_group.command(
-    name="disable", description="Bulk disable all tasks for this server."
-)
-async def disable(interaction: discord.Interaction):
-    await toggle_all(interaction, False)
-
-
-@autodelete_group.command(
-    name="enable", description="Bulk enable all tasks for this server."
-)
-async def enable(interaction: discord.Interaction):
-    await toggle_all(interaction, True)
-
-
-async def toggle_all(interaction: discord.Interaction, enabled: bool):
-    if not await check_role(interaction):
-        return
-
-    affected_channels = []
-    for channel_id, config in bot.config.items():
-        if (
-            channel_id == "management_roles"
-            or config.get("guild") != interaction.guild_id
-        ):
-            continue
-        bot.config[channel_id]["enabled"] = enabled
-        affected_channels.append(channel_id)
-
-    bot.save_config()
-
-    embed = discord.Embed(
-        title=f"Tasks {'enabled' if enabled else 'disabled'}",
-        description=f"All tasks have been {'`enabled`' if enabled else '`disabled`'} for this server.",
-        color=discord.Color.green(),
-    )
-
-    await interaction.response.send_message(embed=embed)
-    message = await interaction.original_response()
-    await message.add_reaction("❌")
-
-@autodelete_group.command(
-    name="help", description="Displays a list of all available commands."
-)
-async def help(interaction: discord.Interaction):
-    """Displays a detailed list of all commands."""
-    if not await check_role(interaction):
-        return
-    embed = discord.Embed(
-        title="Commands",
-        description="Here is a list of all available commands:",
-        color=discord.Color.green(),
-    )
-
-    for command in bot.tree.walk_commands():
-        embed.add_field(
-            name=f"/{command.qualified_name}",
-            value=f"`{command.description}`",
-            inline=True,
-        )
-
-    await interaction.response.send_message(embed=embed)
-    message = await interaction.original_response()
-    await message.add_reaction("❌")
-
-@autodelete_group.command(name="purge", description="Purge all tasks for this server.")
-async def purge(interaction: discord.Interaction):
-    if not await check_role(interaction):
-        return
-
-    tasks_to_delete = [
-        channel_id
-        for channel_id, config in bot.config.items()
-        if channel_id != "management_roles"
-        and config.get("guild") == interaction.guild_id
-    ]
-
-    if not tasks_to_delete:
-        embed = discord.Embed(
-            title="No tasks",
-            description="There are no tasks added for this server.",
-            color=discord.Color.orange(),
-        )
-        await interaction.response.send_message(embed=embed)
-        message = await interaction.original_response()
-        await message.add_reaction("❌")
-        
-    class ConfirmPurgeModal(discord.ui.Modal):
-        def __init__(self):
-            super().__init__(title="Confirm")
-
-            self.add_item(
-                discord.ui.TextInput(
-                    label="Type 'YES' to confirm.",
-                    placeholder="YES",
-                    required=True,
-                    max_length=3,
-                )
-            )
-
-        async def on_submit(self, interaction: discord.Interaction):
-            if not await check_role(interaction):
-                return
-            if self.children[0].value != "YES":
-                await interaction.response.send_message(
-                    embed=discord.Embed(
-                        title="Purge cancelled",
-                        description="You did not confirm the action. Task purge has been cancelled.",
-                        color=discord.Color.green(),
-                    ),
-                    ephemeral=True,
-                )
-                return
-
-            for channel_id in tasks_to_delete:
-                del bot.config[channel_id]
-
-            bot.save_config()
-
-            success_embed = discord.Embed(
-                title="Purge finished",
-                description="All tasks for this server have been successfully purged.",
-                color=discord.Color.red(),
-            )
-
-            await interaction.response.send_message(embed=success_embed)
-            message = await interaction.original_response()
-            await message.add_reaction("❌")
-    await interaction.response.send_modal(ConfirmPurgeModal())
-
-
-bot.tree.add_command(autodelete_group)
-
-if DISCORD_TOKEN:
-    bot.run(DISCORD_TOKEN)
-else:
-    print("Error: DISCORD_TOKEN is not set in the .env file.")
+import discord
+from discord import app_commands
+from discord.ext import commands
+import asyncio
+import collections
+import datetime
+import hashlib
+import heapq
+import json
+import logging
+import math
+import sys
+import time
+from dotenv import load_dotenv
+import os
+
+from archive import Archive, message_record
+from logs import setup_logging
+from metrics import MetricsServer, Registry
+from models import ChannelTask
+from pacing import DeletionPacer, FairDeleteQueue, parse_guild_values
+from rules import TaskRules
+from storage import open_storage
+
+PROCESS_STARTED = time.monotonic()
+
+load_dotenv()
+
+DISCORD_TOKEN = os.getenv("DISCORD_TOKEN")
+STATUS_TEXT = os.getenv("BOT_STATUS", "AutoDeleteBot")
+MAX_CONCURRENT_TRIMS = int(os.getenv("MAX_CONCURRENT_TRIMS", "4"))
+TRIM_DEBOUNCE = float(os.getenv("TRIM_DEBOUNCE", "1.0"))
+RECONCILE_CONCURRENCY = int(os.getenv("RECONCILE_CONCURRENCY", "4"))
+RECONCILE_PRIORITY = os.getenv("RECONCILE_PRIORITY", "overflow")
+CONFIG_FILE = "autodelete_config.json"
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "sqlite")
+DATABASE_FILE = os.getenv("DATABASE_FILE", "autodelete.db")
+COUNTER_FLUSH_INTERVAL = float(os.getenv("COUNTER_FLUSH_INTERVAL", "30"))
+COUNTER_FLUSH_THRESHOLD = int(os.getenv("COUNTER_FLUSH_THRESHOLD", "100"))
+EPHEMERAL_RESPONSES = os.getenv("EPHEMERAL_RESPONSES", "false").lower() in ("1", "true", "yes")
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "1000"))
+LIST_TIMEOUT = float(os.getenv("LIST_TIMEOUT", "180"))
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR", "archive")
+ARCHIVE_COMPRESSION = os.getenv("ARCHIVE_COMPRESSION", "gzip")
+ARCHIVE_SEGMENT_BYTES = int(float(os.getenv("ARCHIVE_SEGMENT_MB", "16")) * 1024 * 1024)
+ARCHIVE_SEGMENT_SECONDS = float(os.getenv("ARCHIVE_SEGMENT_SECONDS", "3600"))
+ARCHIVE_QUEUE_SIZE = int(os.getenv("ARCHIVE_QUEUE_SIZE", "10000"))
+ARCHIVE_MAX_RECORDS = int(os.getenv("ARCHIVE_MAX_RECORDS", "2000"))
+EXPORT_MAX_FILES = 10
+LIST_PAGE_SIZE = 5
+
+BULK_DELETE_LIMIT = 100
+# Messages per history request, as discord.py reads them.
+HISTORY_PAGE_SIZE = 100
+# Discord rejects bulk deletes of messages older than 14 days; keep a margin.
+BULK_DELETE_MAX_AGE = datetime.timedelta(days=14) - datetime.timedelta(minutes=5)
+# Seconds past a held back message's min_age before the channel is trimmed
+# again, so the message is clear of the cutoff.
+MIN_AGE_RETRY_MARGIN = 1.0
+GLOBAL_DELETE_RATE = float(os.getenv("GLOBAL_DELETE_RATE", "25"))
+DELETE_RATE = float(os.getenv("DELETE_RATE", "2"))
+MAX_DELETE_RATE = float(os.getenv("MAX_DELETE_RATE", "10"))
+GUILD_WEIGHTS = parse_guild_values(os.getenv("GUILD_WEIGHTS", ""))
+GUILD_DELETE_QUOTA = float(os.getenv("GUILD_DELETE_QUOTA", "0"))
+GUILD_DELETE_QUOTAS = parse_guild_values(os.getenv("GUILD_DELETE_QUOTAS", ""))
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", "1.0"))
+# Set by launcher.py for each cluster process; leave unset to run a single
+# unsharded process.
+SHARD_COUNT = int(os.getenv("SHARD_COUNT", "0")) or None
+SHARD_IDS = [
+    int(shard_id) for shard_id in os.getenv("SHARD_IDS", "").split(",") if shard_id.strip()
+] or None
+CLUSTER_ID = os.getenv("CLUSTER_ID")
+GATEWAY_PROFILE = os.getenv("GATEWAY_PROFILE", "lean")
+MAX_MESSAGES = os.getenv("MAX_MESSAGES")
+EXTENSIONS = [name.strip() for name in os.getenv("EXTENSIONS", "").split(",") if name.strip()]
+
+
+def gateway_options(profile, max_messages=None):
+    """Intents and cache settings for the ``lean`` or ``full`` gateway profile.
+
+    ``lean`` subscribes to guild, guild message and reaction events only,
+    caches no members, skips member chunking and keeps a small message
+    cache; the bot works from raw events and its own message windows.
+    ``full`` is the original setup with the members intent and discord.py's
+    default caches, for extensions that need member updates.
+    """
+    if profile == "full":
+        intents = discord.Intents.default()
+        intents.message_content = True
+        intents.members = True
+        return {
+            "intents": intents,
+            "max_messages": 1000 if max_messages is None else int(max_messages),
+        }
+    if profile != "lean":
+        raise ValueError(f"Unknown gateway profile: {profile}")
+    intents = discord.Intents.none()
+    intents.guilds = True
+    intents.guild_messages = True
+    intents.guild_reactions = True
+    intents.message_content = True
+    return {
+        "intents": intents,
+        "member_cache_flags": discord.MemberCacheFlags.none(),
+        "chunk_guilds_at_startup": False,
+        "max_messages": 100 if max_messages is None else int(max_messages),
+    }
+
+
+activity = discord.CustomActivity(name=STATUS_TEXT)
+log = logging.getLogger("autodelete")
+
+metrics = Registry()
+HISTORY_SCAN_SECONDS = metrics.histogram(
+    "autodelete_history_scan_seconds", "Time spent reading a channel's history to seed its window."
+)
+HISTORY_PAGES = metrics.counter(
+    "autodelete_history_pages_total", "History pages fetched from the API."
+)
+DELETE_CALLS = metrics.counter(
+    "autodelete_delete_calls_total", "Delete API calls issued.", ["route"]
+)
+DELETE_SECONDS = metrics.histogram(
+    "autodelete_delete_seconds", "Latency of delete API calls, including pacing.", ["route"]
+)
+DELETED_MESSAGES = metrics.counter(
+    "autodelete_deleted_messages_total", "Messages deleted by trims."
+)
+TRIM_SECONDS = metrics.histogram(
+    "autodelete_trim_seconds", "Duration of trims that deleted messages."
+)
+TRIM_QUEUE_WAIT_SECONDS = metrics.histogram(
+    "autodelete_trim_queue_wait_seconds",
+    "Time between a channel being marked dirty and its trim starting.",
+)
+TRIM_LOCK_WAIT_SECONDS = metrics.histogram(
+    "autodelete_trim_lock_wait_seconds",
+    "Time a trim waited for its channel lock.",
+)
+TRIM_COALESCED = metrics.counter(
+    "autodelete_trim_coalesced_total",
+    "Trim requests folded into a trim of the same channel that had not started yet.",
+)
+DELETE_QUEUE_WAIT_SECONDS = metrics.histogram(
+    "autodelete_delete_queue_wait_seconds",
+    "Time a delete call waited for its turn in the fair delete queue.",
+)
+RATE_LIMITED = metrics.counter(
+    "autodelete_rate_limited_total", "Delete calls answered with a 429."
+)
+STORAGE_SECONDS = metrics.histogram(
+    "autodelete_storage_seconds", "Duration of storage operations.", ["operation"]
+)
+CHECK_ROLE_SECONDS = metrics.histogram(
+    "autodelete_check_role_seconds", "Duration of management role checks."
+)
+READY_SECONDS = metrics.histogram(
+    "autodelete_ready_seconds",
+    "Time from process start, or from a disconnect, until the bot was ready.",
+    ["kind"],
+    buckets=(1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0, 300.0),
+)
+
+
+def message_flags(message, task=None):
+    """Return the (pinned, bot_embed, exempt) flags the trim rules look at.
+
+    ``exempt`` is set for messages the task's filter rules keep.
+    """
+    exempt = task is not None and task.rules.exempts(message)
+    return message.pinned, bool(message.author.bot and message.embeds), exempt
+
+
+async def read_history(channel, **options):
+    """Iterate over ``channel.history(limit=None, **options)``, counting each
+    page in ``HISTORY_PAGES`` as it is fetched.
+
+    The history ends on a page shorter than ``HISTORY_PAGE_SIZE``, an empty
+    one when the messages fill the last page exactly.
+    """
+    count = 0
+    async for msg in channel.history(limit=None, **options):
+        if count % HISTORY_PAGE_SIZE == 0:
+            HISTORY_PAGES.inc()
+        count += 1
+        yield msg
+    if count % HISTORY_PAGE_SIZE == 0:
+        HISTORY_PAGES.inc()
+
+
+class MessageWindow:
+    """Index of the message ids currently in a channel, oldest first.
+
+    Every entry keeps the pinned, bot-embed and exempt flags of its
+    message, and the window counts the entries per combination of flags, so
+    the number of messages that count towards a task's limit is known from
+    at most eight combinations without walking the channel history.
+    """
+
+    def __init__(self):
+        self.entries = {}
+        self.combinations = collections.Counter()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def add(self, message_id, pinned=False, bot_embed=False, exempt=False):
+        if message_id in self.entries:
+            self.update(message_id, pinned, bot_embed, exempt)
+            return
+        newest = next(reversed(self.entries), None)
+        flags = (bool(pinned), bool(bot_embed), bool(exempt))
+        self.entries[message_id] = flags
+        self.combinations[flags] += 1
+        if newest is not None and message_id < newest:
+            # Snowflakes are time ordered; keep the window sorted if an
+            # event arrives out of order.
+            self.entries = dict(sorted(self.entries.items()))
+
+    def update(self, message_id, pinned=None, bot_embed=None, exempt=None):
+        flags = self.entries.get(message_id)
+        if flags is None:
+            return
+        new_flags = (
+            flags[0] if pinned is None else bool(pinned),
+            flags[1] if bot_embed is None else bool(bot_embed),
+            flags[2] if exempt is None else bool(exempt),
+        )
+        self.combinations[flags] -= 1
+        self.combinations[new_flags] += 1
+        self.entries[message_id] = new_flags
+
+    def remove(self, message_id):
+        flags = self.entries.pop(message_id, None)
+        if flags is not None:
+            self.combinations[flags] -= 1
+
+    def count(self, keeps):
+        """Number of messages that count towards the limit.
+
+        ``keeps(pinned, bot_embed, exempt)`` tells which messages the task
+        keeps, usually :meth:`ChannelTask.keeps`.
+        """
+        return sum(
+            count for flags, count in self.combinations.items() if not keeps(*flags)
+        )
+
+    def overflow(self, limit, keeps, before=None):
+        """Return the oldest countable message ids beyond ``limit``.
+
+        Messages with ids from ``before`` on are too young to delete; they
+        are left for a later trim.
+        """
+        excess = self.count(keeps) - limit
+        to_delete = []
+        if excess <= 0:
+            return to_delete
+        for message_id, flags in self.entries.items():
+            if before is not None and message_id >= before:
+                break
+            if keeps(*flags):
+                continue
+            to_delete.append(message_id)
+            if len(to_delete) == excess:
+                break
+        return to_delete
+
+
+class SeedBuffer:
+    """Message events of a channel whose history is being read.
+
+    The scan can't see messages sent, edited or deleted after it started,
+    so these events are collected here and laid over the seeded window
+    with :meth:`apply`. It takes the same calls as :class:`MessageWindow`.
+    """
+
+    def __init__(self):
+        self.window = MessageWindow()
+        self.updates = {}
+        self.removed = set()
+
+    def add(self, message_id, pinned=False, bot_embed=False, exempt=False):
+        self.window.add(message_id, pinned, bot_embed, exempt)
+        self.removed.discard(message_id)
+
+    def update(self, message_id, pinned=None, bot_embed=None, exempt=None):
+        if message_id in self.window.entries:
+            self.window.update(message_id, pinned, bot_embed, exempt)
+            return
+        previous = self.updates.get(message_id, (None, None, None))
+        self.updates[message_id] = tuple(
+            old if new is None else new
+            for old, new in zip(previous, (pinned, bot_embed, exempt))
+        )
+
+    def remove(self, message_id):
+        self.window.remove(message_id)
+        self.updates.pop(message_id, None)
+        self.removed.add(message_id)
+
+    def apply(self, window):
+        for message_id, flags in self.updates.items():
+            window.update(message_id, *flags)
+        for message_id, flags in self.window.entries.items():
+            window.add(message_id, *flags)
+        for message_id in self.removed:
+            window.remove(message_id)
+
+
+class TrimResult:
+    """What a trim cost: messages removed, API calls made and wall time."""
+
+    def __init__(self):
+        self.deleted = 0
+        self.calls = 0
+        self.elapsed = 0.0
+
+
+class GuildStats:
+    """Running totals behind a guild's stats embed.
+
+    The totals are updated as tasks and counters change. ``embed`` caches
+    the rendered embed and is reset whenever anything shown in it changes;
+    ``pages`` does the same for the embeds of the task list.
+    """
+
+    __slots__ = ("tasks", "active", "deleted", "embed", "pages")
+
+    def __init__(self):
+        self.tasks = 0
+        self.active = 0
+        self.deleted = 0
+        self.embed = None
+        self.pages = None
+
+
+class TrimScheduler:
+    """Coalesces trim requests so each channel is trimmed at most once per debounce window.
+
+    ``mark`` flags a channel as dirty. The first mark starts a worker that
+    waits out the debounce window and then trims; marks arriving while the
+    worker waits fold into that pass, and marks arriving while it trims fold
+    into a single follow-up pass.
+    """
+
+    def __init__(self, trim, debounce):
+        self.trim = trim
+        self.debounce = debounce
+        self.dirty = {}
+        self.marked_at = {}
+        self.workers = {}
+        self.marks = 0
+        self.coalesced = 0
+        self.trims = 0
+
+    @property
+    def queue_depth(self):
+        return len(self.dirty)
+
+    def mark(self, channel):
+        self.marks += 1
+        if channel.id in self.dirty:
+            self.coalesced += 1
+            TRIM_COALESCED.inc()
+            return
+        self.dirty[channel.id] = channel
+        self.marked_at[channel.id] = time.perf_counter()
+        if channel.id not in self.workers:
+            self.workers[channel.id] = asyncio.create_task(self._run(channel.id))
+
+    async def _run(self, channel_id):
+        try:
+            while channel_id in self.dirty:
+                await asyncio.sleep(self.debounce)
+                channel = self.dirty.pop(channel_id)
+                TRIM_QUEUE_WAIT_SECONDS.observe(
+                    time.perf_counter() - self.marked_at.pop(channel_id)
+                )
+                self.trims += 1
+                try:
+                    await self.trim(channel)
+                except Exception:
+                    log.exception("Trim failed", extra={"channel_id": channel_id})
+        finally:
+            self.workers.pop(channel_id, None)
+
+
+class CounterBuffer:
+    """Write-behind buffer for the deleted message counters.
+
+    Increments are kept in memory and written to storage in one transaction
+    every ``interval`` seconds, or as soon as ``threshold`` increments have
+    piled up. A crash loses at most the increments of one interval; a clean
+    shutdown or restart always flushes.
+    """
+
+    def __init__(self, storage, interval, threshold):
+        self.storage = storage
+        self.interval = interval
+        self.threshold = threshold
+        self.pending = {}
+        self.increments = 0
+        self.flushes = 0
+        self.absorbed = 0
+        self.last_absorbed = 0
+        self._lock = asyncio.Lock()
+        self._timer = None
+        self._early_flush = None
+
+    def start(self):
+        if self._timer is None:
+            self._timer = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.flush()
+            except Exception:
+                log.exception("Failed to flush deleted message counters")
+
+    def add(self, channel_id, guild_id, count):
+        entry = self.pending.setdefault(channel_id, [guild_id, 0])
+        entry[1] += count
+        self.increments += 1
+        if self.increments >= self.threshold and (
+            self._early_flush is None or self._early_flush.done()
+        ):
+            self._early_flush = asyncio.create_task(self.flush())
+            self._early_flush.add_done_callback(self._early_flush_done)
+
+    @staticmethod
+    def _early_flush_done(flush):
+        # Nothing awaits an early flush; its increments are kept for the
+        # next one, so the failure only needs logging.
+        if not flush.cancelled() and flush.exception() is not None:
+            log.error(
+                "Failed to flush deleted message counters", exc_info=flush.exception()
+            )
+
+    async def flush(self):
+        async with self._lock:
+            if not self.pending:
+                return
+            pending, self.pending = self.pending, {}
+            increments, self.increments = self.increments, 0
+            rows = [
+                (channel_id, guild_id, count)
+                for channel_id, (guild_id, count) in pending.items()
+            ]
+            try:
+                await self.storage.call(self.storage.add_deleted_messages, rows)
+            except Exception:
+                for channel_id, guild_id, count in rows:
+                    self.pending.setdefault(channel_id, [guild_id, 0])[1] += count
+                self.increments += increments
+                raise
+            self.flushes += 1
+            self.absorbed += increments
+            self.last_absorbed = increments
+
+    async def close(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        await self.flush()
+
+
+class ResponseCache:
+    """What the bot's most recent public responses are for, by message id.
+
+    Reactions on a remembered message are handled without fetching it; the
+    oldest entries are dropped past ``capacity``.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.purposes = collections.OrderedDict()
+
+    def remember(self, message_id, purpose):
+        self.purposes[message_id] = purpose
+        self.purposes.move_to_end(message_id)
+        if len(self.purposes) > self.capacity:
+            self.purposes.popitem(last=False)
+
+    def get(self, message_id):
+        return self.purposes.get(message_id)
+
+    def forget(self, message_id):
+        self.purposes.pop(message_id, None)
+
+
+class ExpiryScheduler:
+    """Deletes the messages of tasks with a ``max_age`` once they expire.
+
+    Tracked messages are kept per channel in a :class:`MessageWindow`,
+    oldest first. All messages of a channel share the task's maximum age,
+    so the oldest one always expires next and the heap needs one entry per
+    channel: the time its next message expires. A single worker sleeps
+    until the earliest entry is due and deletes everything that expired in
+    that channel as one batch.
+
+    Changes to the tracked messages are written to storage every
+    ``flush_interval`` seconds, so after a restart the schedule picks up
+    where it left off without reading channel history.
+    """
+
+    def __init__(self, storage, get_task, expire, flush_interval):
+        self.storage = storage
+        self.get_task = get_task
+        self.expire = expire
+        self.flush_interval = flush_interval
+        self.queues = {}
+        self.heap = []
+        self.due = {}
+        self.running = set()
+        # The running passes, referenced so they aren't collected mid-run.
+        self.passes = set()
+        self.expired = 0
+        self.pending = {}
+        self.dropped = set()
+        self._wakeup = asyncio.Event()
+        self._worker = None
+        self._timer = None
+
+    @staticmethod
+    def expires_at(message_id, max_age):
+        created = ((message_id >> 22) + discord.utils.DISCORD_EPOCH) / 1000
+        return created + max_age * 60
+
+    def load(self, rows):
+        self.queues = {}
+        self.heap = []
+        self.due = {}
+        for channel_id, message_id, pinned, bot_embed in rows:
+            queue = self.queues.get(channel_id)
+            if queue is None:
+                queue = self.queues[channel_id] = MessageWindow()
+            queue.add(message_id, pinned, bot_embed)
+        # Changes not flushed yet are missing from the rows.
+        for channel_id in self.dropped:
+            self.queues.pop(channel_id, None)
+        for (channel_id, message_id), flags in self.pending.items():
+            queue = self.queues.get(channel_id)
+            if flags is not None:
+                if queue is None:
+                    queue = self.queues[channel_id] = MessageWindow()
+                queue.add(message_id, *flags)
+            elif queue is not None:
+                queue.remove(message_id)
+        for channel_id in list(self.queues):
+            if not self.queues[channel_id]:
+                del self.queues[channel_id]
+            else:
+                self.reschedule(channel_id)
+
+    def tracked(self):
+        return sum(len(queue) for queue in self.queues.values())
+
+    def _track(self, task, channel_id, message_id, pinned, bot_embed, exempt=False):
+        # Bot embeds rarely change and messages kept by the task's rules
+        # only change with the rules, so neither is tracked at all. Pins
+        # come and go, so pinned messages stay queued and are skipped.
+        if (bot_embed and not task.embeds) or exempt:
+            return
+        queue = self.queues.get(channel_id)
+        if queue is None:
+            queue = self.queues[channel_id] = MessageWindow()
+        if message_id not in queue.entries:
+            queue.add(message_id, pinned, bot_embed)
+            self.pending[(channel_id, message_id)] = (pinned, bot_embed)
+
+    def track(self, channel_id, message_id, pinned=False, bot_embed=False, exempt=False):
+        task = self.get_task(channel_id)
+        if task is None or not task.max_age:
+            return
+        self._track(task, channel_id, message_id, pinned, bot_embed, exempt)
+        if channel_id not in self.due:
+            self.reschedule(channel_id)
+
+    def track_window(self, channel_id, window):
+        """Track every message of a freshly seeded channel window."""
+        task = self.get_task(channel_id)
+        if task is None or not task.max_age:
+            return
+        for message_id, flags in window.entries.items():
+            self._track(task, channel_id, message_id, *flags)
+        self.reschedule(channel_id)
+
+    def update(self, channel_id, message_id, pinned=None, bot_embed=None):
+        queue = self.queues.get(channel_id)
+        if queue is None or message_id not in queue.entries:
+            return
+        queue.update(message_id, pinned, bot_embed)
+        self.pending[(channel_id, message_id)] = queue.entries[message_id][:2]
+        self.reschedule(channel_id)
+
+    def remove(self, channel_id, message_ids):
+        queue = self.queues.get(channel_id)
+        if queue is None:
+            return
+        for message_id in message_ids:
+            if message_id in queue.entries:
+                queue.remove(message_id)
+                self.pending[(channel_id, message_id)] = None
+        if not queue:
+            del self.queues[channel_id]
+            self.due.pop(channel_id, None)
+
+    def forget(self, channel_id):
+        """Stop tracking a channel whose task was removed or lost its max_age."""
+        self.due.pop(channel_id, None)
+        if self.queues.pop(channel_id, None) is not None:
+            self.pending = {
+                key: flags for key, flags in self.pending.items() if key[0] != channel_id
+            }
+            self.dropped.add(channel_id)
+
+    def reschedule(self, channel_id):
+        task = self.get_task(channel_id)
+        if task is None or not task.max_age:
+            self.forget(channel_id)
+            return
+        queue = self.queues.get(channel_id)
+        next_id = None
+        if queue and task.enabled:
+            next_id = next(
+                (
+                    message_id
+                    for message_id, flags in queue.entries.items()
+                    if not task.keeps(*flags)
+                ),
+                None,
+            )
+        if next_id is None:
+            self.due.pop(channel_id, None)
+            return
+        due = self.expires_at(next_id, task.max_age)
+        if self.due.get(channel_id) == due:
+            return
+        # Entries whose time no longer matches ``self.due`` are stale and
+        # skipped when popped.
+        self.due[channel_id] = due
+        heapq.heappush(self.heap, (due, channel_id))
+        if self.heap[0] == (due, channel_id):
+            self._wakeup.set()
+
+    def start(self):
+        if self._worker is None:
+            self._worker = asyncio.create_task(self._run())
+            self._timer = asyncio.create_task(self._flush_periodically())
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            now = time.time()
+            while self.heap and self.heap[0][0] <= now:
+                due, channel_id = heapq.heappop(self.heap)
+                if self.due.get(channel_id) != due:
+                    continue
+                del self.due[channel_id]
+                if channel_id in self.running:
+                    # The running pass reschedules the channel when it ends.
+                    continue
+                self.running.add(channel_id)
+                expiry_pass = asyncio.create_task(self._expire_channel(channel_id))
+                self.passes.add(expiry_pass)
+                expiry_pass.add_done_callback(self.passes.discard)
+            timeout = self.heap[0][0] - now if self.heap else None
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _expire_channel(self, channel_id):
+        try:
+            task = self.get_task(channel_id)
+            queue = self.queues.get(channel_id)
+            if task is None or not task.enabled or not task.max_age or not queue:
+                return
+            now = time.time()
+            expired = []
+            for message_id, flags in queue.entries.items():
+                if self.expires_at(message_id, task.max_age) > now:
+                    break
+                if not task.keeps(*flags):
+                    expired.append(message_id)
+            if expired:
+                deleted = await self.expire(channel_id, expired)
+                # Messages that could not be deleted are dropped as well, so a
+                # missing permission doesn't make the channel fire forever.
+                self.remove(channel_id, expired)
+                self.expired += deleted
+        except Exception:
+            log.exception("Expiry failed", extra={"channel_id": channel_id})
+        finally:
+            self.running.discard(channel_id)
+            self.reschedule(channel_id)
+
+    async def _flush_periodically(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception:
+                log.exception("Failed to flush the expiry schedule")
+
+    async def flush(self):
+        if not self.pending and not self.dropped:
+            return
+        pending, self.pending = self.pending, {}
+        dropped, self.dropped = self.dropped, set()
+        upserts = [
+            (channel_id, message_id, flags[0], flags[1])
+            for (channel_id, message_id), flags in pending.items()
+            if flags is not None
+        ]
+        deletes = [key for key, flags in pending.items() if flags is None]
+        try:
+            await self.storage.call(
+                self.storage.update_expiring, list(dropped), upserts, deletes
+            )
+        except Exception:
+            # Put the changes back for the next flush. Changes made since
+            # win, and channels dropped since stay dropped.
+            for key, flags in pending.items():
+                if key[0] not in self.dropped:
+                    self.pending.setdefault(key, flags)
+            self.dropped |= dropped
+            raise
+
+    async def close(self):
+        for worker in (self._worker, self._timer):
+            if worker is not None:
+                worker.cancel()
+        self._worker = self._timer = None
+        await self.flush()
+
+
+def command_tree_hash(tree):
+    payload = sorted(
+        (command.to_dict(tree) for command in tree.get_commands()),
+        key=lambda command: command["name"],
+    )
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+
+
+BotBase = commands.AutoShardedBot if SHARD_COUNT else commands.Bot
+
+
+class AutoDeleteBot(BotBase):
+    def __init__(self):
+        self.pacer = DeletionPacer(
+            GLOBAL_DELETE_RATE,
+            DELETE_RATE,
+            MAX_DELETE_RATE,
+            on_rate_limited=RATE_LIMITED.inc,
+        )
+        self.deletions = FairDeleteQueue(
+            MAX_CONCURRENT_TRIMS,
+            bucket=self.pacer.global_bucket,
+            weights=GUILD_WEIGHTS,
+            quota=GUILD_DELETE_QUOTA,
+            quotas=GUILD_DELETE_QUOTAS,
+            on_wait=DELETE_QUEUE_WAIT_SECONDS.observe,
+        )
+        options = gateway_options(GATEWAY_PROFILE, MAX_MESSAGES)
+        if SHARD_COUNT:
+            options.update(shard_count=SHARD_COUNT, shard_ids=SHARD_IDS)
+        super().__init__(
+            command_prefix="/",
+            activity=activity,
+            http_trace=self.pacer.trace_config(),
+            **options,
+        )
+        self.owned_shards = set(SHARD_IDS) if SHARD_IDS else None
+        self.storage = open_storage(STORAGE_BACKEND, DATABASE_FILE, CONFIG_FILE)
+        self.storage.observer = (
+            lambda operation, seconds: STORAGE_SECONDS.labels(operation).observe(seconds)
+        )
+        self.metrics_server = (
+            MetricsServer(metrics, METRICS_HOST, METRICS_PORT) if METRICS_PORT else None
+        )
+        self.expiry = ExpiryScheduler(
+            self.storage,
+            lambda channel_id: self.tasks.get(channel_id),
+            self.expire_messages,
+            COUNTER_FLUSH_INTERVAL,
+        )
+        self.counters = CounterBuffer(
+            self.storage, COUNTER_FLUSH_INTERVAL, COUNTER_FLUSH_THRESHOLD
+        )
+        # The store is read in setup_hook while the gateway connects; until
+        # then the bot knows no tasks and commands wait for config_ready.
+        self.apply_config(({}, {}, {}, {}), [])
+        self.config_ready = asyncio.Event()
+        self.config_loading = None
+        # Set when the first load failed; commands then answer with an error.
+        self.config_error = None
+        self.commands_synced = False
+        self.ready_count = 0
+        self.disconnected_at = None
+        # Set by /autodelete restart; the process re-executes itself with
+        # these arguments once the bot has shut down.
+        self.restart_argv = None
+        self.windows = {}
+        # Channels whose history is being read, see seed_window.
+        self.seeding = {}
+        # Timers trimming a channel again once messages held back by
+        # min_age are old enough, see schedule_held_back.
+        self.held_back = {}
+        # Trims of one channel are serialized. Different channels trim in
+        # parallel; their delete calls share MAX_CONCURRENT_TRIMS slots
+        # through self.deletions, and as many history scans may run at once.
+        self.channel_locks = collections.defaultdict(asyncio.Lock)
+        self.scan_slots = asyncio.Semaphore(MAX_CONCURRENT_TRIMS)
+        self.trim_scheduler = TrimScheduler(self.trim_channel, TRIM_DEBOUNCE)
+        self.reconcile_task = None
+        self.startup_task = None
+        self.responses = ResponseCache(RESPONSE_CACHE_SIZE)
+        self.archive = Archive(
+            ARCHIVE_DIR,
+            ARCHIVE_COMPRESSION,
+            ARCHIVE_SEGMENT_BYTES,
+            ARCHIVE_SEGMENT_SECONDS,
+            ARCHIVE_QUEUE_SIZE,
+            ARCHIVE_MAX_RECORDS,
+        )
+        self.response_layouts = {}
+
+    async def setup_hook(self):
+        self.config_loading = asyncio.create_task(self.load_initial_config())
+        self.counters.start()
+        self.expiry.start()
+        self.archive.start()
+        # Handles the buttons of every ephemeral response, by custom id.
+        self.add_view(ResponseButtons())
+        for name in EXTENSIONS:
+            await self.load_extension(name)
+        if self.metrics_server is not None:
+            await self.metrics_server.start()
+            log.info("Serving metrics", extra={"host": METRICS_HOST, "port": METRICS_PORT})
+
+    def owns_guild(self, guild_id):
+        """Whether the guild is on one of this process's shards."""
+        if self.owned_shards is None:
+            return True
+        return (guild_id >> 22) % SHARD_COUNT in self.owned_shards
+
+    async def load_config(self):
+        started = time.perf_counter()
+        config = await self.storage.call(self.storage.load)
+        expiring = await self.storage.call(self.storage.load_expiring)
+        self.apply_config(config, expiring)
+        self.config_ready.set()
+        log.info(
+            "Loaded config",
+            extra={"tasks": len(self.tasks), "seconds": round(time.perf_counter() - started, 3)},
+        )
+
+    async def load_initial_config(self):
+        try:
+            await self.load_config()
+        except Exception as e:
+            log.exception("Failed to load config, commands will answer with an error")
+            self.config_error = e
+            self.config_ready.set()
+
+    async def reload_config(self):
+        """Reload tasks, roles and counters from storage without reconnecting.
+
+        Pending counters and expiry changes are written first, and anything
+        counted while the store is read is laid over what was loaded.
+        Windows of channels that still have a task are kept.
+        """
+        await self.counters.flush()
+        await self.expiry.flush()
+        previous = {
+            channel_id: (task.rules, task.archive) for channel_id, task in self.tasks.items()
+        }
+        await self.load_config()
+        for channel_id in list(self.windows):
+            task = self.tasks.get(channel_id)
+            if task is None:
+                del self.windows[channel_id]
+                self.channel_locks.pop(channel_id, None)
+            elif (task.rules, task.archive) != previous.get(channel_id):
+                self.reset_window(channel_id)
+        for channel_id in list(self.archive.records):
+            task = self.tasks.get(channel_id)
+            if task is None or not task.archive:
+                self.archive.forget_channel(channel_id)
+        self.index_counters()
+        for name in list(self.extensions):
+            await self.reload_extension(name)
+        self.start_reconcile()
+
+    def apply_config(self, config, expiring):
+        (
+            self.tasks,
+            self.management_roles,
+            self.deleted_message_count,
+            counter_guilds,
+        ) = config
+        for channel_id, (guild_id, count) in self.counters.pending.items():
+            # Increments not flushed yet are missing from the loaded totals.
+            self.deleted_message_count[channel_id] = (
+                self.deleted_message_count.get(channel_id, 0) + count
+            )
+            counter_guilds.setdefault(channel_id, guild_id)
+        if self.owned_shards is not None:
+            # The store is shared by all clusters; keep this cluster's guilds.
+            self.tasks = {
+                channel_id: task
+                for channel_id, task in self.tasks.items()
+                if self.owns_guild(task.guild_id)
+            }
+            self.management_roles = {
+                guild_id: role_ids
+                for guild_id, role_ids in self.management_roles.items()
+                if self.owns_guild(guild_id)
+            }
+            self.deleted_message_count = {
+                channel_id: count
+                for channel_id, count in self.deleted_message_count.items()
+                if channel_id not in counter_guilds
+                or self.owns_guild(counter_guilds[channel_id])
+            }
+        # Per-guild indexes so guild-scoped commands only touch their own
+        # guild's tasks and counters.
+        self.guild_tasks = {}
+        self.guild_deleted = {}
+        self.guild_stats = {}
+        self.unindexed_counters = set()
+        self.management_role_sets = {}
+        for guild_id, role_ids in self.management_roles.items():
+            self.cache_management_roles(guild_id, role_ids)
+        for task in self.tasks.values():
+            self.guild_tasks.setdefault(task.guild_id, {})[task.channel_id] = task
+        for channel_id, count in self.deleted_message_count.items():
+            guild_id = counter_guilds.get(channel_id)
+            if guild_id is None:
+                self.unindexed_counters.add(channel_id)
+            else:
+                self.guild_deleted.setdefault(guild_id, {})[channel_id] = count
+                self.get_guild_stats(guild_id).deleted += count
+        for guild_id in self.guild_tasks:
+            self.count_guild_tasks(guild_id)
+        # Rows of other clusters' channels are left alone: forgetting them
+        # here would delete them from the shared store.
+        self.expiry.load(row for row in expiring if row[0] in self.tasks)
+
+    def index_counters(self):
+        """Attach counters stored without a guild id to their channel's guild."""
+        for channel_id in list(self.unindexed_counters):
+            channel = self.get_channel(channel_id)
+            if channel is not None:
+                count = self.deleted_message_count[channel_id]
+                self.guild_deleted.setdefault(channel.guild.id, {})[channel_id] = count
+                stats = self.get_guild_stats(channel.guild.id)
+                stats.deleted += count
+                stats.embed = None
+                self.unindexed_counters.discard(channel_id)
+
+    def get_guild_tasks(self, guild_id):
+        return self.guild_tasks.get(guild_id, {})
+
+    def get_guild_stats(self, guild_id):
+        stats = self.guild_stats.get(guild_id)
+        if stats is None:
+            stats = self.guild_stats[guild_id] = GuildStats()
+        return stats
+
+    def count_guild_tasks(self, guild_id):
+        """Recount a guild's tasks after some were added, edited or removed."""
+        guild_tasks = self.get_guild_tasks(guild_id)
+        stats = self.get_guild_stats(guild_id)
+        stats.tasks = len(guild_tasks)
+        stats.active = sum(1 for task in guild_tasks.values() if task.enabled)
+        stats.embed = None
+        stats.pages = None
+
+    def forget_channel_counter(self, guild_id, channel_id):
+        """Drop a deleted channel from its guild's statistics."""
+        count = self.guild_deleted.get(guild_id, {}).pop(channel_id, None)
+        if count is not None:
+            stats = self.get_guild_stats(guild_id)
+            stats.deleted -= count
+            stats.embed = None
+
+    def get_management_roles(self, guild_id):
+        return self.management_roles.get(guild_id, [])
+
+    def get_management_role_set(self, guild_id):
+        """Management role ids of a guild; empty if the guild isn't set up."""
+        return self.management_role_sets.get(guild_id, frozenset())
+
+    def cache_management_roles(self, guild_id, role_ids):
+        self.management_roles[guild_id] = role_ids
+        if role_ids:
+            self.management_role_sets[guild_id] = frozenset(map(int, role_ids))
+        else:
+            self.management_role_sets.pop(guild_id, None)
+        stats = self.guild_stats.get(guild_id)
+        if stats is not None:
+            stats.embed = None
+
+    async def set_management_roles(self, guild_id, role_ids):
+        self.cache_management_roles(guild_id, role_ids)
+        await self.storage.call(self.storage.set_management_roles, guild_id, role_ids)
+        log.info(
+            "Management roles updated", extra={"guild_id": guild_id, "role_ids": role_ids}
+        )
+
+    async def save_tasks(self, tasks):
+        for task in tasks:
+            self.tasks[task.channel_id] = task
+            self.guild_tasks.setdefault(task.guild_id, {})[task.channel_id] = task
+        for guild_id in {task.guild_id for task in tasks}:
+            self.count_guild_tasks(guild_id)
+        for task in tasks:
+            self.schedule_expiry(task)
+        await self.storage.call(
+            self.storage.save_tasks, [task.copy() for task in tasks]
+        )
+
+    async def remove_tasks(self, channel_ids):
+        guild_ids = set()
+        for channel_id in channel_ids:
+            task = self.tasks.pop(channel_id, None)
+            if task is not None:
+                guild_ids.add(task.guild_id)
+                guild_tasks = self.guild_tasks.get(task.guild_id, {})
+                guild_tasks.pop(channel_id, None)
+                if not guild_tasks:
+                    self.guild_tasks.pop(task.guild_id, None)
+            self.windows.pop(channel_id, None)
+            self.cancel_held_back(channel_id)
+            self.channel_locks.pop(channel_id, None)
+            self.expiry.forget(channel_id)
+            self.archive.forget_channel(channel_id)
+        for guild_id in guild_ids:
+            self.count_guild_tasks(guild_id)
+        await self.storage.call(self.storage.delete_tasks, list(channel_ids))
+
+    async def seed_window(self, channel):
+        """Build the message window for ``channel`` from its full history.
+
+        Events arriving during the scan go to a :class:`SeedBuffer` that is
+        applied to the window before it is stored.
+        """
+        buffer = self.seeding[channel.id] = SeedBuffer()
+        try:
+            task = self.tasks.get(channel.id)
+            archive = task is not None and task.archive
+            window = MessageWindow()
+            with HISTORY_SCAN_SECONDS.time():
+                # Oldest first, so messages go straight into the window
+                # instead of piling up for the whole scan.
+                async for msg in read_history(channel, oldest_first=True):
+                    window.add(msg.id, *message_flags(msg, task))
+                    if archive:
+                        self.archive.remember(msg, task.limit)
+            buffer.apply(window)
+        finally:
+            if self.seeding.get(channel.id) is buffer:
+                del self.seeding[channel.id]
+        self.windows[channel.id] = window
+        self.expiry.track_window(channel.id, window)
+        return window
+
+    async def catch_up_window(self, channel):
+        """Add the messages posted in ``channel`` since the newest one in its
+        window, which a new gateway session doesn't replay.
+
+        Deletions missed the same way stay in the window until a trim finds
+        the messages gone.
+        """
+        window = self.windows.get(channel.id)
+        newest = next(reversed(window.entries), None) if window is not None else None
+        if newest is None:
+            return
+        task = self.tasks.get(channel.id)
+        with HISTORY_SCAN_SECONDS.time():
+            async for msg in read_history(channel, after=discord.Object(id=newest)):
+                flags = message_flags(msg, task)
+                window.add(msg.id, *flags)
+                if task is not None and task.archive:
+                    self.archive.remember(msg, task.limit)
+                self.expiry.track(channel.id, msg.id, *flags)
+
+    def message_window(self, channel_id):
+        """Where message events of ``channel_id`` go: its window, the buffer
+        of a history scan in progress, or None."""
+        window = self.windows.get(channel_id)
+        if window is None:
+            window = self.seeding.get(channel_id)
+        return window
+
+    def reset_window(self, channel_id):
+        """Forget a channel's window and expiry queue after its task's rules
+        or archiving changed; the flags and archive records are stale. The
+        next trim, started here, reads the history again."""
+        self.windows.pop(channel_id, None)
+        self.archive.forget_channel(channel_id)
+        self.expiry.forget(channel_id)
+        channel = self.get_channel(channel_id)
+        if channel is not None:
+            self.trim_scheduler.mark(channel)
+
+    def schedule_expiry(self, task):
+        """Start or update age-based deletion after a task was saved."""
+        if not task.max_age:
+            self.expiry.forget(task.channel_id)
+            return
+        window = self.windows.get(task.channel_id)
+        if window is not None:
+            self.expiry.track_window(task.channel_id, window)
+            return
+        channel = self.get_channel(task.channel_id)
+        if channel is not None and task.enabled:
+            # The trim seeds the channel's window, which feeds the scheduler.
+            self.trim_scheduler.mark(channel)
+
+    async def delete_messages(self, channel, message_ids):
+        """Delete ``message_ids`` from ``channel`` with as few API calls as possible.
+
+        Messages young enough for the bulk delete endpoint go out in batches
+        of up to 100. Older messages, and batches the endpoint refuses, fall
+        back to single deletes. Every call waits for its route's token from
+        ``self.pacer`` and then for its turn in ``self.deletions``, which
+        hands out the global rate fairly between guilds.
+        """
+        result = TrimResult()
+        started = time.perf_counter()
+        window = self.windows.get(channel.id)
+        cutoff = discord.utils.time_snowflake(
+            discord.utils.utcnow() - BULK_DELETE_MAX_AGE
+        )
+        recent = [message_id for message_id in message_ids if message_id > cutoff]
+        single = [message_id for message_id in message_ids if message_id <= cutoff]
+
+        deleted = 0
+        try:
+            for start in range(0, len(recent), BULK_DELETE_LIMIT):
+                batch = recent[start : start + BULK_DELETE_LIMIT]
+                result.calls += 1
+                DELETE_CALLS.labels("bulk").inc()
+                await self.fill_archive(channel, batch)
+                records = self.archive.take(channel.id, batch)
+                try:
+                    with DELETE_SECONDS.labels("bulk").time():
+                        await self.pacer.acquire_route(channel.id, "bulk")
+                        async with self.deletions.slot(channel.guild.id, channel.id):
+                            await channel.delete_messages(
+                                [discord.Object(id=message_id) for message_id in batch]
+                            )
+                except discord.Forbidden:
+                    self.archive.restore(channel.id, records)
+                    raise
+                except discord.HTTPException as e:
+                    self.archive.restore(channel.id, records)
+                    log.warning(
+                        "Bulk delete failed, retrying one by one",
+                        extra={"channel_id": channel.id, "error": str(e)},
+                    )
+                    single.extend(batch)
+                    continue
+                self.archive.write(channel.guild.id, channel.id, records)
+                self._forget_messages(channel.id, window, batch)
+                result.deleted += len(batch)
+                await self.increment_deleted_messages(channel, len(batch))
+
+            for index, message_id in enumerate(single):
+                if index % BULK_DELETE_LIMIT == 0:
+                    await self.fill_archive(channel, single[index : index + BULK_DELETE_LIMIT])
+                result.calls += 1
+                DELETE_CALLS.labels("single").inc()
+                records = self.archive.take(channel.id, (message_id,))
+                try:
+                    with DELETE_SECONDS.labels("single").time():
+                        await self.pacer.acquire_route(channel.id, "single")
+                        async with self.deletions.slot(channel.guild.id, channel.id):
+                            await channel.get_partial_message(message_id).delete()
+                    deleted += 1
+                    self.archive.write(channel.guild.id, channel.id, records)
+                except discord.NotFound:
+                    pass
+                except discord.HTTPException:
+                    self.archive.restore(channel.id, records)
+                    raise
+                self._forget_messages(channel.id, window, (message_id,))
+        finally:
+            # Single deletes are counted once at the end, including when a
+            # later call raised.
+            if deleted:
+                result.deleted += deleted
+                await self.increment_deleted_messages(channel, deleted)
+            DELETED_MESSAGES.inc(result.deleted)
+
+        result.elapsed = time.perf_counter() - started
+        TRIM_SECONDS.observe(result.elapsed)
+        return result
+
+    async def fill_archive(self, channel, message_ids):
+        """Read the messages about to be deleted whose archive records were
+        evicted, so they are archived all the same.
+
+        Called per batch of at most 100 messages, which usually takes a
+        single history page.
+        """
+        task = self.tasks.get(channel.id)
+        if task is None or not task.archive:
+            return
+        missing = set(self.archive.missing(channel.id, message_ids))
+        if not missing:
+            return
+        with HISTORY_SCAN_SECONDS.time():
+            messages = [
+                msg
+                async for msg in read_history(
+                    channel,
+                    after=discord.Object(id=min(missing) - 1),
+                    before=discord.Object(id=max(missing) + 1),
+                )
+                if msg.id in missing
+            ]
+        self.archive.restore(channel.id, [message_record(msg) for msg in messages])
+
+    def _forget_messages(self, channel_id, window, message_ids):
+        if window is not None:
+            for message_id in message_ids:
+                window.remove(message_id)
+        self.expiry.remove(channel_id, message_ids)
+
+    async def trim_channel(self, channel):
+        channel_id = channel.id
+        waiting_since = time.perf_counter()
+        async with self.channel_locks[channel_id]:
+            TRIM_LOCK_WAIT_SECONDS.observe(time.perf_counter() - waiting_since)
+            task = self.tasks.get(channel_id)
+            if task is None or not task.enabled:
+                return
+
+            limit = task.limit
+            before = None
+            if task.rules.min_age:
+                before = discord.utils.time_snowflake(
+                    discord.utils.utcnow() - datetime.timedelta(minutes=task.rules.min_age)
+                )
+
+            try:
+                window = self.windows.get(channel.id)
+                if window is None:
+                    async with self.scan_slots:
+                        window = await self.seed_window(channel)
+
+                current_message_count = window.count(task.keeps)
+                discrepancy = current_message_count - limit
+
+                log.debug(
+                    "Checked channel",
+                    extra={
+                        "channel_id": channel_id,
+                        "messages": current_message_count,
+                        "limit": limit,
+                        "discrepancy": max(discrepancy, 0),
+                        "queued": self.trim_scheduler.queue_depth,
+                        "coalesced": self.trim_scheduler.coalesced,
+                    },
+                )
+                if discrepancy > 0:
+                    to_delete = window.overflow(limit, task.keeps, before)
+                    if len(to_delete) < discrepancy:
+                        self.schedule_held_back(channel, window, task, before)
+                    result = await self.delete_messages(channel, to_delete)
+                    log.info(
+                        "Trimmed channel",
+                        extra={
+                            "channel_id": channel_id,
+                            "guild_id": channel.guild.id,
+                            "deleted": result.deleted,
+                            "api_calls": result.calls,
+                            "seconds": round(result.elapsed, 3),
+                        },
+                    )
+
+            except discord.Forbidden:
+                log.error(
+                    "Missing permissions to manage messages",
+                    extra={"channel_id": channel_id, "guild_id": channel.guild.id},
+                )
+            except discord.HTTPException as e:
+                log.error(
+                    "HTTP exception during trim",
+                    extra={"channel_id": channel_id, "status": e.status, "error": str(e)},
+                )
+
+    def schedule_held_back(self, channel, window, task, before):
+        """Trim ``channel`` again once the oldest message that ``min_age``
+        kept over the limit is old enough to go."""
+        held = next(
+            (
+                message_id
+                for message_id, flags in window.entries.items()
+                if message_id >= before and not task.keeps(*flags)
+            ),
+            None,
+        )
+        if held is None:
+            return
+        due = discord.utils.snowflake_time(held) + datetime.timedelta(minutes=task.rules.min_age)
+        delay = (due - discord.utils.utcnow()).total_seconds() + MIN_AGE_RETRY_MARGIN
+        self.cancel_held_back(channel.id)
+        self.held_back[channel.id] = asyncio.get_running_loop().call_later(
+            max(delay, 0.0), self.trim_held_back, channel
+        )
+
+    def trim_held_back(self, channel):
+        self.held_back.pop(channel.id, None)
+        self.trim_scheduler.mark(channel)
+
+    def cancel_held_back(self, channel_id):
+        timer = self.held_back.pop(channel_id, None)
+        if timer is not None:
+            timer.cancel()
+
+    async def expire_messages(self, channel_id, message_ids):
+        """Delete expired messages; returns how many were deleted."""
+        channel = self.get_channel(channel_id)
+        if channel is None:
+            return 0
+        async with self.channel_locks[channel_id]:
+            try:
+                result = await self.delete_messages(channel, message_ids)
+            except discord.Forbidden:
+                log.error(
+                    "Missing permissions to manage messages",
+                    extra={"channel_id": channel_id, "guild_id": channel.guild.id},
+                )
+                return 0
+            except discord.HTTPException as e:
+                log.error(
+                    "HTTP exception during expiry",
+                    extra={"channel_id": channel_id, "status": e.status, "error": str(e)},
+                )
+                return 0
+        log.info(
+            "Expired messages",
+            extra={
+                "channel_id": channel_id,
+                "guild_id": channel.guild.id,
+                "deleted": result.deleted,
+                "api_calls": result.calls,
+                "seconds": round(result.elapsed, 3),
+            },
+        )
+        return result.deleted
+
+    async def sync_commands(self):
+        """Sync the global command tree unless it matches the last synced one.
+
+        The hash of the tree's payload is kept in storage, so restarts and
+        reconnects only sync after the commands actually changed.
+        """
+        key = f"command_tree_hash:{self.application_id}"
+        digest = command_tree_hash(self.tree)
+        if await self.storage.call(self.storage.get_meta, key) == digest:
+            log.info("Command tree unchanged, skipping sync")
+            return
+        started = time.perf_counter()
+        await self.tree.sync(guild=None)
+        await self.storage.call(self.storage.set_meta, key, digest)
+        log.info(
+            "Synced command tree",
+            extra={"seconds": round(time.perf_counter() - started, 3)},
+        )
+
+    def start_reconcile(self, catch_up=False):
+        if self.reconcile_task is not None:
+            self.reconcile_task.cancel()
+        self.reconcile_task = asyncio.create_task(self.reconcile(catch_up))
+
+    async def reconcile(self, catch_up=False):
+        """Seed every enabled task's window and trim channels that went over
+        their limit while the bot was offline. With ``catch_up``, windows
+        that are already seeded read the messages posted since their newest
+        one instead, see :meth:`catch_up_window`.
+
+        Channels are seeded ``RECONCILE_CONCURRENCY`` at a time and then
+        trimmed in priority order: ``overflow`` trims the channels furthest
+        over their limit first, ``ratio`` the ones furthest over relative
+        to their limit.
+        """
+        started = time.perf_counter()
+        slots = asyncio.Semaphore(RECONCILE_CONCURRENCY)
+        channels = [
+            channel
+            for channel in map(self.get_channel, list(self.tasks))
+            if channel is not None and self.tasks[channel.id].enabled
+        ]
+        total = len(channels)
+        progress_step = max(1, total // 10)
+        seeded = 0
+
+        async def seed(channel):
+            nonlocal seeded
+            async with slots, self.channel_locks[channel.id]:
+                if channel.id in self.tasks and (catch_up or channel.id not in self.windows):
+                    try:
+                        if channel.id in self.windows:
+                            await self.catch_up_window(channel)
+                        else:
+                            await self.seed_window(channel)
+                    except discord.HTTPException as e:
+                        log.error(
+                            "Could not read channel history",
+                            extra={"channel_id": channel.id, "error": str(e)},
+                        )
+            seeded += 1
+            if seeded % progress_step == 0 or seeded == total:
+                log.info("Reconciliation progress", extra={"seeded": seeded, "total": total})
+
+        await asyncio.gather(*(seed(channel) for channel in channels))
+
+        def overflow(channel):
+            task = self.tasks.get(channel.id)
+            window = self.windows.get(channel.id)
+            if task is None or window is None:
+                return 0
+            return window.count(task.keeps) - task.limit
+
+        def ratio(channel):
+            return overflow(channel) / max(self.tasks[channel.id].limit, 1)
+
+        overdue = sorted(
+            (channel for channel in channels if overflow(channel) > 0),
+            key=ratio if RECONCILE_PRIORITY == "ratio" else overflow,
+            reverse=True,
+        )
+        progress_step = max(1, len(overdue) // 10)
+        trimmed = 0
+
+        async def trim(channel):
+            nonlocal trimmed
+            async with slots:
+                await self.trim_channel(channel)
+            trimmed += 1
+            if trimmed % progress_step == 0 or trimmed == len(overdue):
+                log.info(
+                    "Reconciliation progress",
+                    extra={"trimmed": trimmed, "overdue": len(overdue)},
+                )
+
+        # Tasks are created in priority order, so the semaphore hands out
+        # slots to the most overdue channels first.
+        await asyncio.gather(*(trim(channel) for channel in overdue))
+        log.info(
+            "Reconciliation finished",
+            extra={
+                "seeded": total,
+                "trimmed": len(overdue),
+                "seconds": round(time.perf_counter() - started, 3),
+            },
+        )
+
+    async def increment_deleted_messages(self, channel, count):
+        channel_id = channel.id
+        self.deleted_message_count[channel_id] = (
+            self.deleted_message_count.get(channel_id, 0) + count
+        )
+        self.guild_deleted.setdefault(channel.guild.id, {})[channel_id] = (
+            self.deleted_message_count[channel_id]
+        )
+        stats = self.get_guild_stats(channel.guild.id)
+        if channel_id in self.unindexed_counters:
+            # The stored count was not attributed to a guild yet.
+            self.unindexed_counters.discard(channel_id)
+            stats.deleted += self.deleted_message_count[channel_id]
+        else:
+            stats.deleted += count
+        stats.embed = None
+        self.counters.add(channel_id, channel.guild.id, count)
+
+    async def close(self):
+        # A storage error in the final flushes still shuts down the gateway,
+        # the HTTP session and storage before it is raised.
+        try:
+            try:
+                await self.counters.close()
+            finally:
+                await self.expiry.close()
+        finally:
+            if self.metrics_server is not None:
+                await self.metrics_server.stop()
+            await super().close()
+            await self.archive.close()
+            await asyncio.get_running_loop().run_in_executor(None, self.storage.close)
+
+
+bot = AutoDeleteBot()
+metrics.gauge(
+    "autodelete_trim_queue_depth",
+    "Channels marked for a trim that has not started yet.",
+    lambda: bot.trim_scheduler.queue_depth,
+)
+metrics.gauge(
+    "autodelete_delete_queue_waiting",
+    "Delete calls waiting for a slot in the fair delete queue.",
+    lambda: bot.deletions.waiting,
+)
+metrics.gauge("autodelete_tasks", "Configured tasks.", lambda: len(bot.tasks))
+metrics.gauge(
+    "autodelete_pacer_global_tokens",
+    "Tokens left in the pacer's global delete bucket.",
+    lambda: bot.pacer.global_bucket.snapshot(time.monotonic())["tokens"],
+)
+metrics.gauge(
+    "autodelete_pacer_routes",
+    "Delete routes the pacer keeps a bucket for.",
+    lambda: len(bot.pacer.routes),
+)
+metrics.gauge(
+    "autodelete_pacer_blocked_routes",
+    "Delete routes blocked until Discord's rate limit resets.",
+    lambda: sum(
+        1 for bucket in bot.pacer.routes.values() if bucket.blocked_until > time.monotonic()
+    ),
+)
+metrics.gauge(
+    "autodelete_expiry_tracked_messages",
+    "Messages waiting to expire in channels with a max age.",
+    bot.expiry.tracked,
+)
+metrics.gauge(
+    "autodelete_archived_messages",
+    "Deleted messages handed to the archive since start.",
+    lambda: bot.archive.archived,
+)
+metrics.gauge(
+    "autodelete_archive_dropped_messages",
+    "Deleted messages not archived because the archive queue was full.",
+    lambda: bot.archive.dropped,
+)
+autodelete_group = app_commands.Group(name="autodelete", description="Required prefix.")
+
+
+@bot.event
+async def on_guild_role_delete(role):
+    guild_id = role.guild.id
+    if role.id in bot.get_management_role_set(guild_id):
+        await bot.set_management_roles(
+            guild_id,
+            [role_id for role_id in bot.get_management_roles(guild_id) if int(role_id) != role.id],
+        )
+
+
+@bot.event
+async def on_guild_channel_delete(channel):
+    bot.forget_channel_counter(channel.guild.id, channel.id)
+
+
+@bot.event
+async def on_disconnect():
+    if bot.disconnected_at is None:
+        bot.disconnected_at = time.monotonic()
+
+
+@bot.event
+async def on_resumed():
+    bot.disconnected_at = None
+
+
+@bot.event
+async def on_ready():
+    if bot.config_loading is not None:
+        await bot.config_loading
+    bot.index_counters()
+
+    now = time.monotonic()
+    if bot.ready_count == 0:
+        kind, seconds = "startup", now - PROCESS_STARTED
+    else:
+        kind, seconds = "reconnect", now - (bot.disconnected_at or now)
+    bot.ready_count += 1
+    bot.disconnected_at = None
+    READY_SECONDS.labels(kind).observe(seconds)
+    log.info(
+        "Ready",
+        extra={
+            "user": str(bot.user),
+            "guilds": len(bot.guilds),
+            "shards": SHARD_IDS,
+            "kind": kind,
+            "seconds": round(seconds, 3),
+        },
+    )
+
+    # A new session after the first may have missed messages; seeded windows
+    # only read the ones posted since, not the whole history again.
+    bot.start_reconcile(catch_up=bot.ready_count > 1)
+    if bot.ready_count == 1:
+        bot.startup_task = asyncio.create_task(after_first_ready())
+
+
+async def after_first_ready():
+    """Startup work that doesn't need to hold up on_ready."""
+    if not bot.commands_synced and (SHARD_IDS is None or 0 in SHARD_IDS):
+        # Commands are global; with several clusters only the one running
+        # shard 0 syncs them.
+        try:
+            await bot.sync_commands()
+            bot.commands_synced = True
+        except Exception:
+            log.exception("Failed to sync the command tree")
+
+    if "--restarted" in sys.argv:
+        channel_id_arg = next(
+            (arg for arg in sys.argv if arg.startswith("--channel=")), None
+        )
+        message_id_arg = next(
+            (arg for arg in sys.argv if arg.startswith("--message=")), None
+        )
+
+        if channel_id_arg and message_id_arg:
+            channel_id = int(channel_id_arg.split("=")[1])
+            message_id = int(message_id_arg.split("=")[1])
+
+            channel = bot.get_channel(channel_id)
+            if channel:
+                try:
+                    message = channel.get_partial_message(message_id)
+                    embed = discord.Embed(
+                        title="Restart Successful",
+                        description="The bot has restarted and is now online.",
+                        color=discord.Color.green(),
+                    )
+                    await message.edit(embed=embed)
+
+                except Exception:
+                    log.exception("Failed to edit the restart message")
+
+        sys.argv.remove("--restarted")
+        if channel_id_arg:
+            sys.argv.remove(channel_id_arg)
+        if message_id_arg:
+            sys.argv.remove(message_id_arg)
+
+
+@bot.event
+async def on_raw_reaction_add(payload):
+    if payload.member.id == bot.user.id:
+        return
+    emoji = str(payload.emoji)
+    if emoji not in ("❌", "🔄"):
+        return
+    # Responses sent before the last restart aren't remembered; any message
+    # of the bot is handled as before.
+    purpose = bot.responses.get(payload.message_id)
+    if purpose is None and payload.message_author_id != bot.user.id:
+        return
+    message = bot.get_partial_messageable(
+        payload.channel_id, guild_id=payload.guild_id
+    ).get_partial_message(payload.message_id)
+    if emoji == "❌":
+        bot.responses.forget(payload.message_id)
+        await message.delete()
+    elif purpose in (None, "stats"):
+        embed = generate_stats_embed(payload.guild_id, bot)
+        # The bot's own 🔄 stays on the message; only the member's reaction
+        # is removed so they can refresh again.
+        await message.remove_reaction(payload.emoji, payload.member)
+        await message.edit(embed=embed)
+
+
+@bot.event
+async def on_message(message):
+    task = bot.tasks.get(message.channel.id)
+    if task is None:
+        return
+
+    flags = message_flags(message, task)
+    window = bot.message_window(message.channel.id)
+    if window is not None:
+        window.add(message.id, *flags)
+    if task.archive:
+        bot.archive.remember(message, task.limit)
+    bot.expiry.track(message.channel.id, message.id, *flags)
+    if message.author.bot and not task.rules.bots_only:
+        return
+
+    bot.trim_scheduler.mark(message.channel)
+
+
+@bot.event
+async def on_raw_message_delete(payload):
+    window = bot.message_window(payload.channel_id)
+    if window is not None:
+        window.remove(payload.message_id)
+    bot.expiry.remove(payload.channel_id, (payload.message_id,))
+    bot.archive.discard(payload.channel_id, (payload.message_id,))
+
+
+@bot.event
+async def on_raw_bulk_message_delete(payload):
+    window = bot.message_window(payload.channel_id)
+    if window is not None:
+        for message_id in payload.message_ids:
+            window.remove(message_id)
+    bot.expiry.remove(payload.channel_id, payload.message_ids)
+    bot.archive.discard(payload.channel_id, payload.message_ids)
+
+
+@bot.event
+async def on_raw_message_edit(payload):
+    # Pinning and unpinning arrive as message updates carrying the new flag.
+    data = payload.data
+    bot_embed = None
+    if "embeds" in data and "author" in data:
+        bot_embed = bool(data["author"].get("bot", False) and data["embeds"])
+    bot.archive.update(payload.channel_id, payload.message_id, data)
+    # Edited content can change what the task's rules make of the message.
+    task = bot.tasks.get(payload.channel_id)
+    exempt = task.rules.exempts_payload(data) if task is not None else None
+    window = bot.message_window(payload.channel_id)
+    if window is not None:
+        window.update(payload.message_id, data.get("pinned"), bot_embed, exempt)
+    if exempt:
+        bot.expiry.remove(payload.channel_id, (payload.message_id,))
+        return
+    if exempt is not None:
+        bot.expiry.track(
+            payload.channel_id, payload.message_id, bool(data.get("pinned")), bool(bot_embed)
+        )
+    bot.expiry.update(payload.channel_id, payload.message_id, data.get("pinned"), bot_embed)
+
+
+async def check_role(interaction: discord.Interaction, ephemeral=None):
+    """Whether the user may manage the bot; answers if not. ``ephemeral``
+    is how the command answers, see :func:`wait_for_config`."""
+    if not await wait_for_config(interaction, ephemeral):
+        return False
+    with CHECK_ROLE_SECONDS.time():
+        return await _check_role(interaction)
+
+
+async def wait_for_config(interaction: discord.Interaction, ephemeral=None):
+    """Wait until the config is loaded; answers and returns False if it
+    couldn't be.
+
+    While loading, the interaction is deferred the way the command
+    answers: ``ephemeral``, or ``EPHEMERAL_RESPONSES`` if None. A
+    follow-up can't change the visibility of a deferred response.
+    """
+    if not bot.config_ready.is_set():
+        # Loading can outlast Discord's three seconds to answer.
+        if ephemeral is None:
+            ephemeral = EPHEMERAL_RESPONSES
+        await interaction.response.defer(ephemeral=ephemeral)
+        await bot.config_ready.wait()
+    if bot.config_error is not None:
+        await deny(interaction, CONFIG_ERROR_EMBED)
+        return False
+    return True
+
+
+async def deny(interaction: discord.Interaction, embed: discord.Embed):
+    if interaction.response.is_done():
+        await interaction.followup.send(embed=embed, ephemeral=True)
+    else:
+        await interaction.response.send_message(embed=embed, ephemeral=True)
+
+
+async def defer(interaction: discord.Interaction, ephemeral=False):
+    """Defer the response unless waiting for the config already did."""
+    if not interaction.response.is_done():
+        await interaction.response.defer(ephemeral=ephemeral)
+
+
+# Denials are answered ephemerally, so they need no dismiss reaction and
+# cost a single API call.
+NOT_IN_GUILD_EMBED = discord.Embed(
+    title="Invalid",
+    description="This command cannot be used here.",
+    color=discord.Color.red(),
+)
+NOT_SET_UP_EMBED = discord.Embed(
+    title="Setup",
+    description=(
+        "No management roles have been set for this server.\n"
+        "Use `/autodelete setup` to set roles required to use the bot."
+    ),
+    color=discord.Color.orange(),
+)
+MISSING_ROLE_EMBED = discord.Embed(
+    title="Setup",
+    description="You don't have any of the required management roles to use this command.",
+    color=discord.Color.red(),
+)
+CONFIG_ERROR_EMBED = discord.Embed(
+    title="Error",
+    description="The bot couldn't load its configuration. Check its logs and restart it.",
+    color=discord.Color.red(),
+)
+
+
+async def _check_role(interaction: discord.Interaction):
+    guild = interaction.guild
+    if not guild:
+        await deny(interaction, NOT_IN_GUILD_EMBED)
+        return False
+
+    required_roles = bot.get_management_role_set(guild.id)
+    if not required_roles:
+        await deny(interaction, NOT_SET_UP_EMBED)
+        return False
+
+    if required_roles.isdisjoint(role.id for role in interaction.user.roles):
+        await deny(interaction, MISSING_ROLE_EMBED)
+        return False
+
+    return True
+
+
+class ResponseButtons(discord.ui.View):
+    """Dismiss and refresh buttons of ephemeral command responses.
+
+    One instance, registered in ``setup_hook``, handles the clicks on every
+    response. Responses carry stopped copies from :func:`response_buttons`
+    that only provide the layout, so discord.py doesn't track a view per
+    response.
+    """
+
+    def __init__(self, refresh=True):
+        super().__init__(timeout=None)
+        if not refresh:
+            self.remove_item(self.refresh_stats)
+
+    @discord.ui.button(
+        emoji="❌", style=discord.ButtonStyle.secondary, custom_id="autodelete:dismiss"
+    )
+    async def dismiss(self, interaction, button):
+        await interaction.response.defer()
+        await interaction.delete_original_response()
+
+    @discord.ui.button(
+        emoji="🔄", style=discord.ButtonStyle.secondary, custom_id="autodelete:refresh"
+    )
+    async def refresh_stats(self, interaction, button):
+        embed = generate_stats_embed(interaction.guild_id, bot)
+        await interaction.response.edit_message(embed=embed)
+
+
+def response_buttons(refresh):
+    layout = bot.response_layouts.get(refresh)
+    if layout is None:
+        layout = bot.response_layouts[refresh] = ResponseButtons(refresh)
+        layout.stop()
+    return layout
+
+
+async def respond(interaction, embed, *, purpose="response", refresh=False, ephemeral=None):
+    """Send a command's response with a way to dismiss it.
+
+    Ephemeral responses (``EPHEMERAL_RESPONSES``) get dismiss and refresh
+    buttons and cost a single API call. Public ones get ❌ and 🔄
+    reactions and are remembered in ``bot.responses``. Works for deferred
+    interactions too; returns the public message, or None.
+    """
+    if ephemeral is None:
+        ephemeral = EPHEMERAL_RESPONSES
+    if ephemeral:
+        view = response_buttons(refresh)
+        if interaction.response.is_done():
+            await interaction.followup.send(embed=embed, view=view, ephemeral=True)
+        else:
+            await interaction.response.send_message(embed=embed, view=view, ephemeral=True)
+        return None
+
+    if interaction.response.is_done():
+        message = await interaction.followup.send(embed=embed, wait=True)
+    else:
+        await interaction.response.send_message(embed=embed)
+        message = await interaction.original_response()
+    bot.responses.remember(message.id, purpose)
+    await message.add_reaction("❌")
+    if refresh:
+        await message.add_reaction("🔄")
+    return message
+
+
+@autodelete_group.command(name="restart", description="Restarts the bot.")
+async def restart(interaction: discord.Interaction):
+    """Restarts the bot."""
+    if not await check_role(interaction, ephemeral=False):
+        return
+
+    embed = discord.Embed(
+        title="Restarting",
+        description="The bot is restarting... Please wait a moment.",
+        color=discord.Color.orange(),
+    )
+    await defer(interaction)
+    # The response is edited through the channel after the restart, so it
+    # can't be ephemeral.
+    message = await respond(interaction, embed, purpose="restart", ephemeral=False)
+
+    channel_id = interaction.channel.id
+    message_id = message.id
+
+    bot.restart_argv = (
+        [sys.executable]
+        + sys.argv
+        + ["--restarted", f"--channel={channel_id}", f"--message={message_id}"]
+    )
+    # close() flushes counters and the expiry schedule; the process then
+    # replaces itself with a fresh interpreter (see the bottom of this file).
+    await bot.close()
+
+
+@autodelete_group.command(
+    name="reload",
+    description="Reload tasks and settings from storage without restarting.",
+)
+async def reload(interaction: discord.Interaction):
+    if not await check_role(interaction):
+        return
+
+    await defer(interaction, ephemeral=EPHEMERAL_RESPONSES)
+    started = time.perf_counter()
+    await bot.reload_config()
+    embed = discord.Embed(
+        title="Reloaded",
+        description=(
+            f"Loaded `{len(bot.tasks)}` tasks in "
+            f"`{(time.perf_counter() - started) * 1000:.0f}ms` without restarting."
+        ),
+        color=discord.Color.green(),
+    )
+    await respond(interaction, embed)
+
+
+@autodelete_group.command(
+    name="setup", description="Set the management roles required to use the bot."
+)
+@app_commands.describe(
+    roles="Mention all roles required to manage the bot, separated by spaces."
+)
+async def setup(interaction: discord.Interaction, roles: str):
+    guild = interaction.guild
+    if not guild:
+        embed = discord.Embed(
+            title="Error",
+            description="This command must be used in a server.",
+            color=discord.Color.red(),
+        )
+        await respond(interaction, embed)
+        return
+
+    if not await wait_for_config(interaction):
+        return
+    role_ids = []
+    for role_str in roles.split():
+        if role_str.startswith("<@&") and role_str.endswith(">"):
+            try:
+                role_id = int(role_str[3:-1])
+                role = guild.get_role(role_id)
+                if role:
+                    role_ids.append(role_id)
+            except ValueError:
+                pass
+
+    if not role_ids:
+        embed = discord.Embed(
+            title="Error",
+            description="No valid roles were provided.",
+            color=discord.Color.red(),
+        )
+        await respond(interaction, embed)
+        return
+
+    await bot.set_management_roles(interaction.guild_id, role_ids)
+    embed = discord.Embed(
+        title="Roles Set",
+        description=f"The following roles have been set: {', '.join([f'<@&{role_id}>' for role_id in role_ids])}",
+        color=discord.Color.green(),
+    )
+    await respond(interaction, embed)
+
+def format_max_age(max_age) -> str:
+    return f"{max_age} minutes" if max_age else "Off"
+
+
+def format_rules(rules: TaskRules) -> str:
+    parts = []
+    if rules.bots_only:
+        parts.append("bots only")
+    if rules.attachments_only:
+        parts.append("attachments only")
+    if rules.pattern:
+        parts.append(f"matching `{rules.pattern}`")
+    if rules.min_age:
+        parts.append(f"older than {rules.min_age} minutes")
+    exempt = [f"<@&{role_id}>" for role_id in sorted(rules.exempt_roles)]
+    exempt += [f"<@{user_id}>" for user_id in sorted(rules.exempt_users)]
+    if exempt:
+        parts.append("except " + " ".join(exempt))
+    return ", ".join(parts) if parts else "`Off`"
+
+
+def parse_ids(text: str, prefix: str) -> list:
+    """Ids from mentions such as ``<@&123>`` for the ``@&`` prefix, or bare ids."""
+    ids = []
+    for part in text.replace(",", " ").split():
+        if part.startswith(f"<{prefix}") and part.endswith(">"):
+            part = part[len(prefix) + 1 : -1].lstrip("!")
+        if part.isdigit():
+            ids.append(int(part))
+    return ids
+
+
+def invalid_rules_embed(error: ValueError) -> discord.Embed:
+    return discord.Embed(
+        title="Invalid rules", description=str(error), color=discord.Color.red()
+    )
+
+
+@autodelete_group.command(name="add", description="Add a new task.")
+@app_commands.describe(
+    channel="The channel to configure.",
+    limit="Maximum number of messages allowed.",
+    pins="Delete pinned messages.",
+    embeds="Delete bot embeds.",
+    enabled="Enable or disable the task.",
+    max_age="Also delete messages older than this many minutes.",
+    exempt_roles="Mention roles whose members' messages are never deleted.",
+    exempt_users="Mention users whose messages are never deleted.",
+    attachments_only="Only delete messages with attachments.",
+    bots_only="Only delete messages sent by bots.",
+    pattern="Only delete messages whose content matches this regular expression.",
+    min_age="Keep messages younger than this many minutes even over the limit.",
+    archive="Archive the messages the task deletes.",
+)
+async def add(
+    interaction: discord.Interaction,
+    channel: discord.TextChannel,
+    limit: int,
+    pins: bool = False,
+    embeds: bool = False,
+    enabled: bool = True,
+    max_age: app_commands.Range[int, 1] = None,
+    exempt_roles: str = None,
+    exempt_users: str = None,
+    attachments_only: bool = False,
+    bots_only: bool = False,
+    pattern: str = None,
+    min_age: app_commands.Range[int, 1] = None,
+    archive: bool = False,
+):
+    if not await check_role(interaction):
+        return
+    rules = TaskRules(
+        exempt_roles=parse_ids(exempt_roles or "", "@&"),
+        exempt_users=parse_ids(exempt_users or "", "@"),
+        attachments_only=attachments_only,
+        bots_only=bots_only,
+        pattern=pattern,
+        min_age=min_age,
+    )
+    try:
+        rules.validate()
+    except ValueError as e:
+        await respond(interaction, invalid_rules_embed(e))
+        return
+    task = ChannelTask(
+        channel.id,
+        interaction.guild.id,
+        limit,
+        pins=pins,
+        embeds=embeds,
+        enabled=enabled,
+        max_age=max_age,
+        rules=rules,
+        archive=archive,
+    )
+    previous = bot.tasks.get(channel.id)
+    if previous is not None and (previous.rules, previous.archive) != (rules, archive):
+        # The window and archive records were built for the replaced task.
+        bot.reset_window(channel.id)
+    await bot.save_tasks([task])
+    embed = discord.Embed(
+        title="Task added",
+        description=(
+            f"A task has been added for {channel.mention}.\n\n"
+            f"Enabled: `{'Yes' if enabled else 'No'}`\n"
+            f"Message Limit: `{limit}`\n"
+            f"Max Age: `{format_max_age(max_age)}`\n"
+            f"Delete Pins: `{'Yes' if pins else 'No'}`\n"
+            f"Delete Embeds: `{'Yes' if embeds else 'No'}`\n"
+            f"Archive: `{'Yes' if archive else 'No'}`\n"
+            f"Rules: {format_rules(rules)}"
+        ),
+        color=discord.Color.green(),
+    )
+    await respond(interaction, embed)
+
+@autodelete_group.command(name="remove", description="Remove a task.")
+@app_commands.describe(channel="The channel name the task should be removed from.")
+async def remove(interaction: discord.Interaction, channel: discord.TextChannel):
+    if not await check_role(interaction):
+        return
+    if channel.id in bot.tasks:
+        await bot.remove_tasks([channel.id])
+        embed = discord.Embed(
+            title="Task removed",
+            description=f"A task has been removed for {channel.mention}.",
+            color=discord.Color.red(),
+        )
+    else:
+        embed = discord.Embed(
+            title="No task",
+            description=f"No task was found for {channel.mention}.",
+            color=discord.Color.orange(),
+        )
+    await respond(interaction, embed)
+
+class TaskListView(discord.ui.View):
+    """Previous, next and close buttons for the pages of ``/autodelete list``.
+
+    The view is dropped when it times out or the message is closed, so open
+    lists don't pile up listeners. Buttons are removed on timeout.
+    """
+
+    def __init__(self, pages, interaction):
+        super().__init__(timeout=LIST_TIMEOUT)
+        self.pages = pages
+        self.page = 0
+        self.interaction = interaction
+        if len(pages) == 1:
+            self.remove_item(self.previous_page)
+            self.remove_item(self.next_page)
+        self.update_buttons()
+
+    def update_buttons(self):
+        self.previous_page.disabled = self.page == 0
+        self.next_page.disabled = self.page == len(self.pages) - 1
+
+    async def show(self, interaction, page):
+        self.page = page
+        self.update_buttons()
+        await interaction.response.edit_message(embed=self.pages[page], view=self)
+
+    @discord.ui.button(emoji="◀️", style=discord.ButtonStyle.secondary)
+    async def previous_page(self, interaction, button):
+        await self.show(interaction, max(self.page - 1, 0))
+
+    @discord.ui.button(emoji="▶️", style=discord.ButtonStyle.secondary)
+    async def next_page(self, interaction, button):
+        await self.show(interaction, min(self.page + 1, len(self.pages) - 1))
+
+    @discord.ui.button(emoji="❌", style=discord.ButtonStyle.secondary)
+    async def close(self, interaction, button):
+        self.stop()
+        await interaction.response.defer()
+        await interaction.delete_original_response()
+
+    async def on_timeout(self):
+        try:
+            await self.interaction.edit_original_response(view=None)
+        except discord.HTTPException:
+            pass
+
+
+@autodelete_group.command(name="list", description="View all existing tasks.")
+async def list_tasks(interaction: discord.Interaction):
+    if not await check_role(interaction):
+        return
+
+    if not bot.get_guild_tasks(interaction.guild_id):
+        embed = discord.Embed(
+            title="No tasks",
+            description="There are no available tasks.\nUse `/autodelete` to `add`, `remove`, or `edit` a task.\nUse `/autodelete help` for a list of commands.",
+            color=discord.Color.orange(),
+        )
+        await respond(interaction, embed)
+        return
+
+    view = TaskListView(generate_task_pages(interaction.guild_id, bot), interaction)
+    if interaction.response.is_done():
+        await interaction.followup.send(embed=view.pages[0], view=view)
+    else:
+        await interaction.response.send_message(embed=view.pages[0], view=view)
+
+
+def generate_task_pages(guild_id: int, bot: AutoDeleteBot) -> list:
+    """The task list embeds of a guild, rendered once until its tasks change."""
+    stats = bot.get_guild_stats(guild_id)
+    if stats.pages is None:
+        stats.pages = render_task_pages(list(bot.get_guild_tasks(guild_id).values()), bot)
+    return stats.pages
+
+
+def render_task_pages(tasks, bot: AutoDeleteBot) -> list:
+    total_pages = (len(tasks) + LIST_PAGE_SIZE - 1) // LIST_PAGE_SIZE
+    pages = []
+    for page in range(total_pages):
+        start_idx = page * LIST_PAGE_SIZE
+        page_tasks = tasks[start_idx : start_idx + LIST_PAGE_SIZE]
+
+        embed = discord.Embed(
+            title=f"Tasks (Page {page + 1}/{total_pages})",
+            description="Use  `/autodelete` to `add`, `remove`, or `edit` a task.\n\n",
+            color=discord.Color.green(),
+        )
+
+        for index, task in enumerate(page_tasks):
+            channel = bot.get_channel(task.channel_id)
+            if channel:
+                task_info = (
+                    f"Enabled: `{'Yes' if task.enabled else 'No'}`\n"
+                    f"Message Limit: `{task.limit}`\n"
+                    f"Max Age: `{format_max_age(task.max_age)}`\n"
+                    f"Delete Pins: `{'Yes' if task.pins else 'No'}`\n"
+                    f"Delete Embeds: `{'Yes' if task.embeds else 'No'}`\n"
+                    f"Archive: `{'Yes' if task.archive else 'No'}`\n"
+                    f"Rules: {format_rules(task.rules)}"
+                )
+                embed.add_field(
+                    name=f"{start_idx + index + 1} - {channel.mention}",
+                    value=task_info,
+                    inline=False,
+                )
+        pages.append(embed)
+    return pages
+
+
+def generate_stats_embed(guild_id: int, bot: AutoDeleteBot) -> discord.Embed:
+    stats = bot.get_guild_stats(guild_id)
+    if stats.embed is None:
+        stats.embed = render_stats_embed(guild_id, bot, stats)
+    return stats.embed
+
+
+def render_stats_embed(guild_id: int, bot: AutoDeleteBot, stats: GuildStats) -> discord.Embed:
+    management_roles = bot.get_management_roles(guild_id)
+
+    if management_roles:
+        roles_mentions = ", ".join(f"<@&{role_id}>" for role_id in management_roles)
+    else:
+        roles_mentions = "None"
+
+    deleted_counts = [
+        f"<#{channel_id}>: `{count}`"
+        for channel_id, count in bot.guild_deleted.get(guild_id, {}).items()
+    ]
+
+    description = (
+        f"Total tasks: `{stats.tasks}`\n"
+        f"Active tasks: `{stats.active}`\n"
+        f"Inactive tasks: `{stats.tasks - stats.active}`\n"
+        f"Management roles: {roles_mentions}\n\n"
+        f"Deleted messages per channel:\n\n" + "\n".join(deleted_counts) + "\n\n"
+        f"Total deleted messages: `{stats.deleted}`"
+    )
+
+    return discord.Embed(
+        title="Statistics", description=description, color=discord.Color.brand_green()
+    )
+
+
+@autodelete_group.command(name="edit", description="Edit an existing task.")
+@app_commands.describe(
+    channel="The channel whose task you want to edit.",
+    limit="The new limit for ",
+    pins="Toggle deleting pinned messages.",
+    embeds="Toggle deleting bot embeds.",
+    enabled="Enable or disable the task.",
+    max_age="Delete messages older than this many minutes; 0 turns it off.",
+    exempt_roles="Mention roles whose members' messages are never deleted; `none` clears.",
+    exempt_users="Mention users whose messages are never deleted; `none` clears.",
+    attachments_only="Only delete messages with attachments.",
+    bots_only="Only delete messages sent by bots.",
+    pattern="Only delete messages matching this regular expression; `none` clears.",
+    min_age="Keep messages younger than this many minutes; 0 turns it off.",
+    archive="Archive the messages the task deletes.",
+)
+async def edit(
+    interaction: discord.Interaction,
+    channel: discord.TextChannel,
+    limit: int = None,
+    pins: bool = None,
+    embeds: bool = None,
+    enabled: bool = None,
+    max_age: app_commands.Range[int, 0] = None,
+    exempt_roles: str = None,
+    exempt_users: str = None,
+    attachments_only: bool = None,
+    bots_only: bool = None,
+    pattern: str = None,
+    min_age: app_commands.Range[int, 0] = None,
+    archive: bool = None,
+):
+    if not await check_role(interaction):
+        return
+
+    task = bot.tasks.get(channel.id)
+    if task is None:
+        embed = discord.Embed(
+            title="Task not found",
+            description=f"Coudn't find a task for {channel.mention}.",
+            color=discord.Color.orange(),
+        )
+        await respond(interaction, embed)
+        return
+
+    changes = {}
+    if exempt_roles is not None:
+        changes["exempt_roles"] = parse_ids(exempt_roles, "@&")
+    if exempt_users is not None:
+        changes["exempt_users"] = parse_ids(exempt_users, "@")
+    if attachments_only is not None:
+        changes["attachments_only"] = attachments_only
+    if bots_only is not None:
+        changes["bots_only"] = bots_only
+    if pattern is not None:
+        changes["pattern"] = None if pattern.lower() == "none" else pattern
+    if min_age is not None:
+        changes["min_age"] = min_age or None
+    rules = task.rules.replace(**changes)
+    try:
+        rules.validate()
+    except ValueError as e:
+        await respond(interaction, invalid_rules_embed(e))
+        return
+
+    if limit is not None:
+        task.limit = limit
+    if pins is not None:
+        task.pins = pins
+    if embeds is not None:
+        task.embeds = embeds
+    if enabled is not None:
+        task.enabled = enabled
+    if max_age is not None:
+        task.max_age = max_age or None
+
+    # The window's flags and the archive's records both depend on these.
+    if rules != task.rules or (archive is not None and archive != task.archive):
+        task.rules = rules
+        if archive is not None:
+            task.archive = archive
+        bot.reset_window(channel.id)
+
+    await bot.save_tasks([task])
+    embed = discord.Embed(
+        title="Task updated",
+        description=f"The task for {channel.mention} has been updated.\n\n"
+        f"Enabled: `{'Yes' if task.enabled else 'No'}`\n"
+        f"Message Limit: `{task.limit}`\n"
+        f"Max Age: `{format_max_age(task.max_age)}`\n"
+        f"Delete Pins: `{'Yes' if task.pins else 'No'}`\n"
+        f"Delete Embeds: `{'Yes' if task.embeds else 'No'}`\n"
+        f"Archive: `{'Yes' if task.archive else 'No'}`\n"
+        f"Rules: {format_rules(task.rules)}",
+        color=discord.Color.green(),
+    )
+    await respond(interaction, embed)
+
+@autodelete_group.command(
+    name="export", description="Download a channel's archived messages."
+)
+@app_commands.describe(
+    channel="The channel whose archive you want.",
+    days="Include messages sent within this many days.",
+)
+async def export(
+    interaction: discord.Interaction,
+    channel: discord.TextChannel,
+    days: app_commands.Range[int, 1, 365] = 7,
+):
+    # Archived content is only ever shown to the caller.
+    if not await check_role(interaction, ephemeral=True):
+        return
+    await defer(interaction, ephemeral=True)
+
+    since = discord.utils.time_snowflake(
+        discord.utils.utcnow() - datetime.timedelta(days=days)
+    )
+    try:
+        paths = await bot.archive.segments(interaction.guild.id, channel.id, since)
+    except RuntimeError as e:
+        embed = discord.Embed(
+            title="Archive busy",
+            description=f"{e} Try again in a moment.",
+            color=discord.Color.orange(),
+        )
+        await interaction.followup.send(embed=embed, ephemeral=True)
+        return
+
+    # Newest segments first, as many as fit in one message.
+    files = []
+    total = 0
+    for path in reversed(paths):
+        size = os.path.getsize(path)
+        if len(files) == EXPORT_MAX_FILES or total + size > interaction.guild.filesize_limit:
+            break
+        files.append(path)
+        total += size
+    files.reverse()
+
+    if not files:
+        embed = discord.Embed(
+            title="No archive",
+            description=f"No archived messages from {channel.mention} in the last `{days}` days.",
+            color=discord.Color.orange(),
+        )
+        await interaction.followup.send(embed=embed, ephemeral=True)
+        return
+
+    description = (
+        f"Archived messages from {channel.mention}, one JSON object per line.\n\n"
+        f"Segments: `{len(files)}`"
+    )
+    if len(files) < len(paths):
+        description += (
+            f"\n\nOnly the newest `{len(files)}` of `{len(paths)}` segments fit in one message."
+        )
+    embed = discord.Embed(
+        title="Archive export", description=description, color=discord.Color.green()
+    )
+    await interaction.followup.send(
+        embed=embed, files=[discord.File(path) for path in files], ephemeral=True
+    )
+
+
+@autodelete_group.command(
+    name="stats", description="View this server's bot statistics."
+)
+async def stats(interaction: discord.Interaction):
+    if not await check_role(interaction):
+        return
+
+    embed = generate_stats_embed(interaction.guild.id, bot)
+    await respond(interaction, embed, purpose="stats", refresh=True)
+
+
+def format_seconds(seconds: float) -> str:
+    return "∞" if seconds == math.inf else f"{seconds * 1000:.0f}ms"
+
+
+def summarize_histogram(histogram) -> str:
+    children = [child for child in histogram.children.values() if child.count]
+    if not children:
+        return "`no samples`"
+    count = sum(child.count for child in children)
+    p50 = max(child.quantile(0.5) for child in children)
+    p99 = max(child.quantile(0.99) for child in children)
+    return f"`{count}` samples, p50 ≤ `{format_seconds(p50)}`, p99 ≤ `{format_seconds(p99)}`"
+
+
+def pacing_summary(slowest=3):
+    """The pacer's bucket state: the global bucket, how many route buckets
+    are blocked, and the routes paced the slowest."""
+    snapshot = bot.pacer.snapshot()
+    global_bucket = snapshot["global"]
+    routes = snapshot["routes"]
+    blocked = sum(1 for bucket in routes.values() if bucket["blocked_for"] > 0)
+    lines = [
+        f"Global: `{global_bucket['tokens']:.1f}`/`{global_bucket['capacity']:g}` tokens "
+        f"at `{global_bucket['rate']:g}`/s",
+        f"Routes: `{len(routes)}`, blocked: `{blocked}`",
+    ]
+    for route, bucket in sorted(routes.items(), key=lambda item: item[1]["rate"])[:slowest]:
+        line = f"`{route}`: `{bucket['rate']:g}`/s"
+        if bucket["blocked_for"] > 0:
+            line += f", blocked for `{bucket['blocked_for']:g}s`"
+        lines.append(line)
+    return "\n".join(lines)
+
+
+@autodelete_group.command(
+    name="metrics", description="View the bot's performance metrics."
+)
+async def metrics_command(interaction: discord.Interaction):
+    if not await check_role(interaction):
+        return
+
+    embed = discord.Embed(title="Metrics", color=discord.Color.brand_green())
+    embed.add_field(
+        name="Trims",
+        value=(
+            f"Queue depth: `{bot.trim_scheduler.queue_depth}`, "
+            f"coalesced: `{TRIM_COALESCED.value:.0f}`\n"
+            f"Duration: {summarize_histogram(TRIM_SECONDS)}\n"
+            f"Queue wait: {summarize_histogram(TRIM_QUEUE_WAIT_SECONDS)}\n"
+            f"Lock wait: {summarize_histogram(TRIM_LOCK_WAIT_SECONDS)}"
+        ),
+        inline=False,
+    )
+    embed.add_field(
+        name="Deletes",
+        value=(
+            f"Deleted messages: `{DELETED_MESSAGES.value:.0f}`\n"
+            f"Bulk calls: `{DELETE_CALLS.labels('bulk').value:.0f}`\n"
+            f"Single calls: `{DELETE_CALLS.labels('single').value:.0f}`\n"
+            f"Latency: {summarize_histogram(DELETE_SECONDS)}\n"
+            f"Queue wait: {summarize_histogram(DELETE_QUEUE_WAIT_SECONDS)}\n"
+            f"Waiting calls: `{bot.deletions.waiting}`\n"
+            f"Rate limited: `{RATE_LIMITED.value:.0f}`"
+        ),
+        inline=False,
+    )
+    embed.add_field(name="Pacing", value=pacing_summary(), inline=False)
+    embed.add_field(
+        name="History",
+        value=(
+            f"Pages fetched: `{HISTORY_PAGES.value:.0f}`\n"
+            f"Scans: {summarize_histogram(HISTORY_SCAN_SECONDS)}"
+        ),
+        inline=False,
+    )
+    embed.add_field(
+        name="Archive",
+        value=(
+            f"Archived messages: `{bot.archive.archived}`\n"
+            f"Dropped (queue full): `{bot.archive.dropped}`"
+        ),
+        inline=False,
+    )
+    embed.add_field(
+        name="Startup",
+        value=(
+            f"Ready events: `{bot.ready_count}`\n"
+            f"Time to ready: {summarize_histogram(READY_SECONDS)}"
+        ),
+        inline=False,
+    )
+    embed.add_field(
+        name="Storage and checks",
+        value=(
+            f"Storage: {summarize_histogram(STORAGE_SECONDS)}\n"
+            f"Role checks: {summarize_histogram(CHECK_ROLE_SECONDS)}"
+        ),
+        inline=False,
+    )
+
+    await respond(interaction, embed)
+
+
+@autodelete_group.command(
+    name="disable", description="Bulk disable all tasks for this server."
+)
+async def disable(interaction: discord.Interaction):
+    await toggle_all(interaction, False)
+
+
+@autodelete_group.command(
+    name="enable", description="Bulk enable all tasks for this server."
+)
+async def enable(interaction: discord.Interaction):
+    await toggle_all(interaction, True)
+
+
+async def toggle_all(interaction: discord.Interaction, enabled: bool):
+    if not await check_role(interaction):
+        return
+
+    affected_tasks = list(bot.get_guild_tasks(interaction.guild_id).values())
+    for task in affected_tasks:
+        task.enabled = enabled
+
+    await bot.save_tasks(affected_tasks)
+
+    embed = discord.Embed(
+        title=f"Tasks {'enabled' if enabled else 'disabled'}",
+        description=f"All tasks have been {'`enabled`' if enabled else '`disabled`'} for this server.",
+        color=discord.Color.green(),
+    )
+
+    await respond(interaction, embed)
+
+@autodelete_group.command(
+    name="help", description="Displays a list of all available commands."
+)
+async def help(interaction: discord.Interaction):
+    """Displays a detailed list of all commands."""
+    if not await check_role(interaction):
+        return
+    embed = discord.Embed(
+        title="Commands",
+        description="Here is a list of all available commands:",
+        color=discord.Color.green(),
+    )
+
+    for command in bot.tree.walk_commands():
+        embed.add_field(
+            name=f"/{command.qualified_name}",
+            value=f"`{command.description}`",
+            inline=True,
+        )
+
+    await respond(interaction, embed)
+
+@autodelete_group.command(name="purge", description="Purge all tasks for this server.")
+async def purge(interaction: discord.Interaction):
+    if not await check_role(interaction):
+        return
+
+    tasks_to_delete = list(bot.get_guild_tasks(interaction.guild_id))
+
+    if not tasks_to_delete:
+        embed = discord.Embed(
+            title="No tasks",
+            description="There are no tasks added for this server.",
+            color=discord.Color.orange(),
+        )
+        await respond(interaction, embed)
+        return
+
+    class ConfirmPurgeModal(discord.ui.Modal):
+        def __init__(self):
+            super().__init__(title="Confirm")
+
+            self.add_item(
+                discord.ui.TextInput(
+                    label="Type 'YES' to confirm.",
+                    placeholder="YES",
+                    required=True,
+                    max_length=3,
+                )
+            )
+
+        async def on_submit(self, interaction: discord.Interaction):
+            if not await check_role(interaction):
+                return
+            if self.children[0].value != "YES":
+                await interaction.response.send_message(
+                    embed=discord.Embed(
+                        title="Purge cancelled",
+                        description="You did not confirm the action. Task purge has been cancelled.",
+                        color=discord.Color.green(),
+                    ),
+                    ephemeral=True,
+                )
+                return
+
+            await bot.remove_tasks(tasks_to_delete)
+
+            success_embed = discord.Embed(
+                title="Purge finished",
+                description="All tasks for this server have been successfully purged.",
+                color=discord.Color.red(),
+            )
+
+            await respond(interaction, success_embed)
+    if interaction.response.is_done():
+        # A modal has to be the first response; the bot was still loading.
+        embed = discord.Embed(
+            title="Purge cancelled",
+            description="The bot was still starting. Use `/autodelete purge` again.",
+            color=discord.Color.orange(),
+        )
+        await respond(interaction, embed)
+        return
+    await interaction.response.send_modal(ConfirmPurgeModal())
+
+
+bot.tree.add_command(autodelete_group)
+
+if __name__ == "__main__":
+    log_listener = setup_logging(
+        LOG_LEVEL,
+        LOG_FORMAT,
+        LOG_SAMPLE_RATE,
+        fields={"cluster": CLUSTER_ID} if CLUSTER_ID is not None else None,
+    )
+    try:
+        if DISCORD_TOKEN:
+            # Logging is already set up; keep discord.py from adding its own handler.
+            bot.run(DISCORD_TOKEN, log_handler=None)
+        else:
+            log.error("DISCORD_TOKEN is not set in the .env file.")
+    finally:
+        log_listener.stop()
+    if bot.restart_argv is not None:
+        # Same PID, so a launcher or service manager sees no exit.
+        os.execv(sys.executable, bot.restart_argv)
@@ -0,0 +1,369 @@
+"""Offline benchmarks for the trim path and the slash commands.
+
+Runs the real handlers from ``autodelete.py`` against the fakes in
+``fakes.py``, so no token or guild is needed::
+
+    python bench/bench_autodelete.py
+    python bench/bench_autodelete.py --messages 10000 --tasks 1000 --latency 0.05
+    python bench/bench_autodelete.py --rate-limit-chance 0.05 --json results.json
+
+Each scenario reports latency percentiles, REST calls by route and peak
+traced memory. The bot uses a throwaway SQLite database in a temporary
+directory.
+"""
+
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import fakes  # noqa: E402
+
+
+def percentiles(samples):
+    if not samples:
+        return {}
+    ordered = sorted(samples)
+
+    def pick(fraction):
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+    return {
+        "count": len(ordered),
+        "mean": statistics.fmean(ordered),
+        "p50": pick(0.50),
+        "p90": pick(0.90),
+        "p99": pick(0.99),
+        "max": ordered[-1],
+    }
+
+
+class World:
+    """Guilds, channels and a management user wired into the bot."""
+
+    def __init__(self, autodelete, api):
+        self.autodelete = autodelete
+        self.bot = autodelete.bot
+        self.api = api
+        self.channels = {}
+        self.guilds = {}
+        self.snowflakes = fakes.SnowflakeFactory()
+        self.member = fakes.FakeUser(1, bot=False)
+        self.bot_user = fakes.FakeUser(2, bot=True)
+        self.ids = iter(range(10_000, 10**12))
+        self.bot.get_channel = self.channels.get
+
+    def guild(self):
+        guild_id = next(self.ids)
+        role = fakes.FakeRole(next(self.ids), "manager")
+        guild = fakes.FakeGuild(guild_id, roles=[role])
+        self.guilds[guild_id] = guild
+        self.member.roles.append(role)
+        self.bot.cache_management_roles(guild_id, [role.id])
+        return guild
+
+    def channel(self, guild):
+        channel = fakes.FakeChannel(next(self.ids), guild, self.api)
+        self.channels[channel.id] = channel
+        return channel
+
+    def fill(self, channel, count, old_fraction=0.0, pinned_every=0):
+        old = int(count * old_fraction)
+        for index in range(count):
+            if index < old:
+                age = datetime.timedelta(days=30, seconds=count - index)
+            else:
+                age = datetime.timedelta(seconds=count - index)
+            channel.add(
+                fakes.FakeMessage(
+                    self.snowflakes(age),
+                    channel,
+                    self.member,
+                    content=f"message {index}",
+                    pinned=bool(pinned_every) and index % pinned_every == 0,
+                )
+            )
+
+    def post(self, channel, author=None):
+        message = fakes.FakeMessage(
+            self.snowflakes(), channel, author or self.member, content="new message"
+        )
+        channel.add(message)
+        return message
+
+    def interaction(self, guild):
+        channel = next(iter(guild.channels.values()), None) or self.channel(guild)
+        return fakes.FakeInteraction(self.api, guild, channel, self.member)
+
+
+async def drain(bot):
+    """Wait until the trim scheduler has no work left."""
+    while bot.trim_scheduler.workers:
+        await asyncio.gather(*list(bot.trim_scheduler.workers.values()))
+
+
+async def add_task(world, channel, limit, **options):
+    task = world.autodelete.ChannelTask(channel.id, channel.guild.id, limit, **options)
+    await world.bot.save_tasks([task])
+
+
+async def bench_cold_trim(world, args):
+    """One message arrives in a channel far over its limit; the window is seeded first."""
+    guild = world.guild()
+    channel = world.channel(guild)
+    world.fill(channel, args.messages, old_fraction=args.old_fraction, pinned_every=50)
+    await add_task(world, channel, args.limit)
+    world.api.reset()
+    tracemalloc.start()
+    started = time.perf_counter()
+    await world.autodelete.on_message(world.post(channel))
+    await drain(world.bot)
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        "seconds": elapsed,
+        "api_calls": dict(world.api.calls),
+        "rate_limited": world.api.rate_limited,
+        "remaining_messages": len(channel.messages),
+        "peak_memory_kib": peak / 1024,
+    }
+
+
+async def bench_steady_trims(world, args):
+    """Messages arrive one at a time in a seeded channel at its limit."""
+    guild = world.guild()
+    channel = world.channel(guild)
+    world.fill(channel, args.limit)
+    await add_task(world, channel, args.limit)
+    await world.bot.seed_window(channel)
+    world.api.reset()
+    latencies = []
+    for _ in range(args.steady):
+        started = time.perf_counter()
+        await world.autodelete.on_message(world.post(channel))
+        await drain(world.bot)
+        latencies.append(time.perf_counter() - started)
+    return {
+        "trim_latency": percentiles(latencies),
+        "api_calls": dict(world.api.calls),
+        "api_calls_per_trim": world.api.total_calls / max(args.steady, 1),
+        "rate_limited": world.api.rate_limited,
+    }
+
+
+async def bench_burst(world, args):
+    """Many messages land in a few channels at once."""
+    guild = world.guild()
+    channels = [world.channel(guild) for _ in range(args.burst_channels)]
+    for channel in channels:
+        world.fill(channel, args.limit)
+        await add_task(world, channel, args.limit)
+        await world.bot.seed_window(channel)
+    world.api.reset()
+    scheduler = world.bot.trim_scheduler
+    trims_before, coalesced_before = scheduler.trims, scheduler.coalesced
+    handler_latencies = []
+    started = time.perf_counter()
+    for index in range(args.burst):
+        message = world.post(channels[index % len(channels)])
+        handler_started = time.perf_counter()
+        await world.autodelete.on_message(message)
+        handler_latencies.append(time.perf_counter() - handler_started)
+    await drain(world.bot)
+    return {
+        "seconds": time.perf_counter() - started,
+        "handler_latency": percentiles(handler_latencies),
+        "trims": scheduler.trims - trims_before,
+        "coalesced": scheduler.coalesced - coalesced_before,
+        "api_calls": dict(world.api.calls),
+        "remaining_over_limit": sum(
+            max(0, len(channel.messages) - args.limit) for channel in channels
+        ),
+    }
+
+
+async def bench_fairness(world, args):
+    """Steady trims in small guilds while one guild clears a backlog in several channels.
+
+    The backlog is older than 14 days, so it is deleted one message per
+    call. Small guilds post every ``--fair-interval`` seconds, taking turns,
+    so each of their channels stays within its own route's rate and only
+    contention with the backlog shows. Run with ``--latency`` for the
+    calls to contend for slots.
+    """
+    busy = world.guild()
+    backlog = [world.channel(busy) for _ in range(args.backlog_channels)]
+    for channel in backlog:
+        world.fill(channel, args.limit + args.backlog, old_fraction=1.0)
+        await add_task(world, channel, args.limit)
+        await world.bot.seed_window(channel)
+    small = []
+    for _ in range(args.fair_guilds):
+        channel = world.channel(world.guild())
+        world.fill(channel, args.limit)
+        await add_task(world, channel, args.limit)
+        await world.bot.seed_window(channel)
+        small.append(channel)
+    world.api.reset()
+    started = time.perf_counter()
+    for channel in backlog:
+        world.bot.trim_scheduler.mark(channel)
+    await asyncio.sleep(0)
+
+    latencies = []
+
+    async def timed_trim(channel):
+        trim_started = time.perf_counter()
+        await world.autodelete.on_message(world.post(channel))
+        worker = world.bot.trim_scheduler.workers.get(channel.id)
+        if worker is not None:
+            await worker
+        latencies.append(time.perf_counter() - trim_started)
+
+    trims = []
+    for index in range(args.steady):
+        trims.append(asyncio.create_task(timed_trim(small[index % len(small)])))
+        await asyncio.sleep(args.fair_interval)
+    await asyncio.gather(*trims)
+    backlog_left = sum(len(channel.messages) - args.limit for channel in backlog)
+    await drain(world.bot)
+    return {
+        "small_guild_trim_latency": percentiles(latencies),
+        "backlog_left_after_small_trims": backlog_left,
+        "backlog_seconds": time.perf_counter() - started,
+        "api_calls": dict(world.api.calls),
+    }
+
+
+async def bench_commands(world, args):
+    """Slash command handlers on a bot with many tasks."""
+    autodelete = world.autodelete
+    guilds = [world.guild() for _ in range(args.guilds)]
+    for index in range(args.tasks):
+        guild = guilds[index % len(guilds)]
+        await add_task(world, world.channel(guild), args.limit)
+
+    commands = {
+        "list": (autodelete.list_tasks.callback, {}),
+        "stats": (autodelete.stats.callback, {}),
+        "disable": (autodelete.disable.callback, {}),
+        "enable": (autodelete.enable.callback, {}),
+    }
+    results = {}
+    for name, (callback, kwargs) in commands.items():
+        world.api.reset()
+        latencies = []
+        for repeat in range(args.command_repeats):
+            interaction = world.interaction(guilds[repeat % len(guilds)])
+            started = asyncio.get_running_loop().time()
+            command = asyncio.create_task(callback(interaction, **kwargs))
+            # Only the time to the first response is measured.
+            await asyncio.wait(
+                {command, asyncio.create_task(interaction.responded.wait())},
+                return_when=asyncio.FIRST_COMPLETED,
+            )
+            await asyncio.sleep(0)
+            if interaction.responded_at is not None:
+                latencies.append(interaction.responded_at - started)
+            if not command.done():
+                command.cancel()
+        results[name] = {
+            "latency": percentiles(latencies),
+            "api_calls_per_command": world.api.total_calls / args.command_repeats,
+        }
+    return results
+
+
+SCENARIOS = {
+    "cold_trim": bench_cold_trim,
+    "steady_trims": bench_steady_trims,
+    "burst": bench_burst,
+    "fairness": bench_fairness,
+    "commands": bench_commands,
+}
+
+
+def print_report(results):
+    for name, result in results.items():
+        print(f"== {name}")
+        print(json.dumps(result, indent=2, default=str))
+
+
+async def run(args):
+    import autodelete
+
+    pacer = autodelete.bot.pacer
+    api = fakes.FakeAPI(
+        latency=args.latency,
+        jitter=args.jitter,
+        rate_limit_chance=args.rate_limit_chance,
+        retry_after=args.retry_after,
+        pacer=pacer,
+    )
+    results = {}
+    async with autodelete.bot:
+        await autodelete.bot.load_config()
+        autodelete.bot.trim_scheduler.debounce = args.debounce
+        world = World(autodelete, api)
+        for name in args.scenarios:
+            print(f"Running {name}...", file=sys.stderr)
+            results[name] = await SCENARIOS[name](world, args)
+        results["pacer"] = pacer.snapshot()["global"]
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scenarios", nargs="+", default=list(SCENARIOS), choices=list(SCENARIOS))
+    parser.add_argument("--messages", type=int, default=10_000, help="Messages in the cold trim channel.")
+    parser.add_argument("--limit", type=int, default=100, help="Task message limit.")
+    parser.add_argument("--old-fraction", type=float, default=0.0, help="Share of messages older than 14 days.")
+    parser.add_argument("--steady", type=int, default=200, help="Messages in the steady trim scenario.")
+    parser.add_argument("--burst", type=int, default=1_000, help="Messages in the burst scenario.")
+    parser.add_argument("--burst-channels", type=int, default=10)
+    parser.add_argument("--fair-interval", type=float, default=0.1, help="Seconds between small guild posts.")
+    parser.add_argument("--backlog", type=int, default=500, help="Backlog per channel in the fairness scenario.")
+    parser.add_argument("--backlog-channels", type=int, default=8)
+    parser.add_argument("--fair-guilds", type=int, default=10, help="Small guilds in the fairness scenario.")
+    parser.add_argument("--tasks", type=int, default=1_000, help="Tasks in the command scenario.")
+    parser.add_argument("--guilds", type=int, default=50)
+    parser.add_argument("--command-repeats", type=int, default=50)
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds added to every REST call.")
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--rate-limit-chance", type=float, default=0.0)
+    parser.add_argument("--retry-after", type=float, default=0.05)
+    parser.add_argument("--debounce", type=float, default=0.0, help="Trim debounce used during the run.")
+    parser.add_argument("--json", help="Also write the results to this file.")
+    args = parser.parse_args()
+
+    json_path = os.path.abspath(args.json) if args.json else None
+    workdir = tempfile.mkdtemp(prefix="autodelete-bench-")
+    os.environ["DATABASE_FILE"] = os.path.join(workdir, "bench.db")
+    os.environ["STORAGE_BACKEND"] = "sqlite"
+    # The fake API has no real rate limits, so pacing is opened up unless the
+    # caller sets these to measure it.
+    os.environ.setdefault("GLOBAL_DELETE_RATE", "1000")
+    os.environ.setdefault("DELETE_RATE", "1000")
+    os.environ.setdefault("MAX_DELETE_RATE", "1000")
+    os.chdir(workdir)
+
+    results = asyncio.run(run(args))
+    print_report(results)
+    if json_path:
+        with open(json_path, "w") as f:
+            json.dump(results, f, indent=2, default=str)
+
+
+if __name__ == "__main__":
+    main()
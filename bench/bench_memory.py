@@ -0,0 +1,178 @@
+"""Memory comparison of the ``lean`` and ``full`` gateway profiles.
+
+Feeds the same synthetic guilds and message traffic into discord.py's
+connection state, once with the intents and cache settings of each
+profile, and reports the memory the state still holds afterwards::
+
+    python bench/bench_memory.py
+    python bench/bench_memory.py --guilds 20 --members 50000 --messages 5000
+
+Every guild payload carries all of its members, which is what the cache
+ends up holding after startup chunking under the ``full`` profile. No
+token or connection is needed.
+"""
+
+import argparse
+import gc
+import json
+import os
+import sys
+import tempfile
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import discord  # noqa: E402
+
+import fakes  # noqa: E402
+
+CHANNELS_PER_GUILD = 20
+ROLES_PER_GUILD = 30
+
+
+def user_payload(user_id):
+    return {
+        "id": str(user_id),
+        "username": f"user{user_id}",
+        "discriminator": "0",
+        "global_name": None,
+        "avatar": None,
+    }
+
+
+def member_payload(user_id, role_ids):
+    return {
+        "user": user_payload(user_id),
+        "roles": [str(role_id) for role_id in role_ids],
+        "joined_at": "2024-01-01T00:00:00+00:00",
+        "deaf": False,
+        "mute": False,
+        "flags": 0,
+    }
+
+
+def guild_payload(snowflakes, members):
+    guild_id = snowflakes()
+    roles = [guild_id] + [snowflakes() for _ in range(ROLES_PER_GUILD)]
+    channels = [snowflakes() for _ in range(CHANNELS_PER_GUILD)]
+    data = {
+        "id": str(guild_id),
+        "name": f"guild {guild_id}",
+        "owner_id": "1",
+        "member_count": members,
+        "large": members > 250,
+        "roles": [
+            {"id": str(role_id), "name": f"role {index}", "permissions": "0", "position": index}
+            for index, role_id in enumerate(roles)
+        ],
+        "channels": [
+            {"id": str(channel_id), "type": 0, "name": f"channel {index}", "position": index}
+            for index, channel_id in enumerate(channels)
+        ],
+        "members": [
+            member_payload(snowflakes(), roles[1 + index % 3 : 2 + index % 3])
+            for index in range(members)
+        ],
+        "emojis": [],
+        "stickers": [],
+        "features": [],
+        "threads": [],
+        "stage_instances": [],
+        "guild_scheduled_events": [],
+        "voice_states": [],
+        "presences": [],
+    }
+    return data, channels
+
+
+def message_payload(snowflakes, guild_data, channel_id, index):
+    member = guild_data["members"][index % len(guild_data["members"])]
+    return {
+        "id": str(snowflakes()),
+        "channel_id": str(channel_id),
+        "guild_id": guild_data["id"],
+        "author": member["user"],
+        "member": {key: value for key, value in member.items() if key != "user"},
+        "content": f"message {index}",
+        "timestamp": "2024-01-01T00:00:00+00:00",
+        "edited_timestamp": None,
+        "tts": False,
+        "mention_everyone": False,
+        "mentions": [],
+        "mention_roles": [],
+        "attachments": [],
+        "embeds": [],
+        "pinned": False,
+        "type": 0,
+    }
+
+
+def measure(options, args):
+    """Build a connection state with ``options`` and return what it retains."""
+    snowflakes = fakes.SnowflakeFactory()
+    payloads = [guild_payload(snowflakes, args.members) for _ in range(args.guilds)]
+    messages = [
+        message_payload(snowflakes, data, channels[index % len(channels)], index)
+        for data, channels in payloads
+        for index in range(args.messages)
+    ]
+
+    gc.collect()
+    tracemalloc.start()
+    baseline = tracemalloc.get_traced_memory()[0]
+    client = discord.Client(**options)
+    state = client._connection
+    for data, _ in payloads:
+        state._add_guild_from_data(data)
+    for data in messages:
+        state.parse_message_create(data)
+    gc.collect()
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    guilds = list(client.guilds)
+    return {
+        "intents": options["intents"].value,
+        "cached_members": sum(len(guild.members) for guild in guilds),
+        "cached_messages": len(client.cached_messages),
+        "retained_bytes": retained - baseline,
+        "peak_bytes": peak - baseline,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--guilds", type=int, default=10)
+    parser.add_argument("--members", type=int, default=10_000, help="Members per guild.")
+    parser.add_argument("--messages", type=int, default=2_000, help="Messages per guild.")
+    parser.add_argument("--max-messages", type=int, help="MAX_MESSAGES for both profiles.")
+    parser.add_argument("--json", help="Also write the results to this file.")
+    args = parser.parse_args()
+
+    json_path = os.path.abspath(args.json) if args.json else None
+    # Importing the bot opens its storage; keep that out of the checkout.
+    workdir = tempfile.mkdtemp(prefix="autodelete-bench-")
+    os.environ["DATABASE_FILE"] = os.path.join(workdir, "bench.db")
+    os.environ["STORAGE_BACKEND"] = "sqlite"
+    os.chdir(workdir)
+    import autodelete
+
+    results = {
+        profile: measure(autodelete.gateway_options(profile, args.max_messages), args)
+        for profile in ("full", "lean")
+    }
+    for profile, result in results.items():
+        print(
+            f"{profile:>5}: {result['retained_bytes'] / 2**20:8.1f} MiB retained, "
+            f"{result['peak_bytes'] / 2**20:8.1f} MiB peak, "
+            f"{result['cached_members']} members, {result['cached_messages']} messages"
+        )
+    if json_path:
+        with open(json_path, "w") as file:
+            json.dump(results, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
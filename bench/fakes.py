@@ -0,0 +1,302 @@
+"""In-memory stand-ins for the parts of discord.py the bot talks to.
+
+The fakes implement only what ``autodelete.py`` uses: channel history
+pagination, single and bulk deletes, partial messages and the interaction
+response calls of the slash commands. Every call that would be a REST
+request goes through :class:`FakeAPI`, which adds latency, injects 429s
+and counts requests per route.
+"""
+
+import asyncio
+import collections
+import datetime
+import itertools
+import random
+
+import discord
+
+HISTORY_PAGE_SIZE = 100
+
+
+class FakeAPI:
+    """Counts REST calls and simulates their latency and rate limits.
+
+    ``rate_limit_chance`` is the probability that a call is answered with a
+    429 first. Like discord.py, the fake then waits ``retry_after`` and
+    retries. Every response is reported to ``pacer`` the way the bot's HTTP
+    trace would report it.
+    """
+
+    def __init__(self, latency=0.0, jitter=0.0, rate_limit_chance=0.0, retry_after=0.5, pacer=None, seed=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_limit_chance = rate_limit_chance
+        self.retry_after = retry_after
+        self.pacer = pacer
+        self.random = random.Random(seed)
+        self.calls = collections.Counter()
+        self.rate_limited = 0
+
+    @property
+    def total_calls(self):
+        return sum(self.calls.values())
+
+    def reset(self):
+        self.calls.clear()
+        self.rate_limited = 0
+
+    async def request(self, route, channel_id=None):
+        while True:
+            self.calls[route] += 1
+            delay = self.latency + self.random.uniform(0, self.jitter)
+            if delay:
+                await asyncio.sleep(delay)
+            limited = self.random.random() < self.rate_limit_chance
+            self._observe(route, channel_id, 429 if limited else 200)
+            if not limited:
+                return
+            self.rate_limited += 1
+            await asyncio.sleep(self.retry_after)
+
+    def _observe(self, route, channel_id, status):
+        if self.pacer is None or route not in ("delete", "bulk_delete"):
+            return
+        headers = {"Retry-After": str(self.retry_after)} if status == 429 else {}
+        pacer_route = "bulk" if route == "bulk_delete" else "single"
+        self.pacer.observe(channel_id, pacer_route, status, headers)
+
+
+class FakeRole:
+    def __init__(self, role_id, name="role"):
+        self.id = role_id
+        self.name = name
+
+    def __eq__(self, other):
+        return isinstance(other, FakeRole) and other.id == self.id
+
+    def __hash__(self):
+        return hash(self.id)
+
+
+class FakeUser:
+    def __init__(self, user_id, bot=False, roles=()):
+        self.id = user_id
+        self.bot = bot
+        self.roles = list(roles)
+        self.mention = f"<@{user_id}>"
+
+    def __str__(self):
+        return f"user-{self.id}"
+
+
+class FakeMessage:
+    def __init__(self, message_id, channel, author, content="", pinned=False, embeds=(), attachments=()):
+        self.id = message_id
+        self.channel = channel
+        self.guild = channel.guild
+        self.author = author
+        self.content = content
+        self.pinned = pinned
+        self.embeds = list(embeds)
+        self.attachments = list(attachments)
+        self.created_at = discord.utils.snowflake_time(message_id)
+
+
+class FakePartialMessage:
+    def __init__(self, channel, message_id):
+        self.channel = channel
+        self.id = message_id
+
+    async def delete(self):
+        await self.channel.api.request("delete", self.channel.id)
+        if self.channel.messages.pop(self.id, None) is None:
+            raise discord.NotFound(FakeResponse(404), "Unknown Message")
+
+    async def add_reaction(self, emoji):
+        await self.channel.api.request("reaction")
+
+    async def remove_reaction(self, emoji, member):
+        await self.channel.api.request("reaction")
+
+    async def edit(self, **kwargs):
+        await self.channel.api.request("edit")
+
+
+class FakeResponse:
+    """Just enough of an aiohttp response to build discord.py exceptions."""
+
+    def __init__(self, status):
+        self.status = status
+        self.reason = "fake"
+
+
+class FakeGuild:
+    def __init__(self, guild_id, roles=()):
+        self.id = guild_id
+        self.roles = list(roles)
+        self.channels = {}
+
+    def get_role(self, role_id):
+        return next((role for role in self.roles if role.id == role_id), None)
+
+    def get_channel(self, channel_id):
+        return self.channels.get(channel_id)
+
+
+class FakeChannel:
+    def __init__(self, channel_id, guild, api, name=None):
+        self.id = channel_id
+        self.guild = guild
+        self.api = api
+        self.name = name or f"channel-{channel_id}"
+        self.mention = f"<#{channel_id}>"
+        self.messages = {}
+        guild.channels[channel_id] = self
+
+    def add(self, message):
+        self.messages[message.id] = message
+        return message
+
+    async def history(self, limit=100, after=None, before=None, oldest_first=None):
+        if oldest_first is None:
+            oldest_first = after is not None
+        ids = sorted(self.messages, reverse=not oldest_first)
+        if after is not None:
+            ids = [message_id for message_id in ids if message_id > after.id]
+        if before is not None:
+            ids = [message_id for message_id in ids if message_id < before.id]
+        if limit is not None:
+            ids = ids[:limit]
+        for start in range(0, len(ids), HISTORY_PAGE_SIZE):
+            await self.api.request("history", self.id)
+            for message_id in ids[start : start + HISTORY_PAGE_SIZE]:
+                message = self.messages.get(message_id)
+                if message is not None:
+                    yield message
+        if len(ids) % HISTORY_PAGE_SIZE == 0 and (limit is None or len(ids) < limit):
+            # Like discord.py, only a short page tells the history ended.
+            await self.api.request("history", self.id)
+
+    def get_partial_message(self, message_id):
+        return FakePartialMessage(self, message_id)
+
+    async def fetch_message(self, message_id):
+        await self.api.request("fetch", self.id)
+        message = self.messages.get(message_id)
+        if message is None:
+            raise discord.NotFound(FakeResponse(404), "Unknown Message")
+        return message
+
+    async def delete_messages(self, messages):
+        messages = [message.id for message in messages]
+        if len(messages) > 100:
+            raise discord.ClientException("Can only bulk delete messages up to 100 messages")
+        if len(messages) == 1:
+            await self.get_partial_message(messages[0]).delete()
+            return
+        await self.api.request("bulk_delete", self.id)
+        for message_id in messages:
+            self.messages.pop(message_id, None)
+
+    async def send(self, content=None, **kwargs):
+        await self.api.request("send", self.id)
+
+
+class FakeSentMessage:
+    """A bot response; reactions and edits only count API calls."""
+
+    def __init__(self, api, channel, message_id):
+        self.api = api
+        self.channel = channel
+        self.id = message_id
+
+    async def add_reaction(self, emoji):
+        await self.api.request("reaction")
+
+    async def remove_reaction(self, emoji, member):
+        await self.api.request("reaction")
+
+    async def clear_reactions(self):
+        await self.api.request("reaction")
+
+    async def edit(self, **kwargs):
+        await self.api.request("edit")
+
+    async def delete(self):
+        await self.api.request("delete_response")
+
+
+class FakeInteractionResponse:
+    def __init__(self, interaction):
+        self.interaction = interaction
+
+    async def send_message(self, content=None, **kwargs):
+        await self.interaction.api.request("respond")
+        self.interaction.mark_responded(kwargs.get("ephemeral", False))
+
+    async def defer(self, **kwargs):
+        await self.interaction.api.request("respond")
+        self.interaction.mark_responded(kwargs.get("ephemeral", False))
+
+    async def send_modal(self, modal):
+        await self.interaction.api.request("respond")
+        self.interaction.mark_responded()
+
+    async def edit_message(self, **kwargs):
+        await self.interaction.api.request("respond")
+        self.interaction.mark_responded()
+
+    def is_done(self):
+        return self.interaction.responded.is_set()
+
+
+class FakeFollowup:
+    def __init__(self, interaction):
+        self.interaction = interaction
+
+    async def send(self, content=None, **kwargs):
+        await self.interaction.api.request("followup")
+        return self.interaction.message
+
+
+class FakeInteraction:
+    _ids = itertools.count(1)
+
+    def __init__(self, api, guild, channel, user):
+        self.api = api
+        self.guild = guild
+        self.guild_id = guild.id
+        self.channel = channel
+        self.user = user
+        self.responded = asyncio.Event()
+        self.responded_at = None
+        # Whether the first response was ephemeral; follow-ups share it.
+        self.ephemeral = None
+        self.response = FakeInteractionResponse(self)
+        self.followup = FakeFollowup(self)
+        self.message = FakeSentMessage(api, channel, next(self._ids))
+
+    def mark_responded(self, ephemeral=False):
+        if self.responded_at is None:
+            self.responded_at = asyncio.get_running_loop().time()
+            self.ephemeral = ephemeral
+        self.responded.set()
+
+    async def original_response(self):
+        await self.api.request("original_response")
+        return self.message
+
+    async def delete_original_response(self):
+        await self.api.request("delete_response")
+
+
+class SnowflakeFactory:
+    """Hands out increasing message ids for messages of a given age."""
+
+    def __init__(self):
+        self.last = 0
+
+    def __call__(self, age=datetime.timedelta()):
+        snowflake = discord.utils.time_snowflake(discord.utils.utcnow() - age)
+        self.last = max(self.last + 1, snowflake)
+        return self.last
@@ -0,0 +1,40 @@
+"""Greets members who get the LOCK role with a message in a fixed channel.
+
+Load it by adding ``cogs.lock_role`` to ``EXTENSIONS``. Role updates are
+only delivered with the members intent, so it also needs
+``GATEWAY_PROFILE=full``. The role name and channel come from
+``LOCK_ROLE_NAME`` and ``LOCK_CHANNEL_ID``.
+"""
+
+import logging
+import os
+
+from discord.ext import commands
+
+log = logging.getLogger("autodelete.lock_role")
+
+
+class LockRole(commands.Cog):
+    def __init__(self, bot):
+        self.bot = bot
+        self.role_name = os.getenv("LOCK_ROLE_NAME", "LOCK")
+        self.channel_id = int(os.getenv("LOCK_CHANNEL_ID", "1146950830461816832"))
+
+    @commands.Cog.listener()
+    async def on_member_update(self, before, after):
+        added_roles = [role for role in after.roles if role not in before.roles]
+
+        for role in added_roles:
+            log.debug("Member role added", extra={"guild_id": after.guild.id, "role_id": role.id})
+            if role.name == self.role_name:
+                channel = after.guild.get_channel(self.channel_id)
+                if channel:
+                    await channel.send(
+                        f"Why don't you have a seat right over here {after.mention}  "
+                    )
+
+
+async def setup(bot):
+    if not bot.intents.members:
+        log.warning("The lock_role extension needs GATEWAY_PROFILE=full to see role changes.")
+    await bot.add_cog(LockRole(bot))
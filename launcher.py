@@ -0,0 +1,203 @@
+"""Runs the bot as several processes, each connecting a cluster of shards.
+
+    python launcher.py --clusters 4
+    python launcher.py --shards 16 --clusters 4
+
+Every cluster is ``autodelete.py`` started with ``SHARD_COUNT``,
+``SHARD_IDS`` and ``CLUSTER_ID`` set, so it only connects its own shards
+and only trims channels of guilds on them. With ``METRICS_PORT`` set,
+cluster ``n`` serves its metrics on ``METRICS_PORT + n``, since the
+clusters can't share one port. All clusters share the SQLite database. A cluster that exits is started again; ``/autodelete restart``
+re-executes the cluster in place, so the launcher doesn't notice it.
+Stopping the launcher stops every cluster.
+"""
+
+import argparse
+import json
+import logging
+import os
+import signal
+import subprocess
+import sys
+import time
+import urllib.request
+
+from dotenv import load_dotenv
+
+from logs import setup_logging
+
+BOT_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "autodelete.py")
+GATEWAY_URL = "https://discord.com/api/v10/gateway/bot"
+# A cluster that dies sooner than this after starting is restarted with a
+# growing delay, so a crash loop doesn't hammer the gateway.
+STABLE_AFTER = 60.0
+MAX_BACKOFF = 300.0
+
+log = logging.getLogger("autodelete.launcher")
+
+
+def recommended_shards(token):
+    request = urllib.request.Request(
+        GATEWAY_URL,
+        headers={"Authorization": f"Bot {token}", "User-Agent": "DiscordAutoDelete launcher"},
+    )
+    with urllib.request.urlopen(request, timeout=10) as response:
+        return json.load(response)["shards"]
+
+
+def shard_clusters(shard_count, clusters):
+    """Split shard ids into ``clusters`` contiguous, evenly sized groups."""
+    size, extra = divmod(shard_count, clusters)
+    groups = []
+    start = 0
+    for index in range(clusters):
+        end = start + size + (1 if index < extra else 0)
+        groups.append(list(range(start, end)))
+        start = end
+    return groups
+
+
+class Cluster:
+    def __init__(self, cluster_id, shard_ids, shard_count, bot_args):
+        self.cluster_id = cluster_id
+        self.shard_ids = shard_ids
+        self.shard_count = shard_count
+        self.bot_args = bot_args
+        self.process = None
+        self.started = 0.0
+        self.backoff = 0.0
+        self.restart_at = 0.0
+
+    def start(self):
+        env = dict(
+            os.environ,
+            SHARD_COUNT=str(self.shard_count),
+            SHARD_IDS=",".join(map(str, self.shard_ids)),
+            CLUSTER_ID=str(self.cluster_id),
+        )
+        metrics_port = int(os.getenv("METRICS_PORT", "0"))
+        if metrics_port:
+            # One port per cluster; only the first could bind a shared one.
+            env["METRICS_PORT"] = str(metrics_port + self.cluster_id)
+        self.process = subprocess.Popen([sys.executable, BOT_SCRIPT, *self.bot_args], env=env)
+        self.started = time.monotonic()
+        log.info(
+            "Started cluster",
+            extra={
+                "cluster": self.cluster_id,
+                "shards": self.shard_ids,
+                "pid": self.process.pid,
+                "metrics_port": env.get("METRICS_PORT"),
+            },
+        )
+
+    def check(self, now):
+        """Restart the cluster if it exited and its backoff has passed."""
+        if self.process is not None:
+            code = self.process.poll()
+            if code is None:
+                return
+            uptime = now - self.started
+            if uptime < STABLE_AFTER:
+                self.backoff = min(max(self.backoff * 2, 5.0), MAX_BACKOFF)
+            else:
+                self.backoff = 0.0
+            self.restart_at = now + self.backoff
+            self.process = None
+            log.warning(
+                "Cluster exited",
+                extra={
+                    "cluster": self.cluster_id,
+                    "code": code,
+                    "uptime": round(uptime, 1),
+                    "restart_in": self.backoff,
+                },
+            )
+        if now >= self.restart_at:
+            self.start()
+
+    def stop(self):
+        if self.process is not None and self.process.poll() is None:
+            self.process.send_signal(signal.SIGINT)
+
+    def wait(self, timeout):
+        if self.process is None:
+            return
+        try:
+            self.process.wait(timeout)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+
+
+def main():
+    load_dotenv()
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--shards",
+        type=int,
+        default=int(os.getenv("SHARD_COUNT", "0")) or None,
+        help="Total shard count (default: SHARD_COUNT, else Discord's recommendation).",
+    )
+    parser.add_argument(
+        "--clusters",
+        type=int,
+        default=int(os.getenv("CLUSTERS", "0")) or os.cpu_count(),
+        help="Number of processes (default: CLUSTERS, else the number of CPUs).",
+    )
+    parser.add_argument(
+        "bot_args", nargs=argparse.REMAINDER, help="Extra arguments passed to autodelete.py."
+    )
+    args = parser.parse_args()
+
+    listener = setup_logging(
+        os.getenv("LOG_LEVEL", "INFO").upper(), os.getenv("LOG_FORMAT", "json")
+    )
+    try:
+        if os.getenv("STORAGE_BACKEND", "sqlite") != "sqlite":
+            log.error("Clusters share their state through SQLite; set STORAGE_BACKEND=sqlite.")
+            sys.exit(1)
+        shard_count = args.shards
+        if shard_count is None:
+            token = os.getenv("DISCORD_TOKEN")
+            if not token:
+                log.error("DISCORD_TOKEN is not set in the .env file.")
+                sys.exit(1)
+            shard_count = recommended_shards(token)
+        clusters = [
+            Cluster(cluster_id, shard_ids, shard_count, args.bot_args)
+            for cluster_id, shard_ids in enumerate(
+                shard_clusters(shard_count, min(args.clusters, shard_count))
+            )
+        ]
+        log.info("Launching", extra={"shards": shard_count, "clusters": len(clusters)})
+
+        stopping = False
+
+        def stop(signum, frame):
+            nonlocal stopping
+            stopping = True
+
+        signal.signal(signal.SIGINT, stop)
+        signal.signal(signal.SIGTERM, stop)
+
+        for cluster in clusters:
+            cluster.start()
+        while not stopping:
+            time.sleep(1.0)
+            now = time.monotonic()
+            for cluster in clusters:
+                if not stopping:
+                    cluster.check(now)
+
+        log.info("Stopping clusters")
+        for cluster in clusters:
+            cluster.stop()
+        for cluster in clusters:
+            cluster.wait(30)
+    finally:
+        listener.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+import datetime
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+
+# Attributes every LogRecord has; anything else was passed through ``extra``.
+_RECORD_ATTRIBUTES = set(vars(logging.makeLogRecord({}))) | {"message", "asctime", "taskName"}
+
+
+def record_fields(record):
+    return {
+        key: value
+        for key, value in vars(record).items()
+        if key not in _RECORD_ATTRIBUTES and not key.startswith("_")
+    }
+
+
+def _exception_text(formatter, record):
+    if record.exc_info:
+        return formatter.formatException(record.exc_info)
+    return record.exc_text
+
+
+class JSONFormatter(logging.Formatter):
+    """One JSON object per line: time, level, logger, message and the
+    fields passed through ``extra``."""
+
+    def format(self, record):
+        entry = {
+            "time": datetime.datetime.fromtimestamp(
+                record.created, datetime.timezone.utc
+            ).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        entry.update(record_fields(record))
+        exception = _exception_text(self, record)
+        if exception:
+            entry["exception"] = exception
+        return json.dumps(entry, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """``[LEVEL] message key=value ...`` for reading logs in a terminal."""
+
+    def format(self, record):
+        line = f"[{record.levelname}] {record.getMessage()}"
+        fields = record_fields(record)
+        if fields:
+            line += " " + " ".join(f"{key}={value}" for key, value in fields.items())
+        exception = _exception_text(self, record)
+        if exception:
+            line += "\n" + exception
+        return line
+
+
+class ChannelSampler(logging.Filter):
+    """Keeps a share of the routine records logged for each channel.
+
+    Records below WARNING that carry a ``channel_id`` field are let through
+    at ``rate`` per channel and message, spread evenly rather than at
+    random. Warnings and errors always pass.
+    """
+
+    def __init__(self, rate):
+        super().__init__()
+        self.rate = rate
+        self.credit = {}
+
+    def filter(self, record):
+        if self.rate >= 1 or record.levelno >= logging.WARNING:
+            return True
+        channel_id = getattr(record, "channel_id", None)
+        if channel_id is None:
+            return True
+        key = (channel_id, record.msg)
+        credit = self.credit.get(key, 1.0) + self.rate
+        if credit >= 1:
+            self.credit[key] = credit - 1
+            return True
+        self.credit[key] = credit
+        return False
+
+
+class StaticFields(logging.Filter):
+    """Adds the same fields to every record, e.g. the process's cluster id."""
+
+    def __init__(self, fields):
+        super().__init__()
+        self.fields = fields
+
+    def filter(self, record):
+        for key, value in self.fields.items():
+            setattr(record, key, value)
+        return True
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record):
+        # The stock handler formats the message on the calling thread; keep
+        # that work for the listener so the event loop only enqueues.
+        record = logging.makeLogRecord(vars(record))
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def setup_logging(level="INFO", fmt="json", sample_rate=1.0, fields=None):
+    """Route all logging through a queue drained by a background thread.
+
+    ``fields`` are added to every record. Returns the started
+    :class:`logging.handlers.QueueListener`; stop it on shutdown to flush
+    what is still queued.
+    """
+    output = logging.StreamHandler(sys.stdout)
+    output.setFormatter(JSONFormatter() if fmt == "json" else TextFormatter())
+
+    records = queue.SimpleQueue()
+    handler = _QueueHandler(records)
+    handler.addFilter(ChannelSampler(sample_rate))
+    if fields:
+        handler.addFilter(StaticFields(fields))
+
+    root = logging.getLogger()
+    root.handlers[:] = [handler]
+    root.setLevel(level)
+    # discord.py's gateway and HTTP debug output is far too chatty for DEBUG.
+    logging.getLogger("discord").setLevel(max(logging.INFO, root.level))
+
+    listener = logging.handlers.QueueListener(records, output)
+    listener.start()
+    return listener
@@ -0,0 +1,90 @@
+from rules import TaskRules
+
+
+class ChannelTask:
+    """An auto-delete task for one channel.
+
+    On disk a task is stored as ``{"guild", "limit", "pins", "embeds",
+    "enabled", "max_age"}`` keyed by channel id, which is the layout the bot
+    has used since its first release plus the optional ``max_age`` in
+    minutes and the ``archive`` flag. Tasks with filter rules also store
+    them under ``"rules"``.
+    """
+
+    __slots__ = (
+        "channel_id",
+        "guild_id",
+        "limit",
+        "pins",
+        "embeds",
+        "enabled",
+        "max_age",
+        "rules",
+        "archive",
+    )
+
+    def __init__(
+        self,
+        channel_id,
+        guild_id,
+        limit,
+        pins=False,
+        embeds=False,
+        enabled=True,
+        max_age=None,
+        rules=None,
+        archive=False,
+    ):
+        self.channel_id = int(channel_id)
+        self.guild_id = int(guild_id)
+        self.limit = limit
+        self.pins = pins
+        self.embeds = embeds
+        self.enabled = enabled
+        self.max_age = max_age
+        self.rules = rules if rules is not None else TaskRules()
+        self.archive = archive
+
+    def __repr__(self):
+        return (
+            f"<ChannelTask channel_id={self.channel_id} guild_id={self.guild_id} "
+            f"limit={self.limit} pins={self.pins} embeds={self.embeds} "
+            f"enabled={self.enabled} max_age={self.max_age} rules={self.rules.to_dict()} "
+            f"archive={self.archive}>"
+        )
+
+    def keeps(self, pinned, bot_embed, exempt):
+        """Whether a message with these window flags is kept and not counted."""
+        return (pinned and not self.pins) or (bot_embed and not self.embeds) or exempt
+
+    @classmethod
+    def from_dict(cls, channel_id, data):
+        return cls(
+            channel_id,
+            data["guild"],
+            data["limit"],
+            pins=data.get("pins", False),
+            embeds=data.get("embeds", False),
+            enabled=data.get("enabled", True),
+            max_age=data.get("max_age"),
+            rules=TaskRules.from_dict(data.get("rules")),
+            archive=data.get("archive", False),
+        )
+
+    def to_dict(self):
+        data = {
+            "limit": self.limit,
+            "pins": self.pins,
+            "embeds": self.embeds,
+            "enabled": self.enabled,
+            "guild": self.guild_id,
+            "max_age": self.max_age,
+            "archive": self.archive,
+        }
+        rules = self.rules.to_dict()
+        if rules:
+            data["rules"] = rules
+        return data
+
+    def copy(self):
+        return ChannelTask.from_dict(self.channel_id, self.to_dict())
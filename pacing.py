@@ -0,0 +1,389 @@
+import asyncio
+import collections
+import contextlib
+import logging
+import re
+import time
+
+import aiohttp
+
+# Delete routes the pacer tracks, by the path of the request.
+ROUTE_PATTERN = re.compile(r"/channels/(\d+)/messages/(bulk-delete|\d+)$")
+IDLE_BUCKET_TTL = 300.0
+
+log = logging.getLogger("autodelete.pacing")
+
+
+class TokenBucket:
+    """Token bucket that hands out reservations instead of blocking.
+
+    ``reserve`` takes a token even if none is available yet and returns how
+    long the caller has to wait for it, so waiters are served in the order
+    they asked.
+    """
+
+    def __init__(self, rate, capacity, max_rate):
+        self.rate = rate
+        self.capacity = capacity
+        self.max_rate = max_rate
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, now):
+        self._refill(now)
+        self.tokens -= 1
+        wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+        return max(wait, self.blocked_until - now)
+
+    def available(self, now):
+        """Seconds until a token is free without taking one; 0 if one is."""
+        self._refill(now)
+        wait = (1 - self.tokens) / self.rate if self.tokens < 1 else 0.0
+        return max(wait, self.blocked_until - now)
+
+    def block(self, now, seconds):
+        self.blocked_until = max(self.blocked_until, now + seconds)
+
+    def snapshot(self, now):
+        self._refill(now)
+        return {
+            "rate": round(self.rate, 3),
+            "capacity": self.capacity,
+            "tokens": round(self.tokens, 3),
+            "blocked_for": round(max(0.0, self.blocked_until - now), 3),
+        }
+
+
+class DeletionPacer:
+    """Paces delete calls against Discord's rate limits.
+
+    Every delete waits for a token from a global bucket shared by all
+    guilds and from the bucket of its route, which is the channel plus
+    either single or bulk delete. :meth:`acquire` takes both; with a
+    :class:`FairDeleteQueue` in front of the global bucket, calls take
+    their route token with :meth:`acquire_route` and leave the global one
+    to the queue. Route buckets learn from the
+    ``X-RateLimit-*`` headers on every response. They grow slowly while
+    requests succeed, halve on a 429, and stop until the reset time once
+    Discord reports no requests remaining.
+    """
+
+    def __init__(self, global_rate, route_rate, max_route_rate, on_rate_limited=None):
+        self.global_bucket = TokenBucket(global_rate, global_rate, global_rate)
+        self.on_rate_limited = on_rate_limited
+        self.route_rate = route_rate
+        self.max_route_rate = max_route_rate
+        self.routes = {}
+        self.rate_limited = 0
+        self._acquired = 0
+
+    def _bucket(self, key):
+        bucket = self.routes.get(key)
+        if bucket is None:
+            bucket = self.routes[key] = TokenBucket(
+                self.route_rate, 1, self.max_route_rate
+            )
+        return bucket
+
+    async def acquire(self, channel_id, route):
+        now = time.monotonic()
+        wait = max(
+            self.global_bucket.reserve(now),
+            self._bucket((channel_id, route)).reserve(now),
+        )
+        await self._wait(now, wait)
+
+    async def acquire_route(self, channel_id, route):
+        """Wait for a token of the call's route only; the global token is
+        taken by a :class:`FairDeleteQueue` sharing ``global_bucket``."""
+        now = time.monotonic()
+        await self._wait(now, self._bucket((channel_id, route)).reserve(now))
+
+    async def _wait(self, now, wait):
+        self._acquired += 1
+        if self._acquired % 256 == 0:
+            self.prune(now)
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def observe(self, channel_id, route, status, headers):
+        now = time.monotonic()
+        bucket = self._bucket((channel_id, route))
+        if status == 429:
+            self.rate_limited += 1
+            if self.on_rate_limited is not None:
+                self.on_rate_limited()
+            retry_after = float(headers.get("Retry-After", 1.0))
+            bucket.rate = max(bucket.rate / 2, 0.1)
+            bucket.block(now, retry_after)
+            if headers.get("X-RateLimit-Global"):
+                self.global_bucket.block(now, retry_after)
+            log.warning(
+                "Rate limited",
+                extra={
+                    "channel_id": channel_id,
+                    "route": route,
+                    "retry_after": retry_after,
+                    "route_rate": round(bucket.rate, 3),
+                },
+            )
+            return
+
+        limit = headers.get("X-RateLimit-Limit")
+        remaining = headers.get("X-RateLimit-Remaining")
+        reset_after = headers.get("X-RateLimit-Reset-After")
+        if limit is not None:
+            bucket.capacity = max(1, int(limit))
+        if remaining is not None and reset_after is not None:
+            reset_after = float(reset_after)
+            if int(remaining) == 0:
+                bucket.block(now, reset_after)
+            elif limit is not None and int(remaining) == int(limit) - 1 and reset_after > 0:
+                # First request of a fresh window: the window length is known.
+                bucket.max_rate = min(self.max_route_rate, int(limit) / reset_after)
+        if 200 <= status < 300:
+            bucket.rate = min(bucket.rate * 1.1, bucket.max_rate)
+
+    def prune(self, now):
+        for key, bucket in list(self.routes.items()):
+            if now - bucket.updated > IDLE_BUCKET_TTL and bucket.blocked_until < now:
+                del self.routes[key]
+
+    def snapshot(self):
+        """Current bucket state, for debugging."""
+        now = time.monotonic()
+        return {
+            "global": self.global_bucket.snapshot(now),
+            "routes": {
+                f"{channel_id}/{route}": bucket.snapshot(now)
+                for (channel_id, route), bucket in self.routes.items()
+            },
+            "rate_limited": self.rate_limited,
+        }
+
+    def trace_config(self):
+        """An aiohttp trace config feeding every delete response to :meth:`observe`."""
+
+        async def on_request_end(session, context, params):
+            match = ROUTE_PATTERN.search(params.url.path)
+            if match is None or params.method not in ("DELETE", "POST"):
+                return
+            route = "bulk" if match.group(2) == "bulk-delete" else "single"
+            self.observe(
+                int(match.group(1)), route, params.response.status, params.response.headers
+            )
+
+        trace = aiohttp.TraceConfig()
+        trace.on_request_end.append(on_request_end)
+        return trace
+
+
+def parse_guild_values(text):
+    """Parse ``"guild_id:value,..."`` into ``{guild_id: float(value)}``."""
+    values = {}
+    for item in text.split(","):
+        if item.strip():
+            guild_id, _, value = item.partition(":")
+            values[int(guild_id)] = float(value)
+    return values
+
+
+class _GuildQueue:
+    __slots__ = ("channels", "deficit")
+
+    def __init__(self):
+        # Waiters of each channel, channels in round-robin order.
+        self.channels = collections.OrderedDict()
+        self.deficit = 0.0
+
+    def pop(self):
+        """The next live waiter, rotating through the channels; None when
+        only cancelled waiters were left."""
+        while self.channels:
+            channel_id, waiters = next(iter(self.channels.items()))
+            future = waiters.popleft()
+            if waiters:
+                self.channels.move_to_end(channel_id)
+            else:
+                del self.channels[channel_id]
+            if not future.done():
+                return future
+        return None
+
+
+class FairDeleteQueue:
+    """Hands out delete calls fairly across guilds and their channels.
+
+    A call is let through once one of ``slots`` is free and ``bucket``,
+    the pacer's global bucket, has a token for it, so the order in which
+    calls get the global rate is decided here. Waiting calls are served
+    with deficit round robin over guilds: a guild earns its weight
+    (default 1, see ``weights``) in credit each time its turn comes up and
+    spends one per call, so a guild with weight 2 gets twice the calls of
+    one with weight 1 while both have work. Within a guild the channels
+    take turns. A channel clearing a large backlog therefore only ever
+    gets one guild's share, and a call from any other guild waits for at
+    most one round.
+
+    Calls should wait for their route's token (see
+    :meth:`DeletionPacer.acquire_route`) before they queue here, so a slot
+    is only held for the request itself.
+
+    ``quota`` caps every guild at that many delete calls per second, with
+    ``quotas`` overriding it per guild; 0 means no cap.
+    """
+
+    def __init__(
+        self, slots, bucket=None, weights=None, quota=0.0, quotas=None, on_wait=None
+    ):
+        if any(weight <= 0 for weight in (weights or {}).values()):
+            raise ValueError("Guild weights must be positive.")
+        self.slots = slots
+        self.bucket = bucket
+        self.weights = weights or {}
+        self.quota = quota
+        self.quotas = quotas or {}
+        self.on_wait = on_wait
+        self.active = 0
+        self.guilds = collections.OrderedDict()
+        self.buckets = {}
+        self.waiting = 0
+        self.granted = 0
+        self._timer = None
+
+    def _quota_bucket(self, guild_id):
+        rate = self.quotas.get(guild_id, self.quota)
+        if not rate:
+            return None
+        bucket = self.buckets.get(guild_id)
+        if bucket is None:
+            bucket = self.buckets[guild_id] = TokenBucket(rate, max(rate, 1.0), rate)
+        return bucket
+
+    def _global_wait(self, now):
+        return self.bucket.available(now) if self.bucket is not None else 0.0
+
+    @contextlib.asynccontextmanager
+    async def slot(self, guild_id, channel_id):
+        """Hold one of the delete slots for a call in ``channel_id``."""
+        await self.acquire(guild_id, channel_id)
+        try:
+            yield
+        finally:
+            self.release()
+
+    async def acquire(self, guild_id, channel_id):
+        started = time.perf_counter()
+        now = time.monotonic()
+        quota = self._quota_bucket(guild_id)
+        if (
+            self.active < self.slots
+            and not self.guilds
+            and self._global_wait(now) == 0
+            and (quota is None or quota.available(now) == 0)
+        ):
+            self._grant(quota)
+        else:
+            future = asyncio.get_running_loop().create_future()
+            guild = self.guilds.get(guild_id)
+            if guild is None:
+                guild = self.guilds[guild_id] = _GuildQueue()
+            guild.channels.setdefault(channel_id, collections.deque()).append(future)
+            self.waiting += 1
+            self._dispatch()
+            try:
+                await future
+            except asyncio.CancelledError:
+                if future.done() and not future.cancelled():
+                    # Granted just before the cancellation; give it back.
+                    self.release()
+                else:
+                    self.waiting -= 1
+                raise
+        if self.on_wait is not None:
+            self.on_wait(time.perf_counter() - started)
+
+    def release(self):
+        self.active -= 1
+        self._dispatch()
+
+    def _grant(self, quota):
+        self.active += 1
+        self.granted += 1
+        now = time.monotonic()
+        if self.bucket is not None:
+            self.bucket.reserve(now)
+        if quota is not None:
+            quota.reserve(now)
+
+    def _dispatch(self):
+        while self.active < self.slots and self.guilds:
+            future, quota = self._next()
+            if future is None:
+                return
+            self.waiting -= 1
+            self._grant(quota)
+            future.set_result(None)
+
+    def _next(self):
+        """Pick the next waiter by deficit round robin; (None, None) if the
+        global bucket is empty or every waiting guild is held back by its
+        quota, with a timer set to try again."""
+        now = time.monotonic()
+        wake_in = self._global_wait(now) or None
+        held_back = 0
+        while wake_in is None and self.guilds and held_back < len(self.guilds):
+            guild_id, guild = next(iter(self.guilds.items()))
+            quota = self._quota_bucket(guild_id)
+            wait = quota.available(now) if quota is not None else 0.0
+            if wait > 0:
+                held_back += 1
+                self.guilds.move_to_end(guild_id)
+                if held_back == len(self.guilds):
+                    wake_in = min(
+                        self._quota_bucket(waiting).available(now) for waiting in self.guilds
+                    )
+                continue
+            held_back = 0
+            if guild.deficit < 1:
+                guild.deficit += self.weights.get(guild_id, 1.0)
+                if guild.deficit < 1:
+                    self.guilds.move_to_end(guild_id)
+                    continue
+            future = guild.pop()
+            if future is None:
+                # Only cancelled waiters; their count was settled on cancel.
+                del self.guilds[guild_id]
+                continue
+            guild.deficit -= 1
+            if not guild.channels:
+                # An idle guild doesn't bank credit for later.
+                del self.guilds[guild_id]
+            elif guild.deficit < 1:
+                self.guilds.move_to_end(guild_id)
+            return future, quota
+        if wake_in is not None and self.guilds:
+            loop = asyncio.get_running_loop()
+            if self._timer is None or self._timer.when() > loop.time() + wake_in:
+                if self._timer is not None:
+                    self._timer.cancel()
+                self._timer = loop.call_later(wake_in, self._wake)
+        return None, None
+
+    def _wake(self):
+        self._timer = None
+        self._dispatch()
+
+    def snapshot(self):
+        return {
+            "slots": self.slots,
+            "active": self.active,
+            "waiting": self.waiting,
+            "guilds": len(self.guilds),
+            "granted": self.granted,
+        }
@@ -0,0 +1,359 @@
+import collections
+import re
+
+try:
+    from re import _parser as sre_parse
+except ImportError:  # Python < 3.11
+    import sre_parse
+
+# What the rules look at, taken from a message when it is seen.
+MessageFacts = collections.namedtuple(
+    "MessageFacts", ["author_id", "bot", "role_ids", "attachments", "content"]
+)
+
+MAX_PATTERN_LENGTH = 200
+REPEATS = {sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT}
+if hasattr(sre_parse, "POSSESSIVE_REPEAT"):
+    REPEATS.add(sre_parse.POSSESSIVE_REPEAT)
+
+
+def facts_from_message(message, roles=True):
+    """Facts of ``message``; its author's roles are skipped unless ``roles``."""
+    author = message.author
+    return MessageFacts(
+        author.id,
+        author.bot,
+        frozenset(role.id for role in getattr(author, "roles", ())) if roles else frozenset(),
+        bool(message.attachments),
+        message.content,
+    )
+
+
+def facts_from_payload(data):
+    """Facts of a raw message payload, or None if it lacks the author."""
+    author = data.get("author")
+    if author is None:
+        return None
+    return MessageFacts(
+        int(author["id"]),
+        author.get("bot", False),
+        frozenset(int(role_id) for role_id in data.get("member", {}).get("roles", ())),
+        bool(data.get("attachments")),
+        data.get("content", ""),
+    )
+
+
+def _subpatterns(value):
+    """The parsed subpatterns nested in an sre token's value."""
+    if isinstance(value, sre_parse.SubPattern):
+        yield value
+    elif isinstance(value, (tuple, list)):
+        for item in value:
+            yield from _subpatterns(item)
+
+
+class _Backtracking:
+    """Finds repeats in a parsed pattern that can match the same input in
+    more than one way, like ``(a+)+``, ``(a*)*`` or ``(a|ab)*``. The regex
+    engine backtracks through every split of the input on such patterns,
+    which can take exponential time.
+
+    Inside a repeat, every choice the engine makes (taking an alternative,
+    repeating a quantifier once more) must be settled by the next character:
+    the alternatives, or a quantifier and whatever can follow it, must not
+    start with the same character. Character sets are compared on a sample
+    of characters, the ASCII ones plus every character the pattern names.
+    """
+
+    SAMPLE = frozenset(map(chr, range(128))) | frozenset("\u00a0\u00e9\u0663\u4e2d")
+    CATEGORIES = {
+        "CATEGORY_DIGIT": re.compile(r"\d"),
+        "CATEGORY_NOT_DIGIT": re.compile(r"\D"),
+        "CATEGORY_SPACE": re.compile(r"\s"),
+        "CATEGORY_NOT_SPACE": re.compile(r"\S"),
+        "CATEGORY_WORD": re.compile(r"\w"),
+        "CATEGORY_NOT_WORD": re.compile(r"\W"),
+    }
+
+    def __init__(self, parsed):
+        self.ignorecase = bool(parsed.state.flags & re.IGNORECASE)
+        self.sample = self.SAMPLE | frozenset(self._named(parsed))
+
+    def _named(self, items):
+        """Characters named in ``items``; notes case-insensitive groups."""
+        for op, value in items:
+            if op is sre_parse.LITERAL or op is sre_parse.NOT_LITERAL:
+                yield chr(value)
+            elif op is sre_parse.IN:
+                for item_op, item in value:
+                    if item_op is sre_parse.LITERAL:
+                        yield chr(item)
+                    elif item_op is sre_parse.RANGE:
+                        yield from map(chr, item)
+            elif op is sre_parse.SUBPATTERN and value[1] & re.IGNORECASE:
+                self.ignorecase = True
+            for inner in _subpatterns(value):
+                yield from self._named(inner)
+
+    def chars(self, op, value):
+        """The sample characters a single-character token matches."""
+        if op is sre_parse.LITERAL:
+            return frozenset((chr(value),))
+        if op is sre_parse.NOT_LITERAL:
+            return self.sample - {chr(value)}
+        if op is not sre_parse.IN:
+            return self.sample
+        chars, negate = set(), False
+        for item_op, item in value:
+            if item_op is sre_parse.NEGATE:
+                negate = True
+            elif item_op is sre_parse.LITERAL:
+                chars.add(chr(item))
+            elif item_op is sre_parse.RANGE:
+                chars.update(c for c in self.sample if item[0] <= ord(c) <= item[1])
+            elif item_op is sre_parse.CATEGORY and str(item) in self.CATEGORIES:
+                chars.update(filter(self.CATEGORIES[str(item)].match, self.sample))
+            else:
+                chars.update(self.sample)
+        return self.sample - chars if negate else frozenset(chars)
+
+    def first(self, items):
+        """``(chars, empty)``: what a match of ``items`` can start with, and
+        whether it can be empty."""
+        chars = set()
+        for op, value in items:
+            if op in (sre_parse.LITERAL, sre_parse.NOT_LITERAL, sre_parse.IN, sre_parse.ANY):
+                token, empty = self.chars(op, value), False
+            elif op is sre_parse.SUBPATTERN:
+                token, empty = self.first(value[-1])
+            elif op in REPEATS:
+                token, empty = self.first(value[2])
+                empty = empty or value[0] == 0
+            elif op is sre_parse.BRANCH:
+                token, empty = self.first_of(value[1])
+            elif op is sre_parse.GROUPREF_EXISTS:
+                token, empty = self.first_of([value[1], value[2] or []])
+            elif op in (sre_parse.AT, sre_parse.ASSERT, sre_parse.ASSERT_NOT):
+                token, empty = (), True
+            elif isinstance(value, sre_parse.SubPattern):  # atomic groups
+                token, empty = self.first(value)
+            else:  # backreferences
+                token, empty = self.sample, True
+            chars.update(token)
+            if not empty:
+                return chars, False
+        return chars, True
+
+    def first_of(self, alternatives):
+        chars, empty = set(), False
+        for alternative in alternatives:
+            alternative_chars, alternative_empty = self.first(alternative)
+            chars.update(alternative_chars)
+            empty = empty or alternative_empty
+        return chars, empty
+
+    def overlap(self, a, b):
+        if self.ignorecase:
+            a = {c.lower() for c in a}
+            b = {c.lower() for c in b}
+        return not a.isdisjoint(b)
+
+    def backtracks(self, items, follow=frozenset(), repeated=False):
+        """Whether ``items``, followed by something starting with one of
+        ``follow``, can match the same input in more than one way under a
+        repeat (when ``repeated``)."""
+        items = list(items)
+        for index, (op, value) in enumerate(items):
+            after, empty = self.first(items[index + 1:])
+            if empty:
+                after = after | follow
+            if op in REPEATS:
+                body_first, body_empty = self.first(value[2])
+                if value[1] > 1 and body_empty:
+                    return True
+                if repeated and value[0] != value[1] and self.overlap(body_first, after):
+                    return True
+                if value[1] > 1:
+                    after, repeated_inside = after | body_first, True
+                else:
+                    repeated_inside = repeated
+                if self.backtracks(value[2], after, repeated_inside):
+                    return True
+            elif op is sre_parse.BRANCH:
+                if repeated:
+                    starts = []
+                    for alternative in value[1]:
+                        chars, alternative_empty = self.first(alternative)
+                        starts.append(chars | after if alternative_empty else chars)
+                    if any(
+                        self.overlap(a, b)
+                        for i, a in enumerate(starts)
+                        for b in starts[i + 1:]
+                    ):
+                        return True
+                if any(self.backtracks(alternative, after, repeated) for alternative in value[1]):
+                    return True
+            elif op in (sre_parse.ASSERT, sre_parse.ASSERT_NOT):
+                if self.backtracks(value[1], frozenset(), repeated):
+                    return True
+            elif any(self.backtracks(inner, after, repeated) for inner in _subpatterns(value)):
+                return True
+        return False
+
+
+def _backtracks(parsed):
+    """Whether a parsed pattern can take exponential time to match."""
+    return _Backtracking(parsed).backtracks(parsed)
+
+
+class TaskRules:
+    """Which messages of a channel a task may delete.
+
+    Messages of ``exempt_users`` or of members with one of ``exempt_roles``
+    are kept. With ``bots_only`` or ``attachments_only`` only messages from
+    bots or with attachments are deleted, and with ``pattern`` only
+    messages whose content matches the regex. Kept messages don't count
+    towards the task's limit. ``min_age`` holds back messages younger than
+    that many minutes from limit-based trims until a later trim.
+
+    The message rules are compiled into a single predicate the first time
+    it is needed; a task gets new ``TaskRules`` whenever they change.
+    """
+
+    __slots__ = (
+        "exempt_roles",
+        "exempt_users",
+        "attachments_only",
+        "bots_only",
+        "pattern",
+        "min_age",
+        "_predicate",
+    )
+
+    def __init__(
+        self,
+        exempt_roles=(),
+        exempt_users=(),
+        attachments_only=False,
+        bots_only=False,
+        pattern=None,
+        min_age=None,
+    ):
+        self.exempt_roles = frozenset(map(int, exempt_roles))
+        self.exempt_users = frozenset(map(int, exempt_users))
+        self.attachments_only = attachments_only
+        self.bots_only = bots_only
+        self.pattern = pattern or None
+        self.min_age = min_age or None
+        self._predicate = None
+
+    def __eq__(self, other):
+        return isinstance(other, TaskRules) and self.to_dict() == other.to_dict()
+
+    def __repr__(self):
+        return f"<TaskRules {self.to_dict()}>"
+
+    @classmethod
+    def from_dict(cls, data):
+        data = data or {}
+        return cls(
+            exempt_roles=data.get("exempt_roles", ()),
+            exempt_users=data.get("exempt_users", ()),
+            attachments_only=data.get("attachments_only", False),
+            bots_only=data.get("bots_only", False),
+            pattern=data.get("pattern"),
+            min_age=data.get("min_age"),
+        )
+
+    def to_dict(self):
+        """The rules that are set; an empty dict when there are none."""
+        data = {
+            "exempt_roles": sorted(self.exempt_roles),
+            "exempt_users": sorted(self.exempt_users),
+            "attachments_only": self.attachments_only,
+            "bots_only": self.bots_only,
+            "pattern": self.pattern,
+            "min_age": self.min_age,
+        }
+        return {key: value for key, value in data.items() if value}
+
+    def replace(self, **changes):
+        data = self.to_dict()
+        data.update(changes)
+        return TaskRules.from_dict(data)
+
+    def compile(self):
+        """Return ``predicate(facts) -> bool``, true for messages the task may
+        delete, or None when every message qualifies.
+
+        Raises :class:`re.error` for an invalid pattern.
+        """
+        checks = []
+        if self.bots_only:
+            checks.append(lambda facts: facts.bot)
+        if self.attachments_only:
+            checks.append(lambda facts: facts.attachments)
+        if self.exempt_users:
+            users = self.exempt_users
+            checks.append(lambda facts: facts.author_id not in users)
+        if self.exempt_roles:
+            roles = self.exempt_roles
+            checks.append(lambda facts: roles.isdisjoint(facts.role_ids))
+        if self.pattern:
+            search = re.compile(self.pattern).search
+            checks.append(lambda facts: search(facts.content) is not None)
+
+        if not checks:
+            return None
+        if len(checks) == 1:
+            return checks[0]
+
+        def predicate(facts):
+            for check in checks:
+                if not check(facts):
+                    return False
+            return True
+
+        return predicate
+
+    @property
+    def predicate(self):
+        if self._predicate is None:
+            self._predicate = (self.compile(),)
+        return self._predicate[0]
+
+    def validate(self):
+        """Raise :class:`ValueError` if the rules can't be used."""
+        if self.pattern and len(self.pattern) > MAX_PATTERN_LENGTH:
+            raise ValueError(f"The pattern is longer than {MAX_PATTERN_LENGTH} characters.")
+        try:
+            self.compile()
+        except re.error as e:
+            raise ValueError(f"The pattern is not a valid regular expression: {e}") from None
+        # Patterns run on the event loop for every message; refuse the ones
+        # that can stall it.
+        if self.pattern and _backtracks(sre_parse.parse(self.pattern)):
+            raise ValueError(
+                "The pattern repeats a group that can match the same text in more "
+                "than one way, which can make matching very slow."
+            )
+
+    def exempts(self, message):
+        """Whether ``message`` is kept no matter the task's limit."""
+        predicate = self.predicate
+        if predicate is None:
+            return False
+        return not predicate(facts_from_message(message, roles=bool(self.exempt_roles)))
+
+    def exempts_payload(self, data):
+        """Like :meth:`exempts` for a raw message update; None if the payload
+        doesn't carry what the rules look at."""
+        predicate = self.predicate
+        if predicate is None:
+            return False
+        if "content" not in data or (self.exempt_roles and "member" not in data):
+            return None
+        facts = facts_from_payload(data)
+        if facts is None:
+            return None
+        return not predicate(facts)
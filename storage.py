@@ -0,0 +1,458 @@
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from models import ChannelTask
+from rules import TaskRules
+
+log = logging.getLogger("autodelete.storage")
+
+# Version of the JSON document layout. Version 1 is the original flat
+# layout where tasks sit next to ``management_roles`` and
+# ``deleted_message_count`` at the top level.
+JSON_SCHEMA_VERSION = 2
+
+
+def migrate_document(document):
+    """Upgrade a JSON config document to :data:`JSON_SCHEMA_VERSION`."""
+    version = document.get("schema_version", 1)
+    if version > JSON_SCHEMA_VERSION:
+        raise ValueError(f"Config schema version {version} is newer than this bot.")
+    if version == 1:
+        document = {
+            "schema_version": 2,
+            "tasks": {
+                key: value
+                for key, value in document.items()
+                if key not in ("management_roles", "deleted_message_count")
+            },
+            "management_roles": document.get("management_roles", {}),
+            "deleted_message_count": document.get("deleted_message_count", {}),
+        }
+    return document
+
+
+class Storage:
+    """Where tasks, management roles and deleted message counters are kept.
+
+    Backends are synchronous and are driven from a single worker thread
+    through :meth:`call`, so disk I/O never runs on the event loop and writes
+    are applied in the order they were issued.
+
+    :meth:`load` returns four dicts keyed by int ids: :class:`ChannelTask`
+    by channel, management role ids by guild, deleted message counts by
+    channel, and the guild of every counted channel the backend knows it for.
+    :meth:`load_expiring` returns the messages the expiry scheduler tracks.
+    """
+
+    def __init__(self):
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="storage")
+        # Called with the operation name and its duration in seconds.
+        self.observer = None
+
+    async def call(self, method, *args):
+        loop = asyncio.get_running_loop()
+        started = time.perf_counter()
+        try:
+            return await loop.run_in_executor(self._executor, method, *args)
+        finally:
+            if self.observer is not None:
+                self.observer(method.__name__, time.perf_counter() - started)
+
+    def load(self):
+        raise NotImplementedError
+
+    def save_tasks(self, tasks):
+        """Insert or replace ``tasks``, an iterable of :class:`ChannelTask`."""
+        raise NotImplementedError
+
+    def delete_tasks(self, channel_ids):
+        raise NotImplementedError
+
+    def set_management_roles(self, guild_id, role_ids):
+        raise NotImplementedError
+
+    def add_deleted_messages(self, counts):
+        """Add ``counts``, an iterable of (channel id, guild id, count) rows."""
+        raise NotImplementedError
+
+    def load_expiring(self):
+        """Return (channel id, message id, pinned, bot embed) rows."""
+        raise NotImplementedError
+
+    def get_meta(self, key):
+        """Return a small bookkeeping value stored under ``key``, or None."""
+        raise NotImplementedError
+
+    def set_meta(self, key, value):
+        raise NotImplementedError
+
+    def update_expiring(self, dropped_channels, upserts, deletes):
+        """Forget every message of ``dropped_channels``, then insert or replace
+        the (channel id, message id, pinned, bot embed) rows in ``upserts``
+        and delete the (channel id, message id) pairs in ``deletes``."""
+        raise NotImplementedError
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+
+
+class JSONStorage(Storage):
+    """Single JSON file, rewritten atomically on every change.
+
+    Older layouts are migrated on load; the original file is kept next to
+    the new one with a ``.v<version>.bak`` suffix.
+    """
+
+    def __init__(self, path):
+        super().__init__()
+        self.path = path
+        self.document = migrate_document({})
+
+    def load(self):
+        try:
+            with open(self.path, "r") as f:
+                document = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            document = {"schema_version": JSON_SCHEMA_VERSION}
+        version = document.get("schema_version", 1)
+        self.document = migrate_document(document)
+        self.document.setdefault("tasks", {})
+        self.document.setdefault("management_roles", {})
+        self.document.setdefault("deleted_message_count", {})
+        self.document.setdefault("expiring", {})
+        self.document.setdefault("meta", {})
+        if version != JSON_SCHEMA_VERSION and os.path.exists(self.path):
+            os.replace(self.path, f"{self.path}.v{version}.bak")
+            self._write()
+            log.info(
+                "Migrated config file", extra={"path": self.path, "from_version": version}
+            )
+
+        tasks = {
+            int(channel_id): ChannelTask.from_dict(channel_id, data)
+            for channel_id, data in self.document["tasks"].items()
+        }
+        roles = {
+            int(guild_id): [int(role_id) for role_id in role_ids]
+            for guild_id, role_ids in self.document["management_roles"].items()
+        }
+        counts = {
+            int(channel_id): count
+            for channel_id, count in self.document["deleted_message_count"].items()
+        }
+        counter_guilds = {
+            channel_id: tasks[channel_id].guild_id
+            for channel_id in counts
+            if channel_id in tasks
+        }
+        return tasks, roles, counts, counter_guilds
+
+    def _write(self):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.document, f, indent=4)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+    def save_tasks(self, tasks):
+        for task in tasks:
+            self.document["tasks"][str(task.channel_id)] = task.to_dict()
+        self._write()
+
+    def delete_tasks(self, channel_ids):
+        for channel_id in channel_ids:
+            self.document["tasks"].pop(str(channel_id), None)
+        self._write()
+
+    def set_management_roles(self, guild_id, role_ids):
+        self.document["management_roles"][str(guild_id)] = list(role_ids)
+        self._write()
+
+    def add_deleted_messages(self, counts):
+        totals = self.document["deleted_message_count"]
+        for channel_id, guild_id, count in counts:
+            totals[str(channel_id)] = totals.get(str(channel_id), 0) + count
+        self._write()
+
+    def load_expiring(self):
+        return [
+            (int(channel_id), int(message_id), pinned, bot_embed)
+            for channel_id, messages in self.document["expiring"].items()
+            for message_id, (pinned, bot_embed) in messages.items()
+        ]
+
+    def get_meta(self, key):
+        return self.document["meta"].get(key)
+
+    def set_meta(self, key, value):
+        self.document["meta"][key] = value
+        self._write()
+
+    def update_expiring(self, dropped_channels, upserts, deletes):
+        expiring = self.document["expiring"]
+        for channel_id in dropped_channels:
+            expiring.pop(str(channel_id), None)
+        for channel_id, message_id, pinned, bot_embed in upserts:
+            expiring.setdefault(str(channel_id), {})[str(message_id)] = [pinned, bot_embed]
+        for channel_id, message_id in deletes:
+            messages = expiring.get(str(channel_id))
+            if messages is not None:
+                messages.pop(str(message_id), None)
+                if not messages:
+                    del expiring[str(channel_id)]
+        self._write()
+
+
+def _encode_rules(rules):
+    data = rules.to_dict()
+    return json.dumps(data) if data else None
+
+
+class SQLiteStorage(Storage):
+    """WAL-mode SQLite backend that updates individual rows.
+
+    On first start an existing JSON config is imported once; the JSON file
+    itself is left in place as a backup.
+    """
+
+    MIGRATIONS = [
+        """
+        CREATE TABLE tasks (
+            channel_id INTEGER PRIMARY KEY,
+            guild_id INTEGER NOT NULL,
+            message_limit INTEGER NOT NULL,
+            pins INTEGER NOT NULL DEFAULT 0,
+            embeds INTEGER NOT NULL DEFAULT 0,
+            enabled INTEGER NOT NULL DEFAULT 1
+        );
+        CREATE INDEX tasks_guild ON tasks (guild_id);
+        CREATE TABLE management_roles (
+            guild_id INTEGER NOT NULL,
+            role_id INTEGER NOT NULL,
+            PRIMARY KEY (guild_id, role_id)
+        );
+        CREATE TABLE counters (
+            channel_id INTEGER PRIMARY KEY,
+            guild_id INTEGER,
+            deleted INTEGER NOT NULL DEFAULT 0
+        );
+        """,
+        """
+        ALTER TABLE tasks ADD COLUMN max_age INTEGER;
+        CREATE TABLE expiring_messages (
+            channel_id INTEGER NOT NULL,
+            message_id INTEGER NOT NULL,
+            pinned INTEGER NOT NULL DEFAULT 0,
+            bot_embed INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (channel_id, message_id)
+        ) WITHOUT ROWID;
+        """,
+        """
+        CREATE TABLE meta (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        );
+        """,
+        """
+        ALTER TABLE tasks ADD COLUMN rules TEXT;
+        """,
+        """
+        ALTER TABLE tasks ADD COLUMN archive INTEGER NOT NULL DEFAULT 0;
+        """,
+    ]
+
+    def __init__(self, path, legacy_json_path=None):
+        super().__init__()
+        self.path = path
+        self.legacy_json_path = legacy_json_path
+        self.db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute("PRAGMA busy_timeout=5000")
+
+    def _migrate(self):
+        # Several cluster processes may open the same database at once. The
+        # pending migrations run in one transaction that takes the write lock
+        # before reading the version, so only one of them applies them. A new
+        # database imports the legacy JSON config in the same transaction,
+        # so the schema is never committed without the imported tasks.
+        with self.db:
+            self.db.execute("BEGIN IMMEDIATE")
+            version = self.db.execute("PRAGMA user_version").fetchone()[0]
+            for migration in self.MIGRATIONS[version:]:
+                for statement in migration.split(";"):
+                    if statement.strip():
+                        self.db.execute(statement)
+            if version < len(self.MIGRATIONS):
+                self.db.execute(f"PRAGMA user_version = {len(self.MIGRATIONS)}")
+            if version == 0 and self.legacy_json_path and os.path.exists(self.legacy_json_path):
+                self._import_json(self.legacy_json_path)
+
+    def _import_json(self, path):
+        """Import a JSON config; runs inside the migration's transaction."""
+        with open(path, "r") as f:
+            document = migrate_document(json.load(f))
+        tasks = [
+            ChannelTask.from_dict(channel_id, data)
+            for channel_id, data in document.get("tasks", {}).items()
+        ]
+        guilds = {task.channel_id: task.guild_id for task in tasks}
+        self._save_tasks(tasks)
+        for guild_id, role_ids in document.get("management_roles", {}).items():
+            self._set_management_roles(guild_id, role_ids)
+        self._add_deleted_messages(
+            (channel_id, guilds.get(int(channel_id)), count)
+            for channel_id, count in document.get("deleted_message_count", {}).items()
+        )
+        log.info("Imported legacy config", extra={"path": path, "tasks": len(tasks)})
+
+    def load(self):
+        self._migrate()
+        tasks = {}
+        rows = self.db.execute(
+            "SELECT channel_id, guild_id, message_limit, pins, embeds, enabled, max_age, rules, "
+            "archive FROM tasks"
+        )
+        for channel_id, guild_id, limit, pins, embeds, enabled, max_age, rules, archive in rows:
+            tasks[channel_id] = ChannelTask(
+                channel_id,
+                guild_id,
+                limit,
+                pins=bool(pins),
+                embeds=bool(embeds),
+                enabled=bool(enabled),
+                max_age=max_age,
+                rules=TaskRules.from_dict(json.loads(rules) if rules else None),
+                archive=bool(archive),
+            )
+        roles = {}
+        for guild_id, role_id in self.db.execute(
+            "SELECT guild_id, role_id FROM management_roles ORDER BY rowid"
+        ):
+            roles.setdefault(guild_id, []).append(role_id)
+        counts = {}
+        counter_guilds = {}
+        for channel_id, guild_id, deleted in self.db.execute(
+            "SELECT channel_id, guild_id, deleted FROM counters"
+        ):
+            counts[channel_id] = deleted
+            if guild_id is not None:
+                counter_guilds[channel_id] = guild_id
+        return tasks, roles, counts, counter_guilds
+
+    def _save_tasks(self, tasks):
+        self.db.executemany(
+            "INSERT OR REPLACE INTO tasks "
+            "(channel_id, guild_id, message_limit, pins, embeds, enabled, max_age, rules, "
+            "archive) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            [
+                (
+                    task.channel_id,
+                    task.guild_id,
+                    task.limit,
+                    task.pins,
+                    task.embeds,
+                    task.enabled,
+                    task.max_age,
+                    _encode_rules(task.rules),
+                    task.archive,
+                )
+                for task in tasks
+            ],
+        )
+
+    def save_tasks(self, tasks):
+        with self.db:
+            self.db.execute("BEGIN")
+            self._save_tasks(tasks)
+
+    def delete_tasks(self, channel_ids):
+        with self.db:
+            self.db.execute("BEGIN")
+            self.db.executemany(
+                "DELETE FROM tasks WHERE channel_id = ?",
+                [(int(channel_id),) for channel_id in channel_ids],
+            )
+
+    def _set_management_roles(self, guild_id, role_ids):
+        self.db.execute(
+            "DELETE FROM management_roles WHERE guild_id = ?", (int(guild_id),)
+        )
+        self.db.executemany(
+            "INSERT OR IGNORE INTO management_roles (guild_id, role_id) VALUES (?, ?)",
+            [(int(guild_id), int(role_id)) for role_id in role_ids],
+        )
+
+    def set_management_roles(self, guild_id, role_ids):
+        with self.db:
+            self.db.execute("BEGIN")
+            self._set_management_roles(guild_id, role_ids)
+
+    def _add_deleted_messages(self, counts):
+        self.db.executemany(
+            "INSERT INTO counters (channel_id, guild_id, deleted) VALUES (?, ?, ?) "
+            "ON CONFLICT (channel_id) DO UPDATE SET "
+            "deleted = deleted + excluded.deleted, "
+            "guild_id = COALESCE(excluded.guild_id, guild_id)",
+            [(int(channel_id), guild_id, count) for channel_id, guild_id, count in counts],
+        )
+
+    def add_deleted_messages(self, counts):
+        with self.db:
+            self.db.execute("BEGIN")
+            self._add_deleted_messages(counts)
+
+    def load_expiring(self):
+        return [
+            (channel_id, message_id, bool(pinned), bool(bot_embed))
+            for channel_id, message_id, pinned, bot_embed in self.db.execute(
+                "SELECT channel_id, message_id, pinned, bot_embed FROM expiring_messages "
+                "ORDER BY channel_id, message_id"
+            )
+        ]
+
+    def get_meta(self, key):
+        row = self.db.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def set_meta(self, key, value):
+        with self.db:
+            self.db.execute("BEGIN")
+            self.db.execute(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value)
+            )
+
+    def update_expiring(self, dropped_channels, upserts, deletes):
+        with self.db:
+            self.db.execute("BEGIN")
+            self.db.executemany(
+                "DELETE FROM expiring_messages WHERE channel_id = ?",
+                [(int(channel_id),) for channel_id in dropped_channels],
+            )
+            self.db.executemany(
+                "INSERT OR REPLACE INTO expiring_messages "
+                "(channel_id, message_id, pinned, bot_embed) VALUES (?, ?, ?, ?)",
+                upserts,
+            )
+            self.db.executemany(
+                "DELETE FROM expiring_messages WHERE channel_id = ? AND message_id = ?",
+                deletes,
+            )
+
+    def close(self):
+        super().close()
+        self.db.close()
+
+
+def open_storage(backend, database_file, config_file):
+    if backend == "json":
+        return JSONStorage(config_file)
+    if backend == "sqlite":
+        return SQLiteStorage(database_file, legacy_json_path=config_file)
+    raise ValueError(f"Unknown storage backend: {backend}")
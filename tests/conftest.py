@@ -0,0 +1,49 @@
+import asyncio
+import os
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "bench"))
+
+# Read when autodelete is imported, which also opens the database of its
+# module-level bot. The fakes have no real rate limits, so pacing is opened
+# up like in the benchmarks.
+os.environ["STORAGE_BACKEND"] = "sqlite"
+os.environ["DATABASE_FILE"] = os.path.join(tempfile.mkdtemp(prefix="autodelete-tests-"), "autodelete.db")
+os.environ.setdefault("GLOBAL_DELETE_RATE", "1000")
+os.environ.setdefault("DELETE_RATE", "1000")
+os.environ.setdefault("MAX_DELETE_RATE", "1000")
+
+import autodelete  # noqa: E402
+import fakes  # noqa: E402
+from bench_autodelete import World  # noqa: E402
+
+
+@pytest.fixture
+def run_bot(tmp_path, monkeypatch):
+    """Run ``scenario(world)`` on a fresh bot wired to the fakes.
+
+    Every run gets its own bot, database and archive directory in
+    ``tmp_path``; the module's ``bot`` is swapped for it, so the event
+    handlers and commands use it too. Trims aren't debounced.
+    """
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(autodelete, "DATABASE_FILE", "autodelete.db")
+
+    def run(scenario, **api_options):
+        async def main():
+            bot = autodelete.AutoDeleteBot()
+            monkeypatch.setattr(autodelete, "bot", bot)
+            api = fakes.FakeAPI(pacer=bot.pacer, **api_options)
+            async with bot:
+                await bot.load_config()
+                bot.trim_scheduler.debounce = 0
+                return await scenario(World(autodelete, api))
+
+        return asyncio.run(main())
+
+    return run
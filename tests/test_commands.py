@@ -0,0 +1,48 @@
+import asyncio
+
+import autodelete
+
+
+def test_commands_waiting_for_the_config_defer_as_they_answer(run_bot):
+    async def scenario(world):
+        guild = world.guild()
+        channel = world.channel(guild)
+        world.bot.config_ready.clear()
+        interactions = {name: world.interaction(guild) for name in ("export", "restart", "reload")}
+        commands = [
+            asyncio.create_task(autodelete.export.callback(interactions["export"], channel)),
+            asyncio.create_task(autodelete.restart.callback(interactions["restart"])),
+            asyncio.create_task(autodelete.reload.callback(interactions["reload"])),
+        ]
+        await asyncio.gather(*(i.responded.wait() for i in interactions.values()))
+        # Still waiting for the config; restart would shut the bot down.
+        for command in commands:
+            command.cancel()
+        await asyncio.gather(*commands, return_exceptions=True)
+        world.bot.config_ready.set()
+        return {name: interaction.ephemeral for name, interaction in interactions.items()}
+
+    assert run_bot(scenario) == {
+        "export": True,
+        "restart": False,
+        "reload": autodelete.EPHEMERAL_RESPONSES,
+    }
+
+
+def test_metrics_show_the_pacer_state(run_bot):
+    async def scenario(world):
+        pacer = world.bot.pacer
+        pacer.observe(5, "single", 429, {"Retry-After": "30"})
+        pacer.observe(6, "bulk", 200, {})
+        await autodelete.metrics_command.callback(world.interaction(world.guild()))
+        return autodelete.pacing_summary(), autodelete.metrics.render()
+
+    summary, rendered = run_bot(scenario)
+    lines = summary.splitlines()
+    assert lines[0].startswith("Global: `")
+    assert lines[1] == "Routes: `2`, blocked: `1`"
+    # The rate limited route is the slowest after halving its rate.
+    assert lines[2].startswith("`5/single`: `")
+    assert "blocked for `" in lines[2]
+    assert "autodelete_pacer_routes 2" in rendered
+    assert "autodelete_pacer_blocked_routes 1" in rendered
@@ -0,0 +1,97 @@
+import asyncio
+import datetime
+
+import discord
+import pytest
+
+from autodelete import ExpiryScheduler
+from models import ChannelTask
+from storage import SQLiteStorage
+
+TASKS = {
+    1: ChannelTask(1, 100, 50, max_age=10),
+    2: ChannelTask(2, 100, 50, max_age=60),
+}
+
+
+def snowflake(minutes_ago):
+    return discord.utils.time_snowflake(
+        discord.utils.utcnow() - datetime.timedelta(minutes=minutes_ago)
+    )
+
+
+def scheduler(storage):
+    async def expire(channel_id, message_ids):
+        return len(message_ids)
+
+    return ExpiryScheduler(storage, TASKS.get, expire, flush_interval=60)
+
+
+@pytest.fixture
+def storage(tmp_path):
+    storage = SQLiteStorage(str(tmp_path / "autodelete.db"))
+    storage.load()
+    yield storage
+    storage.close()
+
+
+def test_schedule_survives_a_reload(storage):
+    ids = {channel_id: [snowflake(age) for age in (5, 4, 3)] for channel_id in TASKS}
+
+    async def main():
+        expiry = scheduler(storage)
+        for channel_id, message_ids in ids.items():
+            for message_id in message_ids:
+                expiry.track(channel_id, message_id)
+        expiry.track(1, snowflake(2), pinned=True)
+        expiry.remove(2, [ids[2][0]])
+        await expiry.flush()
+        assert expiry.pending == {}
+
+        reloaded = scheduler(storage)
+        reloaded.load(await storage.call(storage.load_expiring))
+        return expiry, reloaded
+
+    expiry, reloaded = asyncio.run(main())
+    assert reloaded.tracked() == expiry.tracked() == 6
+    assert reloaded.due[1] == ExpiryScheduler.expires_at(ids[1][0], 10)
+    assert reloaded.due[2] == ExpiryScheduler.expires_at(ids[2][1], 60)
+    assert sorted(reloaded.heap) == sorted(
+        (due, channel_id) for channel_id, due in reloaded.due.items()
+    )
+
+
+class FlakyStorage:
+    """Passes calls to ``storage`` once ``fail`` is cleared."""
+
+    def __init__(self, storage):
+        self.storage = storage
+        self.fail = True
+        self.update_expiring = storage.update_expiring
+        self.load_expiring = storage.load_expiring
+
+    async def call(self, method, *args):
+        if self.fail:
+            raise OSError("disk full")
+        return await self.storage.call(method, *args)
+
+
+def test_failed_flush_keeps_the_changes(storage):
+    first, second, third = snowflake(5), snowflake(4), snowflake(3)
+
+    async def main():
+        flaky = FlakyStorage(storage)
+        expiry = scheduler(flaky)
+        expiry.track(1, first)
+        expiry.track(1, second)
+        expiry.track(2, third)
+        with pytest.raises(OSError):
+            await expiry.flush()
+        # Changes made after the failed flush win over the restored ones.
+        expiry.remove(1, [first])
+        expiry.forget(2)
+        flaky.fail = False
+        await expiry.flush()
+        return await storage.call(storage.load_expiring)
+
+    assert asyncio.run(main()) == [(1, second, False, False)]
@@ -0,0 +1,32 @@
+import launcher
+
+
+class FakeProcess:
+    pid = 1
+
+
+def start_clusters(monkeypatch, count):
+    """Start ``count`` clusters and return the environment each got."""
+    envs = []
+
+    def popen(args, env):
+        envs.append(env)
+        return FakeProcess()
+
+    monkeypatch.setattr(launcher.subprocess, "Popen", popen)
+    for cluster_id in range(count):
+        launcher.Cluster(cluster_id, [cluster_id], count, []).start()
+    return envs
+
+
+def test_every_cluster_gets_its_own_metrics_port(monkeypatch):
+    monkeypatch.setenv("METRICS_PORT", "9100")
+    envs = start_clusters(monkeypatch, 3)
+    assert [env["METRICS_PORT"] for env in envs] == ["9100", "9101", "9102"]
+    assert [env["CLUSTER_ID"] for env in envs] == ["0", "1", "2"]
+
+
+def test_metrics_stay_off_without_a_port(monkeypatch):
+    monkeypatch.delenv("METRICS_PORT", raising=False)
+    envs = start_clusters(monkeypatch, 2)
+    assert all("METRICS_PORT" not in env for env in envs)
@@ -0,0 +1,128 @@
+import asyncio
+import collections
+import time
+
+import pytest
+
+from pacing import FairDeleteQueue, TokenBucket, parse_guild_values
+
+
+def test_parse_guild_values():
+    assert parse_guild_values("1:2, 3:0.5,") == {1: 2.0, 3: 0.5}
+    assert parse_guild_values("") == {}
+
+
+def test_weights_must_be_positive():
+    with pytest.raises(ValueError):
+        FairDeleteQueue(1, weights={1: 0})
+
+
+def test_token_bucket_reserves_in_order():
+    bucket = TokenBucket(10, 1, 10)
+    now = bucket.updated
+    assert bucket.available(now) == 0
+    assert bucket.reserve(now) == 0
+    assert bucket.reserve(now) == pytest.approx(0.1)
+    assert bucket.reserve(now) == pytest.approx(0.2)
+    assert bucket.available(now) == pytest.approx(0.3)
+
+
+def test_guilds_share_by_weight_and_channels_take_turns():
+    async def main():
+        queue = FairDeleteQueue(1, weights={1: 2.0})
+        order = []
+
+        async def call(guild_id, channel_id):
+            async with queue.slot(guild_id, channel_id):
+                order.append((guild_id, channel_id))
+                await asyncio.sleep(0)
+
+        # Guild 1 has a backlog in two channels; the others one call each.
+        calls = [call(1, channel_id) for channel_id in (10, 10, 10, 11, 11, 11)]
+        calls += [call(2, 20), call(2, 20), call(3, 30)]
+        await asyncio.gather(*(asyncio.create_task(c) for c in calls))
+        return order
+
+    order = asyncio.run(main())
+    # The first call goes straight through; then two calls of guild 1 per
+    # round against one of every other guild.
+    assert [guild_id for guild_id, _ in order] == [1, 1, 1, 2, 3, 1, 1, 2, 1]
+    assert [channel_id for guild_id, channel_id in order if guild_id == 1] == [
+        10, 10, 11, 10, 11, 11
+    ]
+
+
+def test_cancelled_waiter_gives_up_its_place():
+    async def main():
+        queue = FairDeleteQueue(1)
+        release = asyncio.Event()
+        granted = []
+
+        async def holder():
+            async with queue.slot(1, 1):
+                await release.wait()
+
+        async def waiter(guild_id):
+            async with queue.slot(guild_id, guild_id):
+                granted.append(guild_id)
+
+        held = asyncio.create_task(holder())
+        await asyncio.sleep(0)
+        cancelled = asyncio.create_task(waiter(2))
+        waiting = asyncio.create_task(waiter(3))
+        await asyncio.sleep(0)
+        assert queue.waiting == 2
+        cancelled.cancel()
+        await asyncio.sleep(0)
+        release.set()
+        await asyncio.gather(held, waiting)
+        assert cancelled.cancelled()
+        return granted, queue.snapshot()
+
+    granted, snapshot = asyncio.run(main())
+    assert granted == [3]
+    assert snapshot["active"] == 0
+    assert snapshot["waiting"] == 0
+    assert snapshot["guilds"] == 0
+
+
+def test_quota_caps_each_guild():
+    async def main():
+        queue = FairDeleteQueue(4, quota=20.0)
+        calls = collections.Counter()
+
+        async def call(guild_id):
+            async with queue.slot(guild_id, guild_id):
+                calls[guild_id] += 1
+
+        started = time.monotonic()
+        await asyncio.gather(*(call(guild_id) for guild_id in (1, 2) for _ in range(30)))
+        return time.monotonic() - started, calls
+
+    elapsed, calls = asyncio.run(main())
+    assert calls == {1: 30, 2: 30}
+    # 20 up front per guild, then 10 more at 20 per second.
+    assert 0.4 < elapsed < 1.5
+
+
+def test_global_bucket_is_handed_out_by_the_queue():
+    async def main():
+        bucket = TokenBucket(50, 1, 50)
+        queue = FairDeleteQueue(4, bucket=bucket)
+        order = []
+
+        async def call(guild_id):
+            async with queue.slot(guild_id, guild_id):
+                order.append(guild_id)
+
+        started = time.monotonic()
+        busy = [asyncio.create_task(call(1)) for _ in range(10)]
+        await asyncio.sleep(0)
+        small = asyncio.create_task(call(2))
+        await asyncio.gather(*busy, small)
+        return time.monotonic() - started, order
+
+    elapsed, order = asyncio.run(main())
+    # A call queued behind a backlog waits for one round, not the backlog.
+    assert order.index(2) <= 2
+    assert 0.15 < elapsed < 1.0
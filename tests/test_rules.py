@@ -0,0 +1,76 @@
+import pytest
+
+import fakes
+from rules import MAX_PATTERN_LENGTH, TaskRules
+
+
+def message(content="", bot=False, roles=(), attachments=()):
+    guild = fakes.FakeGuild(1)
+    channel = fakes.FakeChannel(2, guild, fakes.FakeAPI())
+    author = fakes.FakeUser(3, bot=bot, roles=roles)
+    return fakes.FakeMessage(
+        4 << 22, channel, author, content=content, attachments=attachments
+    )
+
+
+def test_no_rules_compile_to_none():
+    rules = TaskRules()
+    assert rules.compile() is None
+    assert not rules.exempts(message())
+    assert rules.to_dict() == {}
+
+
+def test_rules_are_combined():
+    rules = TaskRules(bots_only=True, pattern=r"^!")
+    assert not rules.exempts(message("!roll", bot=True))
+    assert rules.exempts(message("!roll"))
+    assert rules.exempts(message("hello", bot=True))
+
+
+def test_exempt_users_and_roles():
+    role = fakes.FakeRole(7)
+    assert TaskRules(exempt_users=[3]).exempts(message())
+    assert TaskRules(exempt_roles=[7]).exempts(message(roles=[role]))
+    assert not TaskRules(exempt_roles=[8]).exempts(message(roles=[role]))
+
+
+def test_attachments_only():
+    rules = TaskRules(attachments_only=True)
+    assert rules.exempts(message())
+    assert not rules.exempts(message(attachments=["file"]))
+
+
+def test_exempts_payload():
+    rules = TaskRules(exempt_roles=[7])
+    payload = {"author": {"id": "3"}, "member": {"roles": ["7"]}, "content": ""}
+    assert rules.exempts_payload(payload)
+    assert rules.exempts_payload({"content": "no author"}) is None
+
+
+def test_round_trip():
+    rules = TaskRules(exempt_roles=["7"], pattern="x", min_age=5)
+    assert TaskRules.from_dict(rules.to_dict()) == rules
+    assert rules.replace(pattern=None).to_dict() == {"exempt_roles": [7], "min_age": 5}
+
+
+@pytest.mark.parametrize(
+    "pattern",
+    [
+        r"^!\w+", r"(ab)+c", r"\d{3}-\d{4}", r"(?:foo|bar)\b", r"a*b*",
+        r"(foo|bar)+", r"(a|b)*", r"((ab)*c)*", r"(\d+,)+\d", r"(cat|dog)s?( (cat|dog)s?)*",
+    ],
+)
+def test_validate_accepts(pattern):
+    TaskRules(pattern=pattern).validate()
+
+
+@pytest.mark.parametrize(
+    "pattern",
+    [
+        r"(a+)+$", r"(a*)*b", r"(a|aa)*c", r"(?:x\w{2,})+y", r"(a?a)+", r"(\w+\s?)+$",
+        r"(?i:(A|ab))+", "(", "a" * (MAX_PATTERN_LENGTH + 1),
+    ],
+)
+def test_validate_refuses(pattern):
+    with pytest.raises(ValueError):
+        TaskRules(pattern=pattern).validate()
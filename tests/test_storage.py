@@ -0,0 +1,153 @@
+import asyncio
+import json
+import logging
+import sqlite3
+
+import pytest
+
+from autodelete import CounterBuffer
+from storage import JSON_SCHEMA_VERSION, JSONStorage, SQLiteStorage, migrate_document
+
+V1_DOCUMENT = {
+    "100": {"guild": 1, "limit": 50, "pins": True, "embeds": False, "enabled": True},
+    "200": {"guild": 2, "limit": 10, "pins": False, "embeds": True, "enabled": False},
+    "management_roles": {"1": [11, 12]},
+    "deleted_message_count": {"100": 7, "300": 2},
+}
+
+
+def test_migrate_v1_document():
+    document = migrate_document(V1_DOCUMENT)
+    assert document["schema_version"] == JSON_SCHEMA_VERSION
+    assert set(document["tasks"]) == {"100", "200"}
+    assert document["management_roles"] == {"1": [11, 12]}
+    assert document["deleted_message_count"] == {"100": 7, "300": 2}
+    assert migrate_document(document) == document
+
+
+def test_newer_schema_is_refused():
+    with pytest.raises(ValueError):
+        migrate_document({"schema_version": JSON_SCHEMA_VERSION + 1})
+
+
+def check_v1_load(loaded):
+    tasks, roles, counts, counter_guilds = loaded
+    assert set(tasks) == {100, 200}
+    assert (tasks[100].guild_id, tasks[100].limit, tasks[100].pins) == (1, 50, True)
+    assert (tasks[200].embeds, tasks[200].enabled) == (True, False)
+    assert roles == {1: [11, 12]}
+    assert counts == {100: 7, 300: 2}
+    assert counter_guilds == {100: 1}
+
+
+def test_json_storage_migrates_and_keeps_a_backup(tmp_path):
+    path = tmp_path / "autodelete_config.json"
+    path.write_text(json.dumps(V1_DOCUMENT))
+    storage = JSONStorage(str(path))
+    check_v1_load(storage.load())
+    assert json.loads((tmp_path / "autodelete_config.json.v1.bak").read_text()) == V1_DOCUMENT
+    assert json.loads(path.read_text())["schema_version"] == JSON_SCHEMA_VERSION
+    storage.close()
+
+
+def test_sqlite_imports_legacy_json_once(tmp_path):
+    legacy = tmp_path / "autodelete_config.json"
+    legacy.write_text(json.dumps(V1_DOCUMENT))
+    storage = SQLiteStorage(str(tmp_path / "autodelete.db"), legacy_json_path=str(legacy))
+    check_v1_load(storage.load())
+    storage.add_deleted_messages([(100, 1, 3)])
+    storage.close()
+
+    # Reopening doesn't import the file again on top of the database.
+    storage = SQLiteStorage(str(tmp_path / "autodelete.db"), legacy_json_path=str(legacy))
+    tasks, roles, counts, _ = storage.load()
+    assert counts == {100: 10, 300: 2}
+    assert roles == {1: [11, 12]}
+    storage.close()
+
+
+def test_failed_import_leaves_the_database_new(tmp_path):
+    legacy = tmp_path / "autodelete_config.json"
+    legacy.write_text("{not json")
+    path = str(tmp_path / "autodelete.db")
+    storage = SQLiteStorage(path, legacy_json_path=str(legacy))
+    with pytest.raises(json.JSONDecodeError):
+        storage.load()
+    storage.close()
+    db = sqlite3.connect(path)
+    assert db.execute("PRAGMA user_version").fetchone()[0] == 0
+    assert db.execute("SELECT name FROM sqlite_master").fetchall() == []
+    db.close()
+
+    # Once the file is fixed, the next start imports it.
+    legacy.write_text(json.dumps(V1_DOCUMENT))
+    storage = SQLiteStorage(path, legacy_json_path=str(legacy))
+    check_v1_load(storage.load())
+    storage.close()
+
+
+class FlakyStorage:
+    def __init__(self):
+        self.fail = True
+        self.rows = []
+
+    async def call(self, method, *args):
+        return method(*args)
+
+    def add_deleted_messages(self, counts):
+        if self.fail:
+            raise OSError("disk full")
+        self.rows.extend(counts)
+
+
+def test_counter_flush_failure_keeps_the_increments():
+    async def main():
+        storage = FlakyStorage()
+        counters = CounterBuffer(storage, interval=60, threshold=1000)
+        counters.add(1, 10, 3)
+        counters.add(2, 10, 1)
+        with pytest.raises(OSError):
+            await counters.flush()
+        counters.add(1, 10, 2)
+        assert counters.pending == {1: [10, 5], 2: [10, 1]}
+        assert counters.increments == 3
+        storage.fail = False
+        await counters.flush()
+        return storage.rows, counters
+
+    rows, counters = asyncio.run(main())
+    assert sorted(rows) == [(1, 10, 5), (2, 10, 1)]
+    assert counters.pending == {}
+    assert counters.absorbed == 3
+
+
+def test_failed_early_flush_is_logged(caplog):
+    async def main():
+        counters = CounterBuffer(FlakyStorage(), interval=60, threshold=2)
+        counters.add(1, 10, 1)
+        counters.add(1, 10, 1)
+        await asyncio.wait([counters._early_flush])
+        await asyncio.sleep(0)
+        return counters
+
+    with caplog.at_level(logging.ERROR, logger="autodelete"):
+        counters = asyncio.run(main())
+    assert counters.pending == {1: [10, 2]}
+    assert [record.getMessage() for record in caplog.records] == [
+        "Failed to flush deleted message counters"
+    ]
+
+
+def test_close_shuts_down_when_the_final_flush_fails(run_bot):
+    async def scenario(world):
+        bot = world.bot
+        bot.counters.add(1, 10, 1)
+        add_deleted_messages = bot.storage.add_deleted_messages
+        bot.storage.add_deleted_messages = FlakyStorage().add_deleted_messages
+        with pytest.raises(OSError):
+            await bot.close()
+        assert bot.is_closed()
+        bot.storage.add_deleted_messages = add_deleted_messages
+        return bot
+
+    assert run_bot(scenario).is_closed()
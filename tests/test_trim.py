@@ -0,0 +1,199 @@
+import asyncio
+import datetime
+import gzip
+
+import discord
+
+import autodelete
+import fakes
+from archive import RECORD_MARGIN
+from bench_autodelete import add_task, drain
+
+
+def test_trim_brings_channel_to_its_limit(run_bot):
+    async def scenario(world):
+        channel = world.channel(world.guild())
+        world.fill(channel, 300, old_fraction=0.5, pinned_every=10)
+        await add_task(world, channel, 20)
+        await autodelete.on_message(world.post(channel))
+        await drain(world.bot)
+        return channel, world
+
+    channel, world = run_bot(scenario)
+    unpinned = [message for message in channel.messages.values() if not message.pinned]
+    assert len(unpinned) == 20
+    assert sum(message.pinned for message in channel.messages.values()) == 30
+    assert world.bot.deleted_message_count[channel.id] == 301 - 50
+
+
+def test_messages_sent_while_seeding_are_counted(run_bot):
+    async def scenario(world):
+        channel = world.channel(world.guild())
+        world.fill(channel, 1000)
+        await add_task(world, channel, 10)
+        seeding = asyncio.create_task(world.bot.seed_window(channel))
+        for _ in range(5):
+            await asyncio.sleep(0.006)
+            await autodelete.on_message(world.post(channel))
+        assert not seeding.done()
+        await seeding
+        await drain(world.bot)
+        return channel, world.bot.windows[channel.id]
+
+    channel, window = run_bot(scenario, latency=0.005)
+    assert len(channel.messages) == 10
+    assert list(window.entries) == sorted(channel.messages)
+
+
+def test_replacing_a_task_with_other_rules_reseeds(run_bot):
+    async def scenario(world):
+        guild = world.guild()
+        channel = world.channel(guild)
+        world.fill(channel, 20)
+        rules = autodelete.TaskRules(exempt_users=[world.member.id])
+        await add_task(world, channel, 5, rules=rules)
+        await autodelete.on_message(world.post(channel))
+        await drain(world.bot)
+        assert len(channel.messages) == 21
+        await autodelete.add.callback(world.interaction(guild), channel, 5)
+        await drain(world.bot)
+        await autodelete.on_message(world.post(channel))
+        await drain(world.bot)
+        return channel
+
+    assert len(run_bot(scenario).messages) == 5
+
+
+def test_single_deletes_are_counted_when_a_later_one_fails(run_bot):
+    class FailingMessage(fakes.FakePartialMessage):
+        calls = 0
+
+        async def delete(self):
+            FailingMessage.calls += 1
+            if FailingMessage.calls == 4:
+                raise discord.HTTPException(fakes.FakeResponse(500), "Internal Server Error")
+            await super().delete()
+
+    async def scenario(world):
+        channel = world.channel(world.guild())
+        world.fill(channel, 10, old_fraction=1.0)
+        await add_task(world, channel, 0)
+        channel.get_partial_message = lambda message_id: FailingMessage(channel, message_id)
+        deleted_before = autodelete.DELETED_MESSAGES.value
+        try:
+            await world.bot.delete_messages(channel, sorted(channel.messages))
+        except discord.HTTPException:
+            pass
+        return (
+            world.bot.deleted_message_count.get(channel.id),
+            autodelete.DELETED_MESSAGES.value - deleted_before,
+        )
+
+    assert run_bot(scenario) == (3, 3)
+
+
+def test_archive_keeps_few_records_and_reads_the_rest_back(run_bot):
+    async def scenario(world):
+        world.bot.archive.start()
+        guild = world.guild()
+        channel = world.channel(guild)
+        world.fill(channel, 1000, old_fraction=0.1)
+        await add_task(world, channel, 10, archive=True)
+        await world.bot.seed_window(channel)
+        kept = len(world.bot.archive.records[channel.id])
+        await autodelete.on_message(world.post(channel))
+        await drain(world.bot)
+        await world.bot.archive.close()
+        segments = await world.bot.archive.segments(guild.id, channel.id)
+        lines = sum(1 for path in segments for _ in gzip.open(path))
+        return kept, len(channel.messages), world.bot.archive.archived, lines
+
+    kept, remaining, archived, lines = run_bot(scenario)
+    assert kept == 10 + RECORD_MARGIN
+    assert remaining == 10
+    assert archived == lines == 991
+
+
+def test_messages_held_back_by_min_age_are_trimmed_later(run_bot):
+    async def scenario(world):
+        channel = world.channel(world.guild())
+        for index in range(20):
+            age = datetime.timedelta(seconds=59.5 - index * 0.01)
+            channel.add(fakes.FakeMessage(world.snowflakes(age), channel, world.member))
+        await add_task(world, channel, 5, rules=autodelete.TaskRules(min_age=1))
+        await autodelete.on_message(world.post(channel))
+        await drain(world.bot)
+        # Nothing is old enough yet; a trim is due once the oldest is.
+        assert len(channel.messages) == 21
+        assert channel.id in world.bot.held_back
+        for _ in range(50):
+            if len(channel.messages) == 5:
+                break
+            await asyncio.sleep(0.1)
+        await drain(world.bot)
+        return channel, world.bot.held_back
+
+    channel, held_back = run_bot(scenario)
+    assert len(channel.messages) == 5
+    assert channel.id not in held_back
+
+
+def test_reconnect_only_reads_messages_posted_since(run_bot):
+    async def scenario(world):
+        channel = world.channel(world.guild())
+        world.fill(channel, 250)
+        await add_task(world, channel, 280)
+        await world.bot.seed_window(channel)
+        # Posted while the bot was disconnected; a new session doesn't
+        # replay them.
+        for _ in range(50):
+            world.post(channel)
+        world.bot.ready_count = 1
+        world.api.reset()
+        await autodelete.on_ready()
+        await world.bot.reconcile_task
+        await drain(world.bot)
+        return channel, world.bot.windows[channel.id], world.api.calls
+
+    channel, window, calls = run_bot(scenario)
+    assert calls["history"] == 1
+    assert len(channel.messages) == 280
+    assert list(window.entries) == sorted(channel.messages)
+
+
+def test_history_pages_are_counted_as_they_are_fetched(run_bot):
+    async def scenario(world):
+        world.bot.archive.start()
+        channel = world.channel(world.guild())
+        world.fill(channel, 1000)
+        # Pinned messages stay, so archive reads skip over most of the
+        # messages they fetch.
+        for index, message in enumerate(channel.messages.values()):
+            message.pinned = index % 4 != 0
+        await add_task(world, channel, 10, archive=True)
+        world.api.reset()
+        before = autodelete.HISTORY_PAGES.value
+        await world.bot.seed_window(channel)
+        await autodelete.on_message(world.post(channel))
+        await drain(world.bot)
+        await world.bot.archive.close()
+        return autodelete.HISTORY_PAGES.value - before, world.api.calls["history"]
+
+    pages, requests = run_bot(scenario)
+    assert pages == requests > 11
+
+
+def test_coalesced_trim_requests_are_counted(run_bot):
+    async def scenario(world):
+        channel = world.channel(world.guild())
+        await add_task(world, channel, 10)
+        world.bot.trim_scheduler.debounce = 0.05
+        before = autodelete.TRIM_COALESCED.value
+        for _ in range(3):
+            await autodelete.on_message(world.post(channel))
+        await drain(world.bot)
+        return autodelete.TRIM_COALESCED.value - before, autodelete.metrics.render()
+
+    coalesced, rendered = run_bot(scenario)
+    assert coalesced == 2
+    assert "autodelete_trim_coalesced_total" in rendered
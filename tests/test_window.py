@@ -0,0 +1,68 @@
+from autodelete import MessageWindow, SeedBuffer
+from models import ChannelTask
+
+
+def keeps_pins(pinned, bot_embed, exempt):
+    return pinned or exempt
+
+
+def test_count_skips_kept_messages():
+    window = MessageWindow()
+    window.add(1)
+    window.add(2, pinned=True)
+    window.add(3, exempt=True)
+    window.add(4, bot_embed=True)
+    assert len(window) == 4
+    assert window.count(keeps_pins) == 2
+    assert window.count(ChannelTask(1, 1, 10, pins=True).keeps) == 2
+    assert window.count(ChannelTask(1, 1, 10, pins=True, embeds=True).keeps) == 3
+
+
+def test_update_and_remove_move_counts():
+    window = MessageWindow()
+    window.add(1)
+    window.add(2)
+    window.update(1, pinned=True)
+    assert window.count(keeps_pins) == 1
+    window.update(99, pinned=True)
+    window.remove(2)
+    window.remove(2)
+    assert window.count(keeps_pins) == 0
+    assert list(window.entries) == [1]
+
+
+def test_overflow_is_oldest_countable_first():
+    window = MessageWindow()
+    for message_id in range(1, 11):
+        window.add(message_id, pinned=message_id == 2)
+    assert window.overflow(10, keeps_pins) == []
+    assert window.overflow(5, keeps_pins) == [1, 3, 4, 5]
+    # Messages from ``before`` on are too young to go yet.
+    assert window.overflow(5, keeps_pins, before=4) == [1, 3]
+
+
+def test_out_of_order_add_keeps_window_sorted():
+    window = MessageWindow()
+    for message_id in (5, 7, 6, 1):
+        window.add(message_id)
+    assert list(window.entries) == [1, 5, 6, 7]
+    assert window.overflow(2, keeps_pins) == [1, 5]
+
+
+def test_seed_buffer_overlays_events_on_the_scan():
+    scanned = MessageWindow()
+    for message_id in (1, 2, 3):
+        scanned.add(message_id)
+    buffer = SeedBuffer()
+    buffer.update(2, pinned=True)
+    buffer.add(4)
+    buffer.add(5)
+    buffer.update(5, exempt=True)
+    buffer.remove(3)
+    buffer.remove(4)
+    buffer.apply(scanned)
+    assert scanned.entries == {
+        1: (False, False, False),
+        2: (True, False, False),
+        5: (False, False, True),
+    }